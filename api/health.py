@@ -0,0 +1,169 @@
+"""
+Reachability of the configured sinks.
+
+Each sink host is probed with a short TCP connect (through the https proxy if one
+is configured) and the result is cached for a while. Every destination (sink and
+webhook url, or channel of the Slack app) also has a circuit breaker: after
+repeated failures it is opened and skipped immediately, until a cool down passes
+and a single trial is allowed again (half open). The trial is claimed by one
+caller, others skip the destination until its result is recorded.
+
+State is kept in `health.json`, so it also holds across the hourly runs.
+
+"""
+
+import json
+import socket
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+from urllib.request import getproxies, proxy_bypass
+
+from core import ROOT
+from core.log_me import logMessage
+from core.utils import writeFileAtomic
+from . import slack
+
+HEALTH_FILE = ROOT + "health.json"
+
+PROBE_TIMEOUT = 3
+"""Seconds to wait for a probe connection."""
+CACHE_TTL = 300
+"""Seconds a probe result is trusted."""
+FAILURE_THRESHOLD = 3
+"""Consecutive failures that open the circuit of a sink."""
+OPEN_SECONDS = 900
+"""Seconds an open circuit skips the sink before a trial is allowed."""
+TRIAL_SECONDS = 120
+"""Seconds after which a half open trial without recorded result is claimable again."""
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_lock = threading.Lock()
+_state: Optional[Dict[str, dict]] = None
+
+
+def _load() -> Dict[str, dict]:
+    global _state
+    if _state is None:
+        try:
+            with open(HEALTH_FILE, "r") as f:
+                _state = json.load(f)
+        except FileNotFoundError:
+            _state = {}
+        except Exception as e:
+            logMessage(f"Failed to load sink health state.\n{e}")
+            _state = {}
+    return _state
+
+
+def _save() -> None:
+    try:
+        writeFileAtomic(HEALTH_FILE, json.dumps(_state, indent=2).encode())
+    except Exception as e:
+        logMessage(f"Failed to save sink health state.\n{e}")
+
+
+def _entry(sink: str, url: str) -> dict:
+    return _load().setdefault(
+        f"{sink} {url}",
+        {
+            "state": CLOSED,
+            "failures": 0,
+            "opened_at": 0,
+            "checked_at": 0,
+            "up": True,
+            "trial_at": 0,
+        },
+    )
+
+
+def sink_address(sink: str, url: str) -> Tuple[str, int]:
+    """Host and port the sink sends to."""
+
+    if sink == "slack_api":
+        url = slack.API_URL
+    parsed = urlparse(url)
+    return parsed.hostname, parsed.port or (443 if parsed.scheme == "https" else 80)
+
+
+def probe(host: str, port: int, timeout: float = PROBE_TIMEOUT) -> bool:
+    """Whether a connection can be made to the host (or the proxy to it)."""
+
+    proxy = getproxies().get("https")
+    if proxy and not proxy_bypass(host):
+        parsed = urlparse(proxy if "://" in proxy else f"http://{proxy}")
+        host, port = parsed.hostname, parsed.port or 8080
+
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def _record(sink: str, url: str, entry: dict, ok: bool, now: float) -> None:
+    entry["trial_at"] = 0
+    if ok:
+        entry["up"] = True
+        entry["checked_at"] = now
+        entry["state"] = CLOSED
+        entry["failures"] = 0
+        return
+
+    entry["failures"] += 1
+    if entry["state"] == HALF_OPEN or entry["failures"] >= FAILURE_THRESHOLD:
+        if entry["state"] != OPEN:
+            # Host only, webhook urls hold their token
+            host = sink_address(sink, url)[0]
+            logMessage(
+                f"Sink {sink} ({host}) is unreachable, skipping it.",
+                "warning",
+                sink=sink,
+            )
+        entry["state"] = OPEN
+        entry["opened_at"] = now
+
+
+def is_available(sink: str, url: str) -> bool:
+    """Whether a report should be sent to the destination now.
+
+    Open circuits answer immediately, otherwise a cached probe result is used
+    or the sink host is probed. Once an open circuit cooled down, only the
+    caller claiming the trial gets `True`, until `record_result`. A probe never
+    changes the circuit, only the sends recorded with `record_result` do.
+    """
+
+    now = time.time()
+    with _lock:
+        entry = _entry(sink, url)
+        if entry["state"] == OPEN:
+            if now - entry["opened_at"] < OPEN_SECONDS:
+                return False
+            entry["state"] = HALF_OPEN
+        elif entry["state"] != HALF_OPEN and now - entry["checked_at"] < CACHE_TTL:
+            return entry["up"]
+        if entry["state"] == HALF_OPEN:
+            if now - entry.get("trial_at", 0) < TRIAL_SECONDS:
+                return False  # Trial claimed by another caller
+            entry["trial_at"] = now
+
+    up = probe(*sink_address(sink, url))
+
+    # The probe only tells if the host answers, the circuit follows the sends
+    with _lock:
+        entry["up"] = up
+        entry["checked_at"] = time.time()
+        _save()
+    return up
+
+
+def record_result(sink: str, url: str, ok: bool) -> None:
+    """Feed the outcome of a send into the circuit of the destination."""
+
+    with _lock:
+        _record(sink, url, _entry(sink, url), ok, time.time())
+        _save()
@@ -0,0 +1,83 @@
+"""
+Live message of a unit, one message per production day edited in place.
+
+Slack (app) messages are pinned in the channel, Discord webhook messages are
+edited through the webhook. Google Chat webhooks cannot edit, so they are not
+part of the live mode.
+
+"""
+
+import datetime
+import json
+from typing import Optional
+
+from core.log_me import logMessage
+from core.settings import Sinks
+from core.utils import stateDir, writeFileAtomic
+from .slack import slack_message, slack_unpin
+from .web_api import discord_message
+
+LIVE_FILE = "live.json"
+"""Message ids of the day, inside the state folder of the unit."""
+
+
+class LiveBoard:
+    """The live messages of a unit for the current production day."""
+
+    def __init__(self, unit: str, sinks: Sinks):
+        self.path = stateDir(unit) + LIVE_FILE
+        self.sinks = sinks
+        self.day: Optional[str] = None
+        self.discord = {}
+        """Message id by webhook url."""
+        self.slack_ts: Optional[str] = None
+        self._load()
+
+    def __bool__(self) -> bool:
+        return bool(self.sinks.discord or self.sinks.slack_token)
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            self.day = data["day"]
+            self.discord = data.get("discord", {})
+            self.slack_ts = data.get("slack_ts")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logMessage(f"Failed to load live message state.\n{e}")
+
+    def _save(self) -> None:
+        data = {"day": self.day, "discord": self.discord, "slack_ts": self.slack_ts}
+        try:
+            writeFileAtomic(self.path, json.dumps(data).encode())
+        except Exception as e:
+            logMessage(f"Failed to save live message state.\n{e}")
+
+    def publish(self, day: datetime.datetime, discord: dict, slack: dict) -> None:
+        """Edit the messages of the day, new messages are posted on a new day."""
+
+        if self.day != day.isoformat():
+            if self.slack_ts and self.sinks.slack_token:
+                slack_unpin(
+                    self.sinks.slack_token, self.sinks.slack_channel, self.slack_ts
+                )
+            self.day = day.isoformat()
+            self.discord = {}
+            self.slack_ts = None
+
+        for url in self.sinks.discord:
+            message_id = discord_message(url, discord, self.discord.get(url))
+            if message_id:
+                self.discord[url] = message_id
+
+        if self.sinks.slack_token:
+            self.slack_ts = slack_message(
+                self.sinks.slack_token,
+                self.sinks.slack_channel,
+                ts=self.slack_ts,
+                **slack,
+            )
+
+        self._save()
@@ -0,0 +1,291 @@
+"""
+Durable outbox for rendered reports.
+
+Every payload is written to `outbox/` before it is sent and removed once it is
+delivered, so a report is never lost to a network failure. Undelivered entries
+are retried by `drain` with exponential backoff (or the server's `Retry-After`).
+
+Hourly reports carry day-to-date figures, so for a destination only the newest
+undelivered hourly report is worth sending: older ones are dropped and a single
+catch-up message goes out, within the hour it was made. Once the next hour has
+started it is no longer the last hour (and may even be of the previous production
+day), so it is dropped as well. Summaries are always delivered.
+
+"""
+
+import datetime
+import glob
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from core import ROOT, metrics
+from core.log_me import logMessage
+from core.settings import slackToken
+from core.utils import writeFileAtomic
+from . import health
+from .slack import slack_api
+from .web_api import SendResult, dispatch, webhook_request
+
+OUTBOX_DIR = ROOT + "outbox/"
+
+BACKOFF_BASE = 60
+"""Seconds to wait after the first failure, doubled on every next failure."""
+BACKOFF_MAX = 3600
+MAX_AGE = datetime.timedelta(days=2)
+"""Undelivered entries older than this are dropped."""
+CLAIM_TIMEOUT = 600
+"""Seconds after which an entry claimed by a crashed process is released."""
+
+SENDING = ".sending"
+
+DRAIN_WORKERS = 2
+DRAIN_EXECUTOR = ThreadPoolExecutor(
+    max_workers=DRAIN_WORKERS,
+    thread_name_prefix="drain",
+    initializer=metrics.markBackground,
+    initargs=("drain",),
+)
+"""Retries run apart from `web_api.EXECUTOR`, a report never waits behind them."""
+
+
+def _encode(entry: dict) -> bytes:
+    return json.dumps(entry).encode()
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now()
+
+
+def enqueue(
+    sink: str, url: str, payload: dict, kind: str = "hourly", claim: bool = False
+) -> Tuple[str, dict]:
+    """Save the payload in the outbox, returns the entry path and entry.
+
+    `url` is the webhook url, or the channel id for the `slack_api` sink. A
+    claimed entry is not picked by `drain` until it is released.
+    """
+
+    now = _now()
+    entry = {
+        "sink": sink,
+        "url": url,
+        "payload": payload,
+        "kind": kind,
+        "created": now.isoformat(),
+        "attempts": 0,
+        "next_attempt": now.isoformat(),
+    }
+    os.makedirs(OUTBOX_DIR, exist_ok=True)
+    name = f"{now:%Y%m%d%H%M%S}_{sink}_{uuid.uuid4().hex[:8]}.json"
+    path = OUTBOX_DIR + name + (SENDING if claim else "")
+    writeFileAtomic(path, _encode(entry))
+    return path, entry
+
+
+def _send(entry: dict) -> SendResult:
+    if entry["sink"] == "slack_api":
+        token = slackToken(entry["url"])
+        if not token:
+            return SendResult(False)
+        return slack_api(
+            token, entry["url"], **entry["payload"], kind=entry.get("kind", "hourly")
+        )
+    return webhook_request(entry["url"], entry["payload"], entry["sink"])
+
+
+def _release(path: str, entry: dict, result: SendResult) -> None:
+    """Put a failed entry back in the outbox with its next attempt time."""
+
+    entry["attempts"] += 1
+    delay = min(BACKOFF_BASE * 2 ** (entry["attempts"] - 1), BACKOFF_MAX)
+    if result.retry_after:
+        delay = max(delay, result.retry_after)
+    entry["next_attempt"] = (_now() + datetime.timedelta(seconds=delay)).isoformat()
+    writeFileAtomic(path, _encode(entry))
+    os.replace(path, path[: -len(SENDING)])
+
+
+def _deliver(path: str, entry: dict) -> bool:
+    """Send a claimed entry, remove it if delivered or release it otherwise."""
+
+    t0 = time.perf_counter()
+    result = _send(entry)
+    metrics.record(
+        "send",
+        time.perf_counter() - t0,
+        sink=entry["sink"],
+        status=result.status or ("ok" if result.ok else "error"),
+    )
+    if result.status is None or result.status >= 500:
+        health.record_result(entry["sink"], entry["url"], result.ok)
+    elif result.status != 429:
+        # Reached the server, even if the request was rejected
+        health.record_result(entry["sink"], entry["url"], True)
+
+    if result.ok:
+        os.remove(path)
+        _drop_superseded(entry)
+    else:
+        _release(path, entry, result)
+    return result.ok
+
+
+def send(sink: str, url: str, payload: dict, kind: str = "hourly") -> bool:
+    """Save the payload in the outbox and try to deliver it right away."""
+
+    try:
+        path, entry = enqueue(sink, url, payload, kind, claim=True)
+    except Exception as e:
+        logMessage(f"Failed to save {sink} report in outbox\n{e}", sink=sink)
+        return _send({"sink": sink, "url": url, "payload": payload, "kind": kind}).ok
+
+    if not health.is_available(sink, url):
+        # Known to be unreachable, keep it for a later drain
+        _release(path, entry, SendResult(False))
+        return False
+    return _deliver(path, entry)
+
+
+def _claim(path: str) -> Optional[Tuple[str, dict]]:
+    """Take the entry for sending, `None` if another process took it first."""
+
+    claimed = path + SENDING
+    try:
+        os.rename(path, claimed)
+        with open(claimed, "rb") as f:
+            return claimed, json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _entries(pattern: str = "*.json") -> List[Tuple[str, dict]]:
+    entries = []
+    for path in sorted(glob.glob(OUTBOX_DIR + pattern)):
+        try:
+            with open(path, "rb") as f:
+                entries.append((path, json.load(f)))
+        except FileNotFoundError:
+            pass  # Claimed meanwhile
+        except Exception as e:
+            logMessage(f"Removing unreadable outbox entry {path}\n{e}")
+            os.remove(path)
+    return entries
+
+
+def _drop_superseded(delivered: dict) -> None:
+    """Remove the older hourly entries of a destination that just got a newer one."""
+
+    if delivered["kind"] != "hourly":
+        return
+    for path, entry in _entries():
+        if (
+            entry["kind"] == "hourly"
+            and (entry["sink"], entry["url"]) == (delivered["sink"], delivered["url"])
+            and entry["created"] < delivered["created"]
+            and _claim(path)
+        ):
+            os.remove(path + SENDING)
+
+
+def _release_abandoned() -> None:
+    """Entries claimed by a process that crashed while sending."""
+
+    for path in glob.glob(OUTBOX_DIR + "*.json" + SENDING):
+        try:
+            if time.time() - os.path.getmtime(path) > CLAIM_TIMEOUT:
+                os.replace(path, path[: -len(SENDING)])
+        except FileNotFoundError:
+            pass
+
+
+def drain() -> int:
+    """Retry the undelivered entries that are due, returns the number delivered.
+
+    For every destination, hourly entries are collapsed into the newest one,
+    dropped if made before the current hour. Destinations are sent in parallel.
+    """
+
+    _release_abandoned()
+    now = _now()
+    hour_start = now.replace(minute=0, second=0, microsecond=0)
+
+    destinations: Dict[Tuple[str, str], List[Tuple[str, dict]]] = {}
+    for path, entry in _entries():
+        created = datetime.datetime.fromisoformat(entry["created"])
+        if now - created > MAX_AGE:
+            logMessage(
+                f"Dropping undelivered {entry['sink']} report {path}",
+                "warning",
+                sink=entry["sink"],
+            )
+            os.remove(path)
+            continue
+        if entry["kind"] == "hourly" and created < hour_start:
+            # Not the last hour anymore, would be shown as current
+            logMessage(
+                f"Dropping stale {entry['sink']} hourly report {path}",
+                "warning",
+                sink=entry["sink"],
+            )
+            if _claim(path):
+                os.remove(path + SENDING)
+            continue
+        destinations.setdefault((entry["sink"], entry["url"]), []).append((path, entry))
+
+    batches = []
+    for (sink, url), entries in destinations.items():
+        hourly = [e for e in entries if e[1]["kind"] == "hourly"]
+        due = [e for e in entries if e[1]["kind"] != "hourly"]
+        if hourly:
+            # Latest figures only, older hourly reports are superseded
+            for path, _ in hourly[:-1]:
+                if _claim(path):
+                    os.remove(path + SENDING)
+            due.append(hourly[-1])
+        due = [
+            e
+            for e in due
+            if datetime.datetime.fromisoformat(e[1]["next_attempt"]) <= now
+        ]
+        due.sort(key=lambda e: e[1]["created"])
+        if due:
+            batches.append(due)
+
+    delivered = []
+
+    def deliver_batch(entries):
+        sink, url = entries[0][1]["sink"], entries[0][1]["url"]
+        if not health.is_available(sink, url):
+            return
+        for path, _ in entries:
+            claimed = _claim(path)
+            if claimed is None:
+                continue
+            if not _deliver(*claimed):
+                break  # Destination still failing, keep the order
+            delivered.append(path)
+
+    dispatch(
+        (lambda batch=batch: deliver_batch(batch) for batch in batches),
+        DRAIN_EXECUTOR,
+    )
+    return len(delivered)
+
+
+def drain_forever(interval: float = 60) -> None:
+    """Keep draining the outbox, meant for a background thread.
+
+    Its send timings are kept apart from the runs (see `core/metrics.py`).
+    """
+
+    while True:
+        with metrics.background("drain"):
+            try:
+                drain()
+            except Exception as e:
+                logMessage(f"Outbox drain failed.\n{e}")
+        time.sleep(interval)
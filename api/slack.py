@@ -0,0 +1,303 @@
+"""
+Slack app (bot token) messages.
+
+One `WebClient` is kept per token. Every call goes through a shared rate limiter
+(a token bucket a bit under Slack's tier 3, ~50 calls a minute with bursts), a
+429 answer pauses all calls for its `Retry-After` and the call is retried.
+
+The ts of every hourly message is kept in `slack_ts.json` (per channel, in the
+state folder), at summary time they are deleted in parallel.
+
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from core import ROOT, settings
+from core.filelock import FileLock
+from core.log_me import logMessage
+from core.utils import writeFileAtomic
+from .web_api import SendResult, _retry_after
+
+if TYPE_CHECKING:
+    from slack_sdk import WebClient
+
+API_URL = "https://slack.com/api/"
+
+TS_FILE = ROOT + "slack_ts.json"
+"""Hourly message ts per channel, deleted at summary time."""
+LEGACY_TS_FILES = ("slack_ts.txt", ROOT + "slack_ts.txt")
+"""Previous ts file, relative to the working directory of the run."""
+
+RATE_PER_MINUTE = 45
+"""Calls per minute, under the tier 3 limit (chat.delete, chat.update, pins)."""
+BURST = 10
+DELETE_WORKERS = 4
+MAX_RETRIES = 3
+"""Retries of a call answered with 429."""
+
+CLIENTS: Dict[str, "WebClient"] = {}
+CLIENTS_LOCK = threading.Lock()
+
+
+class RateLimiter:
+    """Token bucket shared by the threads calling the Slack api."""
+
+    def __init__(self, rate_per_minute: float, burst: int):
+        self.interval = 60 / rate_per_minute
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Wait for a free call."""
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated) / self.interval
+                )
+                self._updated = now
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) * self.interval
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """No calls for `seconds` (rate limited by the server)."""
+
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+
+LIMITER = RateLimiter(RATE_PER_MINUTE, BURST)
+
+
+def slack_client(token: str) -> "WebClient":
+    """Returns the client of the token, created on first use."""
+
+    with CLIENTS_LOCK:
+        client = CLIENTS.get(token)
+        if client is None:
+            from slack_sdk import WebClient
+
+            client = WebClient(
+                token=token,
+                base_url=API_URL,
+                timeout=int(sum(settings.WEBHOOK_TIMEOUT)),
+            )
+            CLIENTS[token] = client
+    return client
+
+
+def call(token: str, method: str, **kwargs):
+    """Call a `WebClient` method within the rate limit, retrying on 429."""
+
+    from slack_sdk.errors import SlackApiError
+
+    client = slack_client(token)
+    for attempt in range(MAX_RETRIES + 1):
+        LIMITER.acquire()
+        try:
+            return getattr(client, method)(**kwargs)
+        except SlackApiError as e:
+            if e.response.status_code != 429 or attempt == MAX_RETRIES:
+                raise
+            LIMITER.pause(_retry_after(e.response.headers) or 1)
+
+
+def _loadTs() -> Dict[str, List[str]]:
+    try:
+        with open(TS_FILE, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logMessage(f"Failed to load slack message ts.\n{e}")
+    return {}
+
+
+def _saveTs(data: Dict[str, List[str]]) -> None:
+    writeFileAtomic(TS_FILE, json.dumps(data).encode())
+
+
+def _legacyTs() -> List[str]:
+    """Ts of the previous `slack_ts.txt` file, the file is removed."""
+
+    ts = []
+    for path in LEGACY_TS_FILES:
+        try:
+            with open(path, "r") as f:
+                ts += [line for line in f.read().split("\n") if line.strip()]
+            os.remove(path)
+        except OSError:
+            pass
+    return ts
+
+
+def _lock() -> FileLock:
+    return FileLock(ROOT + "slack_ts.lock")
+
+
+def record_ts(channel_id: str, ts: str) -> None:
+    """Keep the ts of an hourly message, for the summary cleanup."""
+
+    with _lock():
+        data = _loadTs()
+        data.setdefault(channel_id, []).append(ts)
+        _saveTs(data)
+
+
+def delete_messages(token: str, channel_id: str, ts_list: List[str]) -> List[str]:
+    """Delete the messages in parallel, returns the ts that could not be deleted."""
+
+    from slack_sdk.errors import SlackApiError
+
+    def delete(ts: str) -> bool:
+        try:
+            call(token, "chat_delete", channel=channel_id, ts=ts)
+            return True
+        except SlackApiError as e:
+            # Already deleted, nothing left to do
+            return e.response.get("error") == "message_not_found"
+        except Exception:
+            return False
+
+    with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as executor:
+        deleted = list(executor.map(delete, ts_list))
+    return [ts for ts, ok in zip(ts_list, deleted) if not ok]
+
+
+def cleanup(token: str, channel_id: str) -> None:
+    """Delete the hourly messages of the channel, failed ones are kept for later."""
+
+    with _lock():
+        data = _loadTs()
+        ts_list = data.pop(channel_id, []) + _legacyTs()
+        _saveTs(data)
+
+    failed = delete_messages(token, channel_id, ts_list)
+    if failed:
+        logMessage(
+            f"Failed to delete {len(failed)} slack messages, retrying later.",
+            "warning",
+            sink="slack_api",
+        )
+        with _lock():
+            data = _loadTs()
+            data[channel_id] = failed + data.get(channel_id, [])
+            _saveTs(data)
+
+
+def slack_api(
+    token: str,
+    channel_id: str,
+    text: str,
+    blocks: list,
+    summary: Optional[str] = None,
+    kind: str = "hourly",
+) -> SendResult:
+    """Post the report, a summary is replied in its thread and clears the hourly ones.
+
+    Only the ts of `hourly` reports are kept for the cleanup, other kinds (stall
+    alerts) stay in the channel.
+    """
+
+    from slack_sdk.errors import SlackApiError
+
+    try:
+        res = call(
+            token, "chat_postMessage", channel=channel_id, text=text, blocks=blocks
+        )
+    except SlackApiError as e:
+        logMessage(f"Failed to send to Slack client\n{e}", sink="slack_api")
+        return SendResult(
+            False, e.response.status_code, _retry_after(e.response.headers)
+        )
+    except Exception as e:
+        logMessage(
+            f"Slack App execution failure, please report..\n{e}", sink="slack_api"
+        )
+        return SendResult(False)
+
+    # Report is delivered, failures below are only logged
+    thread_id = res.data.get("ts", None)
+    try:
+        if summary:
+            if thread_id:
+                call(
+                    token,
+                    "chat_postMessage",
+                    channel=channel_id,
+                    text=summary,
+                    thread_ts=thread_id,
+                )
+                cleanup(token, channel_id)
+        elif thread_id and kind == "hourly":
+            record_ts(channel_id, thread_id)
+    except Exception as e:
+        logMessage(
+            f"Slack App execution failure, please report..\n{e}", sink="slack_api"
+        )
+
+    return SendResult(True, res.status_code)
+
+
+def slack_message(
+    token: str, channel_id: str, text: str, blocks: list, ts: Optional[str] = None
+) -> Optional[str]:
+    """Post a message and pin it, or edit it if `ts` is given.
+
+    Returns the message ts, `None` if the request failed.
+    """
+
+    from slack_sdk.errors import SlackApiError
+
+    try:
+        if ts:
+            try:
+                call(
+                    token,
+                    "chat_update",
+                    channel=channel_id,
+                    ts=ts,
+                    text=text,
+                    blocks=blocks,
+                )
+                return ts
+            except SlackApiError as e:
+                if e.response.get("error") != "message_not_found":
+                    raise
+        res = call(
+            token, "chat_postMessage", channel=channel_id, text=text, blocks=blocks
+        )
+        ts = res.data.get("ts")
+        call(token, "pins_add", channel=channel_id, timestamp=ts)
+        return ts
+    except SlackApiError as e:
+        logMessage(f"Failed to send Slack live message\n{e}", sink="slack_api")
+    except Exception as e:
+        logMessage(
+            f"Slack live message failure, please report..\n{e}", sink="slack_api"
+        )
+    return ts
+
+
+def slack_unpin(token: str, channel_id: str, ts: str) -> None:
+    """Remove a message from the pins of the channel."""
+
+    try:
+        call(token, "pins_remove", channel=channel_id, timestamp=ts)
+    except Exception as e:
+        logMessage(f"Failed to unpin Slack message\n{e}", "warning", sink="slack_api")
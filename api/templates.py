@@ -9,13 +9,15 @@ Message templates for each webhooks/apis.
 """
 
 import random
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, List
 
-from core.settings import DISPLAY_HOUR_COUNT
+from core import settings
 
 
 if TYPE_CHECKING:
-    from core.production import Production
+    from core.breakdown import Ranking
+    from core.production import HourlyStats, Production
+    from core.watchdog import StallEvent
 
 
 def randomColor() -> int:
@@ -32,14 +34,108 @@ def randomColor() -> int:
         "orange": 15105570,
         "blue": 3447003,
     }
-    return random.random.choice(discord_colors.values())
+    return random.choice(list(discord_colors.values()))
 
 
-def discord_template(prod: "Production", average: int, summary: dict = None) -> dict:
+def label_slack_message(msg: dict, unit: str) -> dict:
+    """Mark a slack message with the unit it reports (multi unit mode)."""
+
+    msg["text"] = f"{unit} | {msg['text']}"
+    msg["blocks"].insert(
+        0, {"type": "context", "elements": [{"type": "mrkdwn", "text": f"*{unit}*"}]}
+    )
+    return msg
+
+
+def vs_typical(value: int, typical_value: int) -> str:
+    """Difference from the typical figure, in percent."""
+
+    if not typical_value:
+        return "-"
+    return f"{(value - typical_value) * 100 / typical_value:+.0f}%"
+
+
+def typical_text(
+    prod: "Production", typical: dict, summary: dict = None, bold: str = "**"
+) -> str:
+    """Typical figure of the hour (or of the day for a summary), markdown."""
+
+    if summary:
+        return (
+            f"{bold}{typical['achieved']}{bold} pairs/day  "
+            f"`{vs_typical(prod.achieved, typical['achieved'])}`"
+        )
+    return (
+        f"{bold}{typical['phour']}{bold} pairs  "
+        f"`{vs_typical(prod.phour, typical['phour'])}`  "
+        f"({typical['low']} - {typical['high']})"
+    )
+
+
+def typical_label(summary: dict = None) -> str:
+    return "Typical Day" if summary else "Typical Hour"
+
+
+def period_text(period: dict, bold: str = "**") -> str:
+    """Week and month to date totals, markdown."""
+
+    return "\n".join(
+        f"{name.title()}  {bold}{period[name]['phour']}{bold} pairs | "
+        f"{bold}{period[name]['fg']}{bold} cs"
+        for name in ("week", "month")
+    )
+
+
+def stats_label(summary: dict = None) -> str:
+    return "Spread" if summary else "Projected"
+
+
+def stats_text(
+    prod: "Production", stats: "HourlyStats", summary: dict = None, bold: str = "**"
+) -> str:
+    """Spread of the hours for a summary, else the end of day projection, markdown."""
+
+    if summary:
+        return (
+            f"Lowest {bold}{stats.min}{bold} | "
+            f"Std dev {bold}{stats.std:.0f}{bold} pairs/hour"
+        )
+    return (
+        f"{bold}{stats.projection(prod.phour_count)}{bold} pairs/day  "
+        f"(rate {bold}{stats.ewma:.0f}{bold} pairs/hour)"
+    )
+
+
+def breakdown_text(breakdown: List["Ranking"], bold: str = "**") -> str:
+    """Values with the most and the fewest scans of each column, markdown."""
+
+    def values(ranked):
+        return ", ".join(
+            f"{value or '-'} {bold}{count}{bold}" for value, count in ranked
+        )
+
+    lines = []
+    for ranking in breakdown:
+        line = f"{ranking.column.title()}  ▲ {values(ranking.top)}"
+        if ranking.bottom:
+            line += f"  ▼ {values(ranking.bottom)}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def discord_template(
+    prod: "Production",
+    average: int,
+    summary: dict = None,
+    unit: str = None,
+    typical: dict = None,
+    breakdown: List["Ranking"] = None,
+    stats: "HourlyStats" = None,
+) -> dict:
     """Discord embed type meesage."""
 
     last_hour = "Last Hour"
-    if DISPLAY_HOUR_COUNT == 1:
+    if settings.DISPLAY_HOUR_COUNT == 1:
         last_hour += f"  [ {prod.phour_count} ]"
 
     if not summary:
@@ -66,7 +162,7 @@ def discord_template(prod: "Production", average: int, summary: dict = None) ->
                     ],
                     "timestamp": f"{prod.time.utcnow()}",
                     "footer": {
-                        "text": "Fortune Br",
+                        "text": unit or settings.UNIT_ALIAS,
                         # "icon_url": "https://i.imgur.com/7SwrwqC.jpg",
                     },
                 }
@@ -105,7 +201,7 @@ def discord_template(prod: "Production", average: int, summary: dict = None) ->
                         },
                     ],
                     "footer": {
-                        "text": "Fortune Br",
+                        "text": unit or settings.UNIT_ALIAS,
                         # "icon_url": "https://i.imgur.com/7SwrwqC.jpg",
                     },
                     "timestamp": f"{prod.time.utcnow()}",
@@ -113,14 +209,48 @@ def discord_template(prod: "Production", average: int, summary: dict = None) ->
             ]
         }
 
+    if stats:
+        embed["embeds"][0]["fields"].insert(
+            3,
+            {"name": stats_label(summary), "value": stats_text(prod, stats, summary)},
+        )
+
+    if summary and summary.get("period"):
+        embed["embeds"][0]["fields"].insert(
+            3, {"name": "To Date", "value": period_text(summary["period"])}
+        )
+
+    if typical:
+        embed["embeds"][0]["fields"].insert(
+            3,
+            {
+                "name": typical_label(summary),
+                "value": typical_text(prod, typical, summary),
+            },
+        )
+
+    if breakdown:
+        embed["embeds"][0]["fields"].insert(
+            -1 if summary else len(embed["embeds"][0]["fields"]),
+            {"name": "Breakdown", "value": breakdown_text(breakdown)},
+        )
+
     return embed
 
 
-def slack_template(prod: "Production", average: int, summary: dict = None) -> dict:
+def slack_template(
+    prod: "Production",
+    average: int,
+    summary: dict = None,
+    unit: str = None,
+    typical: dict = None,
+    breakdown: List["Ranking"] = None,
+    stats: "HourlyStats" = None,
+) -> dict:
     """Slack block type message."""
 
     last_hour = "Last Hour"
-    if DISPLAY_HOUR_COUNT == 1:
+    if settings.DISPLAY_HOUR_COUNT == 1:
         last_hour += f"  [ {prod.phour_count} ]"
 
     if not summary:
@@ -204,15 +334,76 @@ def slack_template(prod: "Production", average: int, summary: dict = None) -> di
             ],
         }
 
+    if stats:
+        block["blocks"].insert(
+            -2 if summary else -1,
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": f"{stats_label(summary)}\n"
+                    + stats_text(prod, stats, summary, bold="*"),
+                },
+            },
+        )
+
+    if summary and summary.get("period"):
+        block["blocks"].insert(
+            -2,
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": "To Date\n" + period_text(summary["period"], bold="*"),
+                },
+            },
+        )
+
+    if typical:
+        block["blocks"].insert(
+            -2 if summary else -1,
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": f"{typical_label(summary)}\n"
+                    + typical_text(prod, typical, summary, bold="*"),
+                },
+            },
+        )
+
+    if breakdown:
+        block["blocks"].insert(
+            -2 if summary else -1,
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": "Breakdown\n" + breakdown_text(breakdown, bold="*"),
+                },
+            },
+        )
+
+    if unit:
+        label_slack_message(block, unit)
+
     return block
 
 
 # ToDo: Not checked
-def google_template(prod: "Production", average: int, summary: dict = None) -> dict:
+def google_template(
+    prod: "Production",
+    average: int,
+    summary: dict = None,
+    unit: str = None,
+    typical: dict = None,
+    breakdown: List["Ranking"] = None,
+    stats: "HourlyStats" = None,
+) -> dict:
     """Google card type message."""
 
     last_hour = "Last Hour"
-    if DISPLAY_HOUR_COUNT == 1:
+    if settings.DISPLAY_HOUR_COUNT == 1:
         last_hour += f"  [ {prod.phour_count} ]"
 
     card = {
@@ -253,19 +444,71 @@ def google_template(prod: "Production", average: int, summary: dict = None) -> d
             },
         ]
 
+        if summary.get("period"):
+            keys.append(
+                {
+                    "keyValue": {
+                        "topLabel": "To Date",
+                        "content": period_text(summary["period"], bold=""),
+                    },
+                }
+            )
+
         card["cards"][0]["sections"][0]["widgets"].extend(keys)
         card["cards"].insert(0, header)
 
+    if stats:
+        card["cards"][-1]["sections"][0]["widgets"].append(
+            {
+                "keyValue": {
+                    "topLabel": stats_label(summary),
+                    "content": stats_text(prod, stats, summary, bold=""),
+                }
+            }
+        )
+
+    if typical:
+        card["cards"][-1]["sections"][0]["widgets"].append(
+            {
+                "keyValue": {
+                    "topLabel": typical_label(summary),
+                    "content": typical_text(prod, typical, summary, bold=""),
+                }
+            }
+        )
+
+    if breakdown:
+        card["cards"][-1]["sections"][0]["widgets"].append(
+            {
+                "keyValue": {
+                    "topLabel": "Breakdown",
+                    "content": breakdown_text(breakdown, bold=""),
+                    "contentMultiline": True,
+                }
+            }
+        )
+
+    if unit:
+        card["text"] = f"{unit} | {card['text']}"
+
     return card
 
 
-def slack_api_template(prod: "Production", average: int, summary: dict = None) -> dict:
+def slack_api_template(
+    prod: "Production",
+    average: int,
+    summary: dict = None,
+    unit: str = None,
+    typical: dict = None,
+    breakdown: List["Ranking"] = None,
+    stats: "HourlyStats" = None,
+) -> dict:
     """Slack block type message.
 
     Summary is passing as a key-value that can be used to reply in thread by api.
     """
     last_hour = "Last Hour"
-    if DISPLAY_HOUR_COUNT == 1:
+    if settings.DISPLAY_HOUR_COUNT == 1:
         last_hour += f"  [ {prod.phour_count} ]"
 
     if not summary:
@@ -347,4 +590,202 @@ def slack_api_template(prod: "Production", average: int, summary: dict = None) -
             "summary": f"Summary\n```{summary['detail']}```",
         }
 
+    if stats:
+        msg["blocks"].insert(
+            -1,
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": f"{stats_label(summary)}\n"
+                    + stats_text(prod, stats, summary, bold="*"),
+                },
+            },
+        )
+
+    if summary and summary.get("period"):
+        msg["blocks"].insert(
+            -1,
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": "To Date\n" + period_text(summary["period"], bold="*"),
+                },
+            },
+        )
+
+    if typical:
+        msg["blocks"].insert(
+            -1,
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": f"{typical_label(summary)}\n"
+                    + typical_text(prod, typical, summary, bold="*"),
+                },
+            },
+        )
+
+    if breakdown:
+        msg["blocks"].insert(
+            -1,
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": "Breakdown\n" + breakdown_text(breakdown, bold="*"),
+                },
+            },
+        )
+
+    if unit:
+        label_slack_message(msg, unit)
+
+    return msg
+
+
+def live_discord_template(
+    prod: "Production", rate: float, recent_rate: float, unit: str = None
+) -> dict:
+    """Discord embed for the live message, edited in place through the day."""
+
+    embed = {
+        "embeds": [
+            {
+                "color": 5763719,
+                "author": {"name": f"Live - {prod.date.strftime('%A - %b %d, %Y')}"},
+                "fields": [
+                    {
+                        "name": "Achieved",
+                        "value": f"**{prod.achieved}** pairs | **{prod.fg}** cs",
+                    },
+                    {
+                        "name": "This Hour",
+                        "value": f"**{prod.phour}** pairs",
+                        "inline": True,
+                    },
+                    {
+                        "name": "Rate",
+                        "value": f"**{rate:.1f}** pairs/min  (now **{recent_rate:.1f}**)",
+                        "inline": True,
+                    },
+                ],
+                "footer": {
+                    "text": f"{unit or settings.UNIT_ALIAS}  |  {prod.time_string}"
+                },
+            }
+        ]
+    }
+
+    return embed
+
+
+def live_slack_template(
+    prod: "Production", rate: float, recent_rate: float, unit: str = None
+) -> dict:
+    """Slack message for the live message, edited in place through the day."""
+
+    msg = {
+        "text": f"{prod.achieved} pairs | {prod.fg} cs",
+        "blocks": [
+            {
+                "type": "header",
+                "text": {
+                    "type": "plain_text",
+                    "text": f"Live - {prod.date.strftime('%A - %b %d, %Y')}",
+                },
+            },
+            {
+                "type": "section",
+                "fields": [
+                    {
+                        "type": "mrkdwn",
+                        "text": f"Achieved\n*{prod.achieved}* _pairs_ | *{prod.fg}* _cs_",
+                    },
+                    {
+                        "type": "mrkdwn",
+                        "text": f"This Hour\n*{prod.phour}* _pairs_",
+                    },
+                    {
+                        "type": "mrkdwn",
+                        "text": f"Rate\n*{rate:.1f}* _pairs/min_  (now *{recent_rate:.1f}*)",
+                    },
+                ],
+            },
+            {
+                "type": "context",
+                "elements": [
+                    {"type": "mrkdwn", "text": f"Updated {prod.time_string}"},
+                ],
+            },
+        ],
+    }
+
+    if unit:
+        label_slack_message(msg, unit)
+
     return msg
+
+
+def stall_text(event: "StallEvent", bold: str = "**") -> str:
+    """Alert/recovery line of a stalled unit (see `core/watchdog.py`)."""
+
+    since = event.since.strftime("%I:%M %p")
+    if event.kind == "stalled":
+        return (
+            f"Less than {bold}{settings.WATCHDOG_FLOOR}{bold} pairs/min "
+            f"since {bold}{since}{bold}"
+        )
+    minutes = int((event.minute - event.since).total_seconds() // 60)
+    return (
+        f"Running again at {bold}{event.count}{bold} pairs/min, "
+        f"stalled {since} - {event.minute.strftime('%I:%M %p')} ({minutes} min)"
+    )
+
+
+def stall_title(event: "StallEvent", unit: str = None) -> str:
+    title = "Line stalled" if event.kind == "stalled" else "Line recovered"
+    return f"{title} - {unit or settings.UNIT_ALIAS}"
+
+
+def stall_discord_template(event: "StallEvent", unit: str = None) -> dict:
+    """Discord embed of a stall alert or recovery."""
+
+    embed = {
+        "embeds": [
+            {
+                "color": 15548997 if event.kind == "stalled" else 5763719,
+                "author": {"name": stall_title(event, unit)},
+                "description": stall_text(event),
+            }
+        ]
+    }
+
+    return embed
+
+
+def stall_slack_template(event: "StallEvent", unit: str = None) -> dict:
+    """Slack message of a stall alert or recovery, webhook and app."""
+
+    msg = {
+        "text": f"{stall_title(event, unit)}: {stall_text(event, bold='')}",
+        "blocks": [
+            {
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": f"*{stall_title(event, unit)}*\n{stall_text(event, '*')}",
+                },
+            },
+        ],
+    }
+
+    return msg
+
+
+def stall_google_template(event: "StallEvent", unit: str = None) -> dict:
+    """Google Chat message of a stall alert or recovery."""
+
+    return {"text": f"*{stall_title(event, unit)}*\n{stall_text(event, '*')}"}
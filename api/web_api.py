@@ -1,59 +1,142 @@
 """
 Webhook/Api implementation
 
-"""
+All the sinks of a report are sent in parallel by `dispatch`, each sink type has
+its own keep-alive http session and every request is bounded by a timeout.
+
+`requests` is imported on the first request, a run that sends nothing does not
+load it. The Slack app sink lives in `api/slack.py`.
 
-from typing import Optional
+"""
 
-import requests
-from slack_sdk import WebClient
-from slack_sdk.errors import SlackApiError
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, NamedTuple, Optional
 
+from core import settings
 from core.log_me import logMessage
 
+if TYPE_CHECKING:
+    import requests
+
+MAX_WORKERS = 8
+"""Maximum number of requests in flight at once."""
+
+SESSIONS: Dict[str, "requests.Session"] = {}
+"""Http session per webhook type, keeps connections alive between requests/runs."""
+
+SESSIONS_LOCK = threading.Lock()
+
+EXECUTOR = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="sink")
+"""Sends of the reports, its threads are started on the first call."""
+
+
+class SendResult(NamedTuple):
+    """Outcome of a webhook/api request."""
+
+    ok: bool
+    status: Optional[int] = None
+    """Http status code, `None` if no response was received."""
+    retry_after: Optional[float] = None
+    """Seconds to wait before retrying, if asked by the server."""
+
+
+def _retry_after(headers) -> Optional[float]:
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def get_session(wh_type: Optional[str] = "") -> "requests.Session":
+    """Returns the http session of the webhook type, creates it on first use."""
+
+    with SESSIONS_LOCK:
+        session = SESSIONS.get(wh_type)
+        if session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=MAX_WORKERS)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            SESSIONS[wh_type] = session
+    return session
 
-def webhook_request(url: str, data: dict, wh_type: Optional[str] = ""):
+
+def webhook_request(url: str, data: dict, wh_type: Optional[str] = "") -> SendResult:
     """Send the data to webhook."""
 
     try:
-        res = requests.post(url, json=data)
+        res = get_session(wh_type).post(
+            url, json=data, timeout=settings.WEBHOOK_TIMEOUT
+        )
         if res.status_code >= 400:
-            logMessage(f"{wh_type} request failed: #{res.status_code}")
+            logMessage(f"{wh_type} request failed: #{res.status_code}", sink=wh_type)
+            return SendResult(False, res.status_code, _retry_after(res.headers))
+        return SendResult(True, res.status_code)
     except Exception as e:
-        logMessage(f"Failed to send to {wh_type} webhook\n{e}")
+        logMessage(f"Failed to send to {wh_type} webhook\n{e}", sink=wh_type)
+        return SendResult(False)
 
 
-def slack_api(
-    token: str, channel_id: str, text: str, blocks: list, summary: Optional[str] = None
-) -> None:
-    """Slack client execution"""
+def discord_message(
+    url: str, data: dict, message_id: Optional[str] = None
+) -> Optional[str]:
+    """Post a webhook message, or edit it if `message_id` is given.
 
-    CLIENT = WebClient(token=token)
+    Returns the message id, `None` if the request failed.
+    """
 
+    session = get_session("discord")
     try:
-        res = CLIENT.chat_postMessage(channel=channel_id, text=text, blocks=blocks)
-        thread_id = res.data.get("ts", None)
-        if summary:
-            if thread_id:
-                res = CLIENT.chat_postMessage(
-                    channel=channel_id, text=summary, thread_ts=thread_id
-                )
-                # Get captured old message id's and delete them
-                with open("slack_ts.txt", "r") as f:
-                    slack_ts = f.read()
-                for ts in slack_ts.strip().split("\n"):
-                    _ = CLIENT.chat_delete(channel=channel_id, ts=ts)
-                with open("slack_ts.txt", "w+") as f:
-                    f.write("")
+        if message_id:
+            res = session.patch(
+                f"{url}/messages/{message_id}",
+                json=data,
+                timeout=settings.WEBHOOK_TIMEOUT,
+            )
+            if res.status_code == 404:
+                # Message was deleted, post a new one
+                return discord_message(url, data)
         else:
-            with open("slack_ts.txt", "a+") as f:
-                f.write("\n")
-                f.write(thread_id)
-
-    except SlackApiError as e:
-        logMessage(f"Failed to send to Slack client\n{e}")
-    except OSError:
-        # slack_ts.txt file not found
-        pass
+            res = session.post(
+                url,
+                params={"wait": "true"},
+                json=data,
+                timeout=settings.WEBHOOK_TIMEOUT,
+            )
+        if res.status_code >= 400:
+            logMessage(
+                f"discord live message failed: #{res.status_code}", sink="discord"
+            )
+            return None
+        return res.json().get("id", message_id)
     except Exception as e:
-        logMessage(f"Slack App execution failure, please report..\n{e}")
+        logMessage(f"Failed to send discord live message\n{e}", sink="discord")
+        return None
+
+
+def dispatch(
+    calls: Iterable[Callable[[], None]], executor: Optional[ThreadPoolExecutor] = None
+) -> None:
+    """Run the send calls in parallel and wait for all of them.
+
+    Takes as long as the slowest call, which is bounded by `WEBHOOK_TIMEOUT`.
+    Calls run on `EXECUTOR` unless an other `executor` is given.
+    """
+
+    calls = list(calls)
+    if not calls:
+        return
+    if len(calls) == 1:
+        calls[0]()
+        return
+
+    executor = executor or EXECUTOR
+    futures = [executor.submit(call) for call in calls]
+    wait(futures)
+    for future in futures:
+        if future.exception():
+            logMessage(f"Failed to send report\n{future.exception()}")
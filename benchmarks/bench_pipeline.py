@@ -0,0 +1,336 @@
+"""
+End-to-end run of `main()` against local stand-ins of the SQL Server and the sinks.
+
+The scans are a synthetic SQLite `tbl_ProductionScan`/`tbl_StorageScan` (see
+`bench_queries`, a `sqlite:///` data source), `--rows-per-day` spread over
+the last `--days` days. Every webhook (Discord, Slack, Google) and the Slack Web
+API are answered by a local http server, with `--latency-ms` of delay.
+
+Each run is a fresh `python` process with its own state folder (`ROOT` is moved
+under a temporary folder), as scheduled by the task scheduler. For every hour of
+the production day in `--hours` (the production day is set to have started that
+many hours ago), a cold run (no local history, the baseline and the period
+totals are backfilled) and a warm run (the next run, state kept) are timed.
+
+Prints the wall time and peak memory of every stage (import, settings, query,
+store, history, render, send...), `--output` saves them as json and `--compare`
+prints the change against a saved run.
+
+Usage:
+    python -m benchmarks.bench_pipeline [--rows-per-day 100000] [--days 14]
+        [--hours 1,6,12,23] [--latency-ms 0] [--rollup] [--memory]
+        [--output result.json] [--compare previous.json]
+
+"""
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+from .bench_queries import createDatabase
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STAGES = {
+    "main": [
+        "loadHourlyProductionLog",
+        "fetchCounts",
+        "updateRollup",
+        "fetchRollupCounts",
+        "appendHourlyProductionLog",
+        "reconcile",
+        "recordHour",
+        "loadHistory",
+        "periodTotals",
+        "computeBaseline",
+        "typicalHour",
+        "reportCalls",
+        "dispatch",
+    ],
+}
+"""Functions timed as a stage, by the module they are called from."""
+
+SLACK_TOKEN = "xoxb-bench"
+SLACK_CHANNEL = "CBENCH"
+
+
+class Stages:
+    """Wall time and peak traced memory of the calls of each stage."""
+
+    def __init__(self, memory: bool):
+        self.memory = memory
+        self.times: Dict[str, float] = {}
+        self.peaks: Dict[str, int] = {}
+        self.calls: Dict[str, int] = {}
+
+    def measure(self, name: str, function, *args, **kwargs):
+        import tracemalloc
+
+        if self.memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        t0 = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.times[name] = self.times.get(name, 0) + time.perf_counter() - t0
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if self.memory:
+                peak = tracemalloc.get_traced_memory()[1] - base
+                self.peaks[name] = max(self.peaks.get(name, 0), peak)
+
+    def wrap(self, module, name: str) -> None:
+        function = getattr(module, name)
+        setattr(
+            module,
+            name,
+            lambda *args, **kwargs: self.measure(name, function, *args, **kwargs),
+        )
+
+    def result(self) -> Dict[str, dict]:
+        return {
+            name: {
+                "ms": self.times[name] * 1000,
+                "calls": self.calls[name],
+                "peak_kb": self.peaks.get(name, 0) / 1024 if self.memory else None,
+            }
+            for name in self.times
+        }
+
+
+def child(path: str, base_url: str, hour: int, rollup: bool, memory: bool) -> None:
+    """One scheduled run, in the benchmarked process. Prints the stages as json."""
+
+    import importlib
+    import tracemalloc
+
+    t_start = time.perf_counter()
+    if memory:
+        tracemalloc.start()
+    stages = Stages(memory)
+
+    import core
+
+    core.ROOT = os.path.abspath("state") + "/"
+
+    main = stages.measure("import", importlib.import_module, "main")
+    from api import slack
+    from core import settings
+    from core.database import SQLITE_PREFIX, DataSource
+    from core.settings import Sinks, Unit
+
+    stages.measure("settings", settings.load)
+    slack.API_URL = base_url + "/api/"
+    sinks = Sinks(
+        discord=[base_url + "/discord"],
+        slack=[base_url + "/slack"],
+        google=[base_url + "/google"],
+        slack_token=SLACK_TOKEN,
+        slack_channel=SLACK_CHANNEL,
+    )
+    settings.override(
+        UNITS=[Unit("bench", "Bench", "Bench", SQLITE_PREFIX + path, None, sinks)],
+        SINKS=sinks,
+        PRODUCTION_START_HOUR=(datetime.datetime.now().hour - hour) % 24,
+        HOURLY_ROLLUP=rollup,
+    )
+
+    for module_name, names in STAGES.items():
+        module = sys.modules[module_name]
+        for name in names:
+            stages.wrap(module, name)
+    # Connecting the data source
+    stages.wrap(DataSource, "open")
+
+    stages.measure("main", main.main)
+
+    result = {
+        "stages": stages.result(),
+        "total_ms": (time.perf_counter() - t_start) * 1000,
+        "peak_kb": tracemalloc.get_traced_memory()[1] / 1024 if memory else None,
+    }
+    try:
+        import resource
+
+        result["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:  # Not available on windows
+        result["max_rss_kb"] = None
+    print(json.dumps(result))
+
+
+class SinkServer(ThreadingHTTPServer):
+    """Answers every webhook and the Slack Web API, counts the requests."""
+
+    daemon_threads = True
+
+    def __init__(self, latency: float):
+        super().__init__(("127.0.0.1", 0), SinkHandler)
+        self.latency = latency
+        self.requests: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class SinkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self.path.split("?")[0]
+        with self.server.lock:
+            self.server.requests[path] = self.server.requests.get(path, 0) + 1
+            count = sum(self.server.requests.values())
+        time.sleep(self.server.latency)
+
+        if path.startswith("/api/"):
+            body = {"ok": True, "ts": f"{count}.000100"}
+        elif path.startswith("/discord"):
+            body = {"id": str(count)}
+        else:
+            body = {}
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_PATCH = do_POST
+
+    def log_message(self, format, *args):
+        pass
+
+
+def runChild(args, path: str, cwd: str, base_url: str, hour: int) -> dict:
+    command = [
+        sys.executable,
+        "-m",
+        "benchmarks.bench_pipeline",
+        "--child",
+        path,
+        "--base-url",
+        base_url,
+        "--child-hour",
+        str(hour),
+    ]
+    command += ["--rollup"] * args.rollup + ["--memory"] * args.memory
+    env = {**os.environ, "PYTHONPATH": ROOT_DIR}
+    res = subprocess.run(command, cwd=cwd, env=env, capture_output=True, text=True)
+    if res.returncode:
+        print(res.stdout + res.stderr)
+        sys.exit(res.returncode)
+    return json.loads(res.stdout.strip().splitlines()[-1])
+
+
+def printRun(name: str, run: dict, previous: dict = None) -> None:
+    memory = "" if run["peak_kb"] is None else f", peak {run['peak_kb']:.0f} KiB"
+    rss = "" if run["max_rss_kb"] is None else f", max rss {run['max_rss_kb']} KiB"
+    print(f"\n{name}: total {run['total_ms']:.1f} ms{memory}{rss}")
+    print(f"  {'stage':<26}{'calls':>6}{'ms':>10}{'peak KiB':>10}{'vs prev':>10}")
+    for stage, value in run["stages"].items():
+        peak = "" if value["peak_kb"] is None else f"{value['peak_kb']:.0f}"
+        change = ""
+        old = (previous or {}).get("stages", {}).get(stage)
+        if old and old["ms"]:
+            change = f"{(value['ms'] / old['ms'] - 1) * 100:+.0f}%"
+        print(
+            f"  {stage:<26}{value['calls']:>6}{value['ms']:>10.2f}{peak:>10}"
+            f"{change:>10}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows-per-day", type=int, default=100_000)
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument(
+        "--hours",
+        default="1,6,12,23",
+        help="hours into the production day, comma separated",
+    )
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--rollup", action="store_true", help="with HOURLY_ROLLUP")
+    parser.add_argument(
+        "--memory",
+        action="store_true",
+        help="trace the peak memory of each stage (slows the timings down)",
+    )
+    parser.add_argument("--output", help="save the results as json")
+    parser.add_argument("--compare", help="results of a previous --output")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    parser.add_argument("--child-hour", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.base_url, args.child_hour, args.rollup, args.memory)
+        return
+
+    hours: List[int] = [int(hour) for hour in args.hours.split(",")]
+    previous = {}
+    if args.compare:
+        with open(args.compare, "r") as f:
+            previous = json.load(f)["runs"]
+
+    server = SinkServer(args.latency_ms / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    results = {
+        "options": {
+            "rows_per_day": args.rows_per_day,
+            "days": args.days,
+            "latency_ms": args.latency_ms,
+            "rollup": args.rollup,
+        },
+        "runs": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "barcode.sqlite")
+        t0 = time.perf_counter()
+        createDatabase(
+            path,
+            args.rows_per_day * args.days,
+            datetime.datetime.now().replace(minute=0, second=0, microsecond=0),
+            args.days,
+        )
+        print(
+            f"rows: {args.rows_per_day * args.days} over {args.days} days, "
+            f"created in {time.perf_counter() - t0:.1f} s"
+        )
+
+        for hour in hours:
+            cwd = os.path.join(tmp, f"hour{hour}")
+            os.makedirs(cwd)
+            hour_path = path
+            if args.rollup:
+                # Rollup table of the scenario, filled by its cold run
+                hour_path = os.path.join(cwd, "barcode.sqlite")
+                shutil.copyfile(path, hour_path)
+            for kind in ("cold", "warm"):
+                name = f"hour {hour} {kind}"
+                run = runChild(args, hour_path, cwd, server.url, hour)
+                results["runs"][name] = run
+                printRun(name, run, previous.get(name))
+
+    server.shutdown()
+    print("\nsink requests: " + json.dumps(server.requests, sort_keys=True))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Timing comparison of the legacy three count queries and the aggregated query.
+
+Runs against a synthetic SQLite stand-in of `tbl_ProductionScan`/`tbl_StorageScan`,
+so it can be run anywhere without the SQL Server.
+
+Usage:
+    python -m benchmarks.bench_queries [--rows 500000] [--repeat 20] [--latency-ms 0]
+
+`--latency-ms` adds a simulated network round trip to every statement, which is
+where the aggregated query saves most on a remote server.
+
+"""
+
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from core.database import SQLITE_PREFIX, SQLiteSource
+from core.queries import fetchCounts, hourlyMeasures
+
+sqlite3.register_adapter(datetime.datetime, lambda d: d.isoformat(" "))
+
+
+def createDatabase(
+    path: str, rows: int, day_end: datetime.datetime, days: int = 2
+) -> None:
+    """Synthetic scans spread over the `days` production days before `day_end`."""
+
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "create table tbl_ProductionScan (id integer primary key, prod_date text)"
+    )
+    conn.execute(
+        "create table tbl_StorageScan (id integer primary key, store_date text)"
+    )
+
+    span = int(datetime.timedelta(days=days).total_seconds())
+    sday = day_end - datetime.timedelta(days=days)
+    rnd = random.Random(1)
+
+    def stamps(count):
+        for _ in range(count):
+            yield (sday + datetime.timedelta(seconds=rnd.randrange(span)),)
+
+    conn.executemany(
+        "insert into tbl_ProductionScan (prod_date) values (?)", stamps(rows)
+    )
+    conn.executemany(
+        "insert into tbl_StorageScan (store_date) values (?)", stamps(rows // 12)
+    )
+    conn.execute("create index ix_prod_date on tbl_ProductionScan (prod_date)")
+    conn.execute("create index ix_store_date on tbl_StorageScan (store_date)")
+    conn.commit()
+    conn.close()
+
+
+class LatencySource(SQLiteSource):
+    """SQLite source adding a fixed delay per statement (simulated round trip)."""
+
+    def __init__(self, path: str, latency: float):
+        super().__init__(SQLITE_PREFIX + path)
+        self.latency = latency
+
+    def fetchall(self, query, params=()):
+        if self.latency:
+            time.sleep(self.latency)
+        return super().fetchall(query, params)
+
+
+def threeQueries(source, hourly_sdate, hourly_edate, start_date) -> dict:
+    """Previous implementation of `main()`, one statement per count."""
+
+    query = (
+        "select count(*) from [tbl_ProductionScan] where [prod_date] between ? and ?"
+    )
+    query_fg = (
+        "select count(*) from [tbl_StorageScan] where [store_date] between ? and ?"
+    )
+    return {
+        "phour": source.fetchone(query, (hourly_sdate, hourly_edate))[0],
+        "achieved": source.fetchone(query, (start_date, hourly_edate))[0],
+        "fg": source.fetchone(query_fg, (start_date, hourly_edate))[0],
+    }
+
+
+def aggregatedQuery(source, hourly_sdate, hourly_edate, start_date) -> dict:
+    measures = hourlyMeasures(hourly_sdate, hourly_edate, start_date)
+    return fetchCounts(source, measures)
+
+
+def timeit(func, args, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - t0)
+    return statistics.median(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    start_date = datetime.datetime(2021, 11, 1, 8)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "barcode.sqlite")
+        createDatabase(path, args.rows, start_date + datetime.timedelta(days=1))
+        source = LatencySource(path, args.latency_ms / 1000)
+
+        print(
+            f"rows: {args.rows}, repeat: {args.repeat}, latency: {args.latency_ms} ms"
+        )
+        print(
+            f"{'hour':>5}  {'3 queries (ms)':>15}  {'aggregated (ms)':>15}  {'speedup':>8}"
+        )
+        for hours in (1, 6, 12, 18, 23):
+            hourly_edate = start_date + datetime.timedelta(hours=hours)
+            hourly_sdate = hourly_edate - datetime.timedelta(hours=1)
+            qargs = (source, hourly_sdate, hourly_edate, start_date)
+
+            if threeQueries(*qargs) != aggregatedQuery(*qargs):
+                raise AssertionError("Aggregated query result differs")
+
+            old = timeit(threeQueries, qargs, args.repeat)
+            new = timeit(aggregatedQuery, qargs, args.repeat)
+            print(
+                f"{hourly_edate.hour:>5}  {old * 1000:>15.2f}  {new * 1000:>15.2f}  {old / new:>7.2f}x"
+            )
+        source.close()
+
+
+if __name__ == "__main__":
+    main()
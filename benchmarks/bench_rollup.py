@@ -0,0 +1,79 @@
+"""
+Hourly report counted from the scan tables vs from the `tbl_ProductionHourly` rollup.
+
+Runs against the synthetic SQLite stand-in of `bench_queries`, the rollup table is
+created there with the same schema (see `core/rollup.py`).
+
+Usage:
+    python -m benchmarks.bench_rollup [--rows 2000000] [--days 30] [--repeat 20]
+
+"""
+
+import argparse
+import datetime
+import os
+import tempfile
+import time
+
+from core.database import SQLITE_PREFIX, SQLiteSource
+from core.queries import fetchCounts, fetchHourlyCounts, hourlyMeasures
+from core.rollup import fetchRollupCounts, updateRollup
+
+from .bench_queries import createDatabase, timeit
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    start_date = datetime.datetime(2021, 11, 1, 8)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "barcode.sqlite")
+        createDatabase(
+            path, args.rows, start_date + datetime.timedelta(days=1), args.days + 1
+        )
+        source = SQLiteSource(SQLITE_PREFIX + path)
+
+        print(f"rows: {args.rows}, days: {args.days}, repeat: {args.repeat}")
+
+        t0 = time.perf_counter()
+        backfill_start = start_date - datetime.timedelta(days=args.days)
+        hours = updateRollup(source, start_date, backfill_start, 2)
+        print(f"backfill: {hours} hours in {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+        print(
+            f"{'hour':>5}  {'update (ms)':>12}  {'scan tables (ms)':>17}  "
+            f"{'rollup (ms)':>12}  {'speedup':>8}"
+        )
+        for hours in (1, 6, 12, 18, 23):
+            hourly_edate = start_date + datetime.timedelta(hours=hours)
+            hourly_sdate = hourly_edate - datetime.timedelta(hours=1)
+
+            t0 = time.perf_counter()
+            updateRollup(source, hourly_edate, backfill_start, 2)
+            update = time.perf_counter() - t0
+
+            rollup = fetchRollupCounts(source, hourly_sdate, hourly_edate, start_date)
+            hourly = fetchHourlyCounts(source, start_date, hourly_edate)
+            if rollup["achieved"] != sum(count for _, count in hourly):
+                raise AssertionError("Rollup differs from the scan table")
+
+            measures = hourlyMeasures(hourly_sdate, hourly_edate, start_date)
+            raw = timeit(fetchCounts, (source, measures), args.repeat)
+            new = timeit(
+                fetchRollupCounts,
+                (source, hourly_sdate, hourly_edate, start_date),
+                args.repeat,
+            )
+            print(
+                f"{hourly_edate.hour:>5}  {update * 1000:>12.2f}  {raw * 1000:>17.2f}  "
+                f"{new * 1000:>12.2f}  {raw / new:>7.1f}x"
+            )
+        source.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Start up time of a run that sends nothing (production below `MIN_PRODUCTION`).
+
+Every run is a fresh `python` process, as scheduled by the task scheduler: it
+imports `main`, loads the settings and counts one unit from the SQLite stand-in
+(a `sqlite:///` unit connection string). The state of the run is kept under the
+`bench` unit folder.
+
+Prints the slowest imports (`python -X importtime`) and the wall time of the
+whole process, and fails if the median is over the budget or if a sink client
+was imported.
+
+Usage:
+    python -m benchmarks.bench_startup [--repeat 10] [--budget-ms 400]
+
+"""
+
+import argparse
+import datetime
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from .bench_queries import createDatabase
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LAZY_MODULES = ("pyodbc", "requests", "slack_sdk")
+"""Must not be imported by a run that sends nothing."""
+
+
+def child(path: str) -> None:
+    """The quiet run, in the benchmarked process."""
+
+    import main
+    from core import settings
+    from core.database import SQLITE_PREFIX
+    from core.settings import Sinks, Unit
+
+    settings.load()
+    settings.override(
+        UNITS=[Unit("bench", "Bench", "Bench", SQLITE_PREFIX + path, None, Sinks())],
+        MIN_PRODUCTION=10**9,
+        BASELINE_DAYS=0,
+        PERIOD_TOTALS=False,
+        INCREMENTAL_COUNT=False,
+        HOURLY_ROLLUP=False,
+    )
+    main.main()
+
+    loaded = [name for name in LAZY_MODULES if name in sys.modules]
+    if loaded:
+        print(f"imported: {', '.join(loaded)}")
+        sys.exit(2)
+
+
+def importTimes(cwd: str, top: int = 10) -> None:
+    """Slowest imports of `main` by cumulative time."""
+
+    res = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=cwd,
+        env={**os.environ, "PYTHONPATH": ROOT_DIR},
+        capture_output=True,
+        text=True,
+    )
+    rows = []
+    for line in res.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        head, cumulative_us, name = line.split("|")
+        self_us = head.split(":")[1]
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+
+    print(f"{'cumulative (ms)':>16}  {'self (ms)':>10}  module")
+    for cumulative, own, name in sorted(rows, reverse=True)[:top]:
+        print(f"{cumulative / 1000:>16.1f}  {own / 1000:>10.1f}  {name}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=400)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "barcode.sqlite")
+        now = datetime.datetime.now()
+        createDatabase(path, 100_000, now + datetime.timedelta(hours=1))
+
+        importTimes(tmp)
+
+        command = [sys.executable, "-m", "benchmarks.bench_startup", "--child", path]
+        env = {**os.environ, "PYTHONPATH": ROOT_DIR}
+        timings = []
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            res = subprocess.run(command, cwd=tmp, env=env, capture_output=True)
+            timings.append(time.perf_counter() - t0)
+            if res.returncode:
+                print(res.stdout.decode() + res.stderr.decode())
+                sys.exit(res.returncode)
+
+    median = statistics.median(timings) * 1000
+    print(
+        f"quiet run: median {median:.0f} ms, min {min(timings) * 1000:.0f} ms "
+        f"(budget {args.budget_ms:.0f} ms)"
+    )
+    if median > args.budget_ms:
+        print("over budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Hours of the production day missed by the runs (computer off, network down,
+skipped schedule).
+
+A run looks for the hour keys missing in the hourly log since the start of the
+production day and counts all of them at once, one grouped hour bucket query per
+table (or a single query of the hourly rollup table), from the day start upto the
+last missing hour so the day to date figures are exact. The hours are saved in
+the store marked as backfilled, the summary then covers the complete day.
+
+"""
+
+import datetime
+from typing import TYPE_CHECKING, Dict, List
+
+from .production import Production
+from .queries import (
+    PRODUCTION_COLUMN,
+    PRODUCTION_TABLE,
+    STORAGE_COLUMN,
+    STORAGE_TABLE,
+    fetchHourlyCounts,
+)
+from .rollup import fetchRollupHours
+from .store import mergeHourlyProductionLog
+
+if TYPE_CHECKING:
+    from .database import DataSource
+
+
+def missingHours(
+    prod_log: Dict[datetime.datetime, Production],
+    start_date: datetime.datetime,
+    end: datetime.datetime,
+) -> List[datetime.datetime]:
+    """Hour keys (end of the hour) of the production day before `end` not logged."""
+
+    hours = int((end - start_date).total_seconds() // 3600)
+    keys = (start_date + datetime.timedelta(hours=i) for i in range(1, hours))
+    return [key for key in keys if key not in prod_log]
+
+
+def backfillHours(
+    source: "DataSource",
+    prod_log: Dict[datetime.datetime, Production],
+    start_date: datetime.datetime,
+    end: datetime.datetime,
+    unit: str = "",
+    rollup: bool = False,
+) -> int:
+    """Count the hours missing in `prod_log` before `end`, add and save them.
+
+    Returns the number of hours backfilled.
+    """
+
+    missing = missingHours(prod_log, start_date, end)
+    if not missing:
+        return 0
+
+    phour: Dict[datetime.datetime, int] = {}
+    fg: Dict[datetime.datetime, int] = {}
+    if rollup:
+        for hour, hour_phour, hour_fg in fetchRollupHours(
+            source, start_date, missing[-1]
+        ):
+            phour[hour] = hour_phour
+            fg[hour] = hour_fg
+    else:
+        for counts, table, column in (
+            (phour, PRODUCTION_TABLE, PRODUCTION_COLUMN),
+            (fg, STORAGE_TABLE, STORAGE_COLUMN),
+        ):
+            for hour, count in fetchHourlyCounts(
+                source, start_date, missing[-1], table, column
+            ):
+                counts[hour] = counts.get(hour, 0) + count
+
+    # Day to date figures summed upto each hour
+    backfilled = []
+    achieved = fg_total = 0
+    for i in range(int((missing[-1] - start_date).total_seconds() // 3600)):
+        hour = start_date + datetime.timedelta(hours=i)
+        key = hour + datetime.timedelta(hours=1)
+        achieved += phour.get(hour, 0)
+        fg_total += fg.get(hour, 0)
+        if key not in prod_log:
+            backfilled.append(
+                Production(
+                    date=start_date,
+                    time=key,
+                    achieved=achieved,
+                    fg=fg_total,
+                    phour=phour.get(hour, 0),
+                    backfilled=True,
+                )
+            )
+
+    mergeHourlyProductionLog(backfilled, unit)
+    for prod in backfilled:
+        prod_log[prod.time] = prod
+    return len(backfilled)
@@ -0,0 +1,109 @@
+"""
+Historical baseline of the hourly production.
+
+Production of the last `BASELINE_DAYS` complete production days is read from the
+hourly history (`core/history.py`), whose missing hours are fetched by the run
+(`reconcile`), as one row of 24 hourly counts per day ordered by the hour of the
+production day (first row is `PRODUCTION_START_HOUR` to next hour).
+
+The typical figures are the median and the 10th/90th percentiles of each hour
+over the days with production (Sundays and holidays are left out).
+
+"""
+
+import datetime
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from . import settings
+from .history import hourIndex, localHours
+
+MIN_DAYS = 3
+"""Days with production needed before typical figures are given."""
+
+History = Tuple[np.ndarray, np.ndarray]
+"""Production day ordinals (`date.toordinal()`) and their hourly counts `(days, 24)`."""
+
+
+class Baseline(NamedTuple):
+    """Typical production of each hour of the production day."""
+
+    days: int
+    """Number of days the figures are taken from."""
+    median: np.ndarray
+    low: np.ndarray
+    """10th percentile."""
+    high: np.ndarray
+    """90th percentile."""
+    achieved: np.ndarray
+    """Median production of the day upto the end of each hour."""
+
+
+def _empty() -> History:
+    return np.empty(0, dtype=np.int64), np.empty((0, 24), dtype=np.int32)
+
+
+def baselineStart(start_date: datetime.datetime, days: int) -> datetime.datetime:
+    """First hour of the `days` production days before `start_date`."""
+
+    return start_date - datetime.timedelta(days=days)
+
+
+def loadHistory(start_date: datetime.datetime, days: int, unit: str = "") -> History:
+    """Hourly counts of the complete days before `start_date` kept in `history/`.
+
+    Days with an hour not in the history are left out.
+    """
+
+    first = baselineStart(start_date, days)
+    index = hourIndex(first)
+    filled, counts = localHours(index, index + days * 24, unit)
+
+    ordinals = np.arange(days, dtype=np.int64) + first.date().toordinal()
+    complete = filled.reshape(days, 24).all(axis=1)
+    phour = counts["phour"].reshape(days, 24).astype(np.int32)
+    return ordinals[complete], phour[complete]
+
+
+def combineHistories(histories: List[History]) -> History:
+    """Sum of the histories over the days all of them have."""
+
+    if not histories:
+        return _empty()
+    common = histories[0][0]
+    for days, _ in histories[1:]:
+        common = np.intersect1d(common, days)
+
+    total = np.zeros((len(common), 24), dtype=np.int32)
+    for days, counts in histories:
+        total += counts[np.isin(days, common)]
+    return common, total
+
+
+def computeBaseline(history: History) -> Optional[Baseline]:
+    """Typical figures per hour, `None` if there are not enough days yet."""
+
+    _, counts = history
+    counts = counts[counts.sum(axis=1) >= settings.MIN_PRODUCTION]
+    if len(counts) < MIN_DAYS:
+        return None
+
+    low, median, high = np.percentile(counts, [10, 50, 90], axis=0)
+    achieved = np.median(np.cumsum(counts, axis=1), axis=0)
+    return Baseline(len(counts), median, low, high, achieved)
+
+
+def typicalHour(baseline: Optional[Baseline], hour_count: int) -> Optional[dict]:
+    """Typical figures of the `hour_count`th hour of the day (`Production.phour_count`)."""
+
+    if baseline is None:
+        return None
+    slot = (hour_count - 1) % 24
+    return {
+        "phour": int(round(baseline.median[slot])),
+        "low": int(round(baseline.low[slot])),
+        "high": int(round(baseline.high[slot])),
+        "achieved": int(round(baseline.achieved[slot])),
+        "days": baseline.days,
+    }
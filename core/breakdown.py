@@ -0,0 +1,199 @@
+"""
+Production per line/article (the `BREAKDOWN_COLUMNS` of `tbl_ProductionScan`).
+
+The scans of every hour are counted per combination of the columns with one
+grouped query and kept per production day in `breakdown/YYYYMMDD.json`. A run
+only queries the hours missing there (the last one), the summary adds the hours
+of the day up from the file without querying again.
+
+Reports show, per column, the values with the most and the fewest scans of the
+hour (or of the day for the summary), picked with a heap. Values seen earlier in
+the day but without scans in the hour count as 0, a stopped line is the lowest.
+
+"""
+
+import datetime
+import heapq
+import json
+import os
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from .filelock import FileLock
+from .log_me import logMessage
+from .queries import fetchGroupedCounts
+from .utils import stateDir, writeFileAtomic
+
+if TYPE_CHECKING:
+    from .database import DataSource
+
+BREAKDOWN_DIR = "breakdown/"
+"""Breakdown folder, inside the state folder of the unit."""
+KEEP_DAYS = 31
+"""Days kept, older files are removed."""
+
+Breakdown = Dict[datetime.datetime, List[Tuple[tuple, int]]]
+"""`(values, count)` rows of each hour."""
+
+
+class Ranking(NamedTuple):
+    """Values of a column with the most and the fewest scans, `(value, count)`."""
+
+    column: str
+    top: List[Tuple[str, int]]
+    bottom: List[Tuple[str, int]]
+    """Empty when every value is in `top`."""
+
+
+def _dir(unit: str) -> str:
+    return stateDir(unit) + BREAKDOWN_DIR
+
+
+def _path(day: datetime.datetime, unit: str) -> str:
+    return f"{_dir(unit)}{day:%Y%m%d}.json"
+
+
+def _lock(unit: str) -> FileLock:
+    return FileLock(_dir(unit) + ".lock")
+
+
+def _value(value) -> str:
+    return "" if value is None else str(value).strip()
+
+
+def _rank(item: Tuple[str, int]) -> Tuple[int, str]:
+    # Ties broken by value, so the top and the bottom never share one
+    return item[1], item[0]
+
+
+def loadBreakdown(
+    day: datetime.datetime, columns: Sequence[str], unit: str = ""
+) -> Breakdown:
+    """Hours of the production day kept for `columns`, empty if other columns."""
+
+    try:
+        with open(_path(day, unit), "r") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logMessage(f"Failed to load production breakdown.\n{e}", "warning")
+        return {}
+
+    if data.get("columns") != list(columns):
+        return {}
+    return {
+        datetime.datetime.fromisoformat(hour): [(tuple(v), c) for v, c in rows]
+        for hour, rows in data["hours"].items()
+    }
+
+
+def _save(
+    day: datetime.datetime, columns: Sequence[str], hours: Breakdown, unit: str
+) -> None:
+    data = {
+        "columns": list(columns),
+        "hours": {
+            hour.isoformat(): [[list(v), c] for v, c in rows]
+            for hour, rows in sorted(hours.items())
+        },
+    }
+    writeFileAtomic(_path(day, unit), json.dumps(data).encode())
+
+    cutoff = f"{day - datetime.timedelta(days=KEEP_DAYS):%Y%m%d}.json"
+    for name in os.listdir(_dir(unit)):
+        if name.endswith(".json") and name < cutoff:
+            os.remove(_dir(unit) + name)
+
+
+def updateBreakdown(
+    source: "DataSource",
+    day: datetime.datetime,
+    end: datetime.datetime,
+    columns: Sequence[str],
+    unit: str = "",
+) -> int:
+    """Count the hours of the production day `day` before `end` not kept yet.
+
+    All of them are fetched in one grouped query. Returns the number of hours.
+    """
+
+    kept = loadBreakdown(day, columns, unit)
+    hours = int((end - day).total_seconds() // 3600)
+    missing = [
+        hour
+        for hour in (day + datetime.timedelta(hours=i) for i in range(hours))
+        if hour not in kept
+    ]
+    if not missing:
+        return 0
+
+    new: Breakdown = {hour: [] for hour in missing}
+    for hour, values, count in fetchGroupedCounts(source, missing[0], end, columns):
+        if hour in new:
+            new[hour].append((tuple(_value(v) for v in values), count))
+
+    os.makedirs(_dir(unit), exist_ok=True)
+    with _lock(unit):
+        # Hours saved meanwhile by an overlapping run are kept
+        hours_kept = loadBreakdown(day, columns, unit)
+        hours_kept.update(new)
+        _save(day, columns, hours_kept, unit)
+    return len(missing)
+
+
+def combineBreakdowns(breakdowns: Iterable[Optional[Breakdown]]) -> Breakdown:
+    """Rows of every unit together (combined report)."""
+
+    combined: Breakdown = {}
+    for breakdown in breakdowns:
+        for hour, rows in (breakdown or {}).items():
+            combined.setdefault(hour, []).extend(rows)
+    return combined
+
+
+def columnTotals(
+    breakdown: Breakdown, columns: Sequence[str], hours: Iterable[datetime.datetime]
+) -> Dict[str, Dict[str, int]]:
+    """Scans per value of each column over `hours`.
+
+    Every value of the kept hours is present, with 0 if it has no scans in `hours`.
+    """
+
+    totals: Dict[str, Dict[str, int]] = {column: {} for column in columns}
+    for rows in breakdown.values():
+        for values, _ in rows:
+            for column, value in zip(columns, values):
+                totals[column].setdefault(value, 0)
+    for hour in hours:
+        for values, count in breakdown.get(hour, []):
+            for column, value in zip(columns, values):
+                totals[column][value] += count
+    return totals
+
+
+def rankings(
+    breakdown: Breakdown,
+    columns: Sequence[str],
+    hours: Iterable[datetime.datetime],
+    size: int,
+) -> List[Ranking]:
+    """Top and bottom `size` values of each column over `hours`."""
+
+    result = []
+    for column, totals in columnTotals(breakdown, columns, hours).items():
+        if not totals:
+            continue
+        top = heapq.nlargest(size, totals.items(), key=_rank)
+        rest = max(min(size, len(totals) - size), 0)
+        bottom = heapq.nsmallest(rest, totals.items(), key=_rank)
+        result.append(Ranking(column, top, bottom))
+    return result
@@ -0,0 +1,221 @@
+"""
+Data sources the scans are counted from.
+
+A `DataSource` is a cached connection and the SQL dialect of its server. Every
+query goes through its `fetchone`/`fetchall`/`execute`, which keep one cursor per
+statement text: a cursor executing the same statement again reuses its prepared
+plan, so a resident process (daemon, live mode) prepares each query once.
+
+* `SqlConnection`: SQL Server through pyodbc, the production server.
+* `SQLiteSource`: a SQLite file (`sqlite:///<path>` connection string), local
+  stand-in for benchmarks and trials.
+
+"""
+
+import datetime
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from .queries import Dialect, SQLiteDialect
+
+SQLITE_PREFIX = "sqlite:///"
+"""Connection string prefix of a SQLite file."""
+
+
+class DataSource:
+    """Lazily opened connection that can be kept open between runs.
+
+    An idle connection is checked with a cheap query before it is used again,
+    and reopened if the server dropped it meanwhile. Results are fetched
+    entirely, so the statement cursors never hold the connection busy.
+    """
+
+    def __init__(
+        self,
+        connection_string: str,
+        dialect: Dialect,
+        ping_after: float = 300,
+        max_statements: int = 32,
+    ):
+        self.connection_string = connection_string
+        self.dialect = dialect
+        self.ping_after = ping_after
+        """Seconds of idle time after which the connection is verified."""
+        self.max_statements = max_statements
+        """Prepared statements kept, least recently used ones are closed."""
+        self._conn = None
+        self._last_used = 0.0
+        self._statements: "OrderedDict[str, object]" = OrderedDict()
+
+    def _connect(self):
+        raise NotImplementedError
+
+    def _cursor(self):
+        return self._conn.cursor()
+
+    def _alive(self) -> bool:
+        try:
+            cursor = self._conn.cursor()
+            cursor.execute("select 1").fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def open(self) -> None:
+        """Connect if required, an idle connection is verified first."""
+
+        if (
+            self._conn is not None
+            and time.monotonic() - self._last_used > self.ping_after
+        ):
+            if not self._alive():
+                self.invalidate()
+
+        if self._conn is None:
+            self._conn = self._connect()
+        self._last_used = time.monotonic()
+
+    def _statement(self, query: str):
+        """Cursor kept for `query`, created (and the query prepared) on first use."""
+
+        if self._conn is None:
+            self.open()
+        self._last_used = time.monotonic()
+
+        cursor = self._statements.pop(query, None)
+        if cursor is None:
+            cursor = self._cursor()
+            if len(self._statements) >= self.max_statements:
+                _, oldest = self._statements.popitem(last=False)
+                oldest.close()
+        self._statements[query] = cursor
+        return cursor
+
+    def execute(self, query: str, params=()) -> None:
+        """Run a statement without result set."""
+
+        self._statement(query).execute(query, params)
+
+    def executemany(self, query: str, rows: List[tuple]) -> None:
+        self._statement(query).executemany(query, rows)
+
+    def fetchone(self, query: str, params=()) -> Optional[tuple]:
+        rows = self.fetchall(query, params)
+        return rows[0] if rows else None
+
+    def fetchall(self, query: str, params=()) -> List[tuple]:
+        return self._statement(query).execute(query, params).fetchall()
+
+    def commit(self) -> None:
+        self._conn.commit()
+
+    def invalidate(self) -> None:
+        """Drop the connection and its statements, next query reconnects."""
+
+        for cursor in self._statements.values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        self._statements.clear()
+        try:
+            if self._conn is not None:
+                self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+    def close(self) -> None:
+        self.invalidate()
+
+
+class SqlConnection(DataSource):
+    """SQL Server through pyodbc, tables qualified with `database`."""
+
+    def __init__(self, connection_string: str, database: str = None, **kwargs):
+        super().__init__(connection_string, Dialect(database), **kwargs)
+
+    def _connect(self):
+        import pyodbc  # Loaded on the first connection, not at start up
+
+        conn = pyodbc.connect(self.connection_string)
+        if not conn:
+            raise ConnectionError("Failed to connect SQL Server.")
+        return conn
+
+    def _cursor(self):
+        cursor = self._conn.cursor()
+        # Parameter arrays in one round trip (rollup upserts)
+        cursor.fast_executemany = True
+        return cursor
+
+
+class SQLiteSource(DataSource):
+    """SQLite file given as `sqlite:///<path>`."""
+
+    def __init__(self, connection_string: str, **kwargs):
+        super().__init__(connection_string, SQLiteDialect(), **kwargs)
+        self.path = connection_string[len(SQLITE_PREFIX) :]
+
+    def _connect(self):
+        import sqlite3
+
+        sqlite3.register_adapter(datetime.datetime, lambda d: d.isoformat(" "))
+        # Borrowed from the pool by any thread, one at a time
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+
+def openSource(connection_string: str, database: str = None) -> DataSource:
+    """Data source of the connection string, not connected yet."""
+
+    if connection_string.startswith(SQLITE_PREFIX):
+        return SQLiteSource(connection_string)
+    return SqlConnection(connection_string, database)
+
+
+class ConnectionPool:
+    """Reusable data source per unit, at most `size` in use at once.
+
+    Used to query many units concurrently without opening more connections than
+    the SQL Servers (or the network) should take at a time.
+    """
+
+    def __init__(self, size: int = 4):
+        self._semaphore = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._connections: Dict[str, DataSource] = {}
+
+    @contextmanager
+    def connection(
+        self, key: str, connection_string: str, database: str = None
+    ) -> Iterator[DataSource]:
+        """Borrow the data source of unit `key`, waiting for a free slot.
+
+        A unit must not borrow its source twice at the same time. The source is
+        replaced if the connection string of the unit changed (configuration
+        reloaded).
+        """
+
+        with self._semaphore:
+            with self._lock:
+                connection = self._connections.get(key)
+                if (
+                    connection is not None
+                    and connection.connection_string != connection_string
+                ):
+                    connection.close()
+                    connection = None
+                if connection is None:
+                    connection = openSource(connection_string, database)
+                    self._connections[key] = connection
+            yield connection
+
+    def close(self) -> None:
+        with self._lock:
+            for connection in self._connections.values():
+                connection.close()
+            self._connections.clear()
@@ -0,0 +1,188 @@
+"""
+Export of the hourly (or daily) production of a date range, as CSV or Parquet.
+
+Records are streamed through generators a chunk of `CHUNK_HOURS` at a time, so
+the memory used does not depend on the length of the range:
+
+1. the hours of the chunk are read from the local history (`core/history.py`),
+2. the hours it does not have are fetched from the database, one grouped query
+   per table over the span of the missing hours of the chunk (a single query of
+   the hourly rollup table with `HOURLY_ROLLUP`),
+3. the rows are summed per production day for a daily export,
+4. each chunk is appended to the file; Parquet needs `pyarrow`, loaded only then.
+
+The file is written beside the output and renamed once complete.
+
+"""
+
+import csv
+import datetime
+import os
+from typing import TYPE_CHECKING, Dict, Iterator, List
+
+import numpy as np
+
+from . import settings
+from .history import COUNTS, EPOCH, hourIndex, localHours
+from .log_me import logMessage
+from .queries import fetchHourlyCounts
+from .rollup import fetchRollupHours
+
+if TYPE_CHECKING:
+    from .database import DataSource
+
+CHUNK_HOURS = 24 * 7
+"""Hours read, fetched and written at a time."""
+
+HOURLY_FIELDS = ["unit", "day", "hour", "phour", "fg", "source"]
+DAILY_FIELDS = ["unit", "day", "phour", "fg", "hours", "fetched_hours"]
+"""`fetched_hours`: hours not in the local history, fetched from the database."""
+
+Chunk = List[dict]
+
+
+def _fetchCounts(
+    source: "DataSource",
+    start: datetime.datetime,
+    end: datetime.datetime,
+    rollup: bool,
+) -> Dict[str, Dict[datetime.datetime, int]]:
+    """`phour` and `fg` per hour start from the database, hours with scans only."""
+
+    counts: Dict[str, Dict[datetime.datetime, int]] = {name: {} for name in COUNTS}
+    if rollup:
+        for hour, phour, fg in fetchRollupHours(source, start, end):
+            counts["phour"][hour] = phour
+            counts["fg"][hour] = fg
+    else:
+        for name, (table, column) in COUNTS.items():
+            for hour, count in fetchHourlyCounts(source, start, end, table, column):
+                counts[name][hour] = counts[name].get(hour, 0) + count
+    return counts
+
+
+def _productionDay(hour: datetime.datetime) -> datetime.date:
+    return (hour - datetime.timedelta(hours=settings.PRODUCTION_START_HOUR)).date()
+
+
+def hourlyChunks(
+    source: "DataSource",
+    start: datetime.datetime,
+    end: datetime.datetime,
+    unit: str = "",
+    rollup: bool = False,
+) -> Iterator[Chunk]:
+    """Rows of the hours `start <= hour < end`, `CHUNK_HOURS` at a time."""
+
+    first, last = hourIndex(start), hourIndex(end)
+    for chunk_start in range(first, last, CHUNK_HOURS):
+        chunk_end = min(chunk_start + CHUNK_HOURS, last)
+
+        filled, counts = localHours(chunk_start, chunk_end, unit)
+        missing = np.flatnonzero(filled == 0)
+        if len(missing):
+            from_hour = EPOCH + datetime.timedelta(hours=chunk_start + int(missing[0]))
+            to_hour = EPOCH + datetime.timedelta(
+                hours=chunk_start + int(missing[-1]) + 1
+            )
+            fetched = _fetchCounts(source, from_hour, to_hour, rollup)
+            for offset in missing:
+                hour = EPOCH + datetime.timedelta(hours=chunk_start + int(offset))
+                for name in COUNTS:
+                    counts[name][offset] = fetched[name].get(hour, 0)
+
+        rows = []
+        for offset in range(chunk_end - chunk_start):
+            hour = EPOCH + datetime.timedelta(hours=chunk_start + offset)
+            rows.append(
+                {
+                    "unit": unit,
+                    "day": _productionDay(hour).isoformat(),
+                    "hour": hour.isoformat(sep=" "),
+                    "phour": int(counts["phour"][offset]),
+                    "fg": int(counts["fg"][offset]),
+                    "source": "history" if filled[offset] else "database",
+                }
+            )
+        yield rows
+
+
+def dailyChunks(chunks: Iterator[Chunk]) -> Iterator[Chunk]:
+    """Hourly rows summed per production day, a day is yielded once complete."""
+
+    day = None
+    for rows in chunks:
+        done = []
+        for row in rows:
+            if day is None or (row["unit"], row["day"]) != (day["unit"], day["day"]):
+                if day is not None:
+                    done.append(day)
+                day = {field: 0 for field in DAILY_FIELDS}
+                day.update(unit=row["unit"], day=row["day"])
+            day["phour"] += row["phour"]
+            day["fg"] += row["fg"]
+            day["hours"] += 1
+            day["fetched_hours"] += row["source"] == "database"
+        if done:
+            yield done
+    if day is not None:
+        yield [day]
+
+
+def _writeCsv(chunks: Iterator[Chunk], path: str, fields: List[str]) -> int:
+    count = 0
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fields)
+        writer.writeheader()
+        for rows in chunks:
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+
+def _writeParquet(chunks: Iterator[Chunk], path: str, fields: List[str]) -> int:
+    import pyarrow as pa  # Optional, only needed for Parquet
+    import pyarrow.parquet as pq
+
+    count = 0
+    writer = None
+    try:
+        for rows in chunks:
+            table = pa.table({field: [row[field] for row in rows] for field in fields})
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+            count += len(rows)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+def exportProduction(
+    chunks: Iterator[Chunk], path: str, fields: List[str] = HOURLY_FIELDS
+) -> int:
+    """Write the rows to `path`, Parquet if it ends with `.parquet` else CSV.
+
+    Returns the number of rows written, -1 if the export failed.
+    """
+
+    parquet = path.lower().endswith(".parquet")
+    temp = path + ".tmp"
+    try:
+        if parquet:
+            count = _writeParquet(chunks, temp, fields)
+        else:
+            count = _writeCsv(chunks, temp, fields)
+        os.replace(temp, path)
+        return count
+    except ImportError:
+        logMessage("Parquet export needs pyarrow, export as .csv instead.")
+    except Exception as e:
+        logMessage(f"Production export to {path} failed.\n{e}")
+
+    try:
+        os.remove(temp)
+    except OSError:
+        pass
+    return -1
@@ -0,0 +1,67 @@
+"""
+Inter-process file lock, guards local state against overlapping runs.
+
+"""
+
+import os
+import time
+
+try:
+    import msvcrt
+except ImportError:  # Not windows
+    msvcrt = None
+    import fcntl
+
+
+class FileLock:
+    """Exclusive lock on `path`, usable as a context manager.
+
+    Raises `TimeoutError` if the lock is not acquired within `timeout` seconds.
+    """
+
+    def __init__(self, path: str, timeout: float = 30):
+        self.path = path
+        self.timeout = timeout
+        self._file = None
+
+    def _try_lock(self) -> bool:
+        try:
+            if msvcrt:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def acquire(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "a+")
+        deadline = time.monotonic() + self.timeout
+        while not self._try_lock():
+            if time.monotonic() > deadline:
+                self._file.close()
+                self._file = None
+                raise TimeoutError(f"Could not lock {self.path}")
+            time.sleep(0.1)
+
+    def release(self) -> None:
+        if self._file is None:
+            return
+        try:
+            if msvcrt:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
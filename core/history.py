@@ -0,0 +1,296 @@
+"""
+Columnar history of the hourly production.
+
+Hourly counts are kept in `history/` as one flat file per column (NumPy memmap),
+indexed by the hour since `EPOCH`: `phour` (production scans) and `fg` (storage
+scans) of the hour, `filled` marking the hours known, and a running total of each
+count (`phour.sum`, `fg.sum`) kept upto the last filled hour, whose index is kept
+in `end`. Any range total (day, week or month to date) is then the difference of
+two running totals, no query and no pass over the history.
+
+Hours are filled by the hourly runs. `reconcile` fetches the hours missing in a
+range (tool not running, server down) from the database, one grouped query per
+table for the whole range.
+
+"""
+
+import datetime
+import os
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, Tuple
+
+import numpy as np
+
+from . import settings
+from .filelock import FileLock
+from .log_me import logMessage
+from .queries import (
+    PRODUCTION_COLUMN,
+    PRODUCTION_TABLE,
+    STORAGE_COLUMN,
+    STORAGE_TABLE,
+    fetchHourlyCounts,
+)
+from .rollup import fetchRollupHours
+from .utils import stateDir
+
+if TYPE_CHECKING:
+    from .database import DataSource
+
+HISTORY_DIR = "history/"
+"""History folder, inside the state folder of the unit."""
+
+EPOCH = datetime.datetime(2020, 1, 1)
+"""Hour index 0, earlier hours are not kept."""
+GROW_HOURS = 24 * 366
+"""Columns are extended by this many hours at a time."""
+
+COUNTS = {
+    "phour": (PRODUCTION_TABLE, PRODUCTION_COLUMN),
+    "fg": (STORAGE_TABLE, STORAGE_COLUMN),
+}
+"""Hourly count columns and the table/column they are counted from."""
+COLUMNS = {"filled": np.uint8, "phour": np.int32, "fg": np.int32}
+COLUMNS.update({f"{name}.sum": np.int64 for name in COUNTS})
+END = "end"
+"""Index after the last filled hour, a single value."""
+
+
+def hourIndex(hour: datetime.datetime) -> int:
+    """Index of the hour starting at `hour`."""
+
+    return int((hour - EPOCH).total_seconds() // 3600)
+
+
+def _historyDir(unit: str) -> str:
+    return stateDir(unit) + HISTORY_DIR
+
+
+@contextmanager
+def _columns(unit: str, size: int = 0) -> Iterator[Dict[str, np.memmap]]:
+    """Memory map every column, extended to at least `size` hours if given.
+
+    Yields an empty dict if there is no history (and nothing to extend).
+    """
+
+    path = _historyDir(unit)
+    try:
+        length = os.path.getsize(path + "filled") // np.dtype(np.uint8).itemsize
+    except FileNotFoundError:
+        length = 0
+
+    if size > length:
+        os.makedirs(path, exist_ok=True)
+        new_length = (size // GROW_HOURS + 1) * GROW_HOURS
+        for name, dtype in COLUMNS.items():
+            with open(path + name, "ab") as f:
+                f.truncate(new_length * np.dtype(dtype).itemsize)
+        # Running totals of the new hours are set when hours get written there
+        length = new_length
+
+    columns = {}
+    if length:
+        for name, dtype in COLUMNS.items():
+            columns[name] = np.memmap(path + name, dtype, "r+", shape=(length,))
+        if not os.path.exists(path + END):
+            # History saved before the end was kept, found once
+            filled = np.flatnonzero(columns["filled"])
+            end = np.memmap(path + END, np.int64, "w+", shape=(1,))
+            end[0] = filled[-1] + 1 if len(filled) else 0
+            end.flush()
+        columns[END] = np.memmap(path + END, np.int64, "r+", shape=(1,))
+    try:
+        yield columns
+    finally:
+        for column in columns.values():
+            column.flush()
+        columns.clear()
+
+
+def _validEnd(columns: Dict[str, np.memmap]) -> int:
+    """Index after the last filled hour, running totals are kept upto there."""
+
+    return int(columns[END][0])
+
+
+def _write(columns: Dict[str, np.memmap], start: int, counts: Dict[str, np.ndarray]):
+    """Set the counts of the hours from `start` and update the running totals.
+
+    Only the totals upto the last filled hour are updated, not the whole
+    preallocated tail of the columns.
+    """
+
+    end = start + len(counts["phour"])
+    valid_end = _validEnd(columns)
+    for name in COUNTS:
+        values = np.asarray(counts[name], dtype=np.int64)
+        delta = np.cumsum(values - columns[name][start:end])
+        columns[name][start:end] = values
+        total = columns[f"{name}.sum"]
+        if end > valid_end:
+            # Hours since the last filled one have no counts, the total carries on
+            total[valid_end:end] = total[valid_end - 1] if valid_end else 0
+        total[start:end] += delta
+        total[end:valid_end] += delta[-1]
+    columns["filled"][start:end] = 1
+    columns[END][0] = max(end, valid_end)
+
+
+def _total(columns: Dict[str, np.memmap], name: str, start: int, end: int) -> int:
+    """Sum of the count over the hours `start <= index < end`."""
+
+    total = columns[f"{name}.sum"]
+    # No hour is filled past the valid end, the totals there are not kept
+    end = min(end, _validEnd(columns))
+    if end <= 0 or start >= end:
+        return 0
+    before = total[start - 1] if start > 0 else 0
+    return int(total[end - 1] - before)
+
+
+def _lock(unit: str) -> FileLock:
+    return FileLock(_historyDir(unit) + ".lock")
+
+
+def recordHour(
+    hour: datetime.datetime, phour: int, fg_to_date: int, unit: str = ""
+) -> None:
+    """Save the counts of the hour starting at `hour` from an hourly run.
+
+    Hourly runs count FG day-to-date, the FG of the hour is what it adds to the
+    hours before it. If an earlier hour of the day is missing it is not known,
+    the hour is left for `reconcile`.
+    """
+
+    index = hourIndex(hour)
+    day_start = hourIndex(_productionDayStart(hour))
+    if index < 0:
+        return
+    try:
+        with _lock(unit), _columns(unit, index + 1) as columns:
+            if not columns["filled"][day_start:index].all():
+                return
+            fg = fg_to_date - _total(columns, "fg", day_start, index)
+            _write(columns, index, {"phour": [phour], "fg": [max(fg, 0)]})
+    except Exception as e:
+        logMessage(f"Failed to save production history.\n{e}")
+
+
+def _missing(columns: Dict[str, np.memmap], start: int, end: int) -> np.ndarray:
+    filled = columns["filled"][start:end] if columns else np.zeros(0, np.uint8)
+    missing = np.flatnonzero(filled == 0) + start
+    # Hours past the current length of the columns are missing as well
+    return np.concatenate([missing, np.arange(start + len(filled), end)])
+
+
+def reconcile(
+    source: "DataSource",
+    start: datetime.datetime,
+    end: datetime.datetime,
+    unit: str = "",
+    rollup: bool = False,
+) -> int:
+    """Fill the hours missing between `start` and `end` from the database.
+
+    Every hour from the first to the last missing one is fetched in one grouped
+    query per table, or a single query of the hourly rollup table if `rollup`.
+    Returns the number of hours that were missing.
+    """
+
+    first, last = max(hourIndex(start), 0), hourIndex(end)
+    with _columns(unit) as columns:
+        missing = _missing(columns, first, last)
+    if not len(missing):
+        return 0
+
+    span_start, span_end = int(missing[0]), int(missing[-1]) + 1
+    from_hour = EPOCH + datetime.timedelta(hours=span_start)
+    to_hour = EPOCH + datetime.timedelta(hours=span_end)
+
+    counts = {name: np.zeros(span_end - span_start, np.int64) for name in COUNTS}
+    if rollup:
+        for hour, phour, fg in fetchRollupHours(source, from_hour, to_hour):
+            counts["phour"][hourIndex(hour) - span_start] = phour
+            counts["fg"][hourIndex(hour) - span_start] = fg
+    else:
+        for name, (table, column) in COUNTS.items():
+            for hour, count in fetchHourlyCounts(
+                source, from_hour, to_hour, table, column
+            ):
+                counts[name][hourIndex(hour) - span_start] += count
+
+    with _lock(unit), _columns(unit, span_end) as columns:
+        _write(columns, span_start, counts)
+    return len(missing)
+
+
+def _productionDayStart(hour: datetime.datetime) -> datetime.datetime:
+    day = (hour - datetime.timedelta(hours=settings.PRODUCTION_START_HOUR)).date()
+    return datetime.datetime.combine(day, datetime.time(settings.PRODUCTION_START_HOUR))
+
+
+def periodStarts(day: datetime.datetime) -> Dict[str, datetime.datetime]:
+    """Start of the production week (monday) and month of the production day."""
+
+    week = day - datetime.timedelta(days=day.weekday())
+    month = day.replace(day=1)
+    return {"week": week, "month": month}
+
+
+def rangeTotals(
+    start: datetime.datetime, end: datetime.datetime, unit: str = ""
+) -> Dict[str, int]:
+    """`phour` and `fg` totals of the hours between `start` and `end`."""
+
+    with _columns(unit) as columns:
+        if not columns:
+            return {name: 0 for name in COUNTS}
+        return {
+            name: _total(columns, name, hourIndex(start), hourIndex(end))
+            for name in COUNTS
+        }
+
+
+def localHours(
+    start: int, end: int, unit: str = ""
+) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """`filled` flags and counts of the hour indexes `start <= index < end`.
+
+    Copies, hours before `EPOCH` or not in the history are not filled.
+    """
+
+    filled = np.zeros(end - start, np.uint8)
+    counts = {name: np.zeros(end - start, np.int64) for name in COUNTS}
+    with _columns(unit) as columns:
+        if columns:
+            a = max(start, 0)
+            b = max(min(end, len(columns["filled"])), a)
+            filled[a - start : b - start] = columns["filled"][a:b]
+            for name in COUNTS:
+                counts[name][a - start : b - start] = columns[name][a:b]
+    return filled, counts
+
+
+def periodTotals(
+    day: datetime.datetime, end: datetime.datetime, unit: str = ""
+) -> Dict[str, Dict[str, int]]:
+    """Week and month to date totals upto `end`, of the production day `day`."""
+
+    return {
+        period: rangeTotals(start, end, unit)
+        for period, start in periodStarts(day).items()
+    }
+
+
+def combineTotals(
+    totals: Iterable[Dict[str, Dict[str, int]]],
+) -> Dict[str, Dict[str, int]]:
+    """Sum of the period totals of several units."""
+
+    combined: Dict[str, Dict[str, int]] = {}
+    for unit_totals in totals:
+        for period, counts in unit_totals.items():
+            for name, value in counts.items():
+                period_totals = combined.setdefault(period, {})
+                period_totals[name] = period_totals.get(name, 0) + value
+    return combined
@@ -1,10 +1,133 @@
+"""
+Program logging, as json lines in `log.jsonl`.
+
+`logMessage` only puts the record on a queue, a background listener writes it,
+so logging costs no file I/O on the calling thread and lines of concurrent
+threads never interleave. The file is rotated when it grows over `MAX_BYTES` or
+on a new day, the last `BACKUP_COUNT` files are kept. Processes write and rotate
+it under a file lock.
+
+A record is `{"time", "level", "pid", "message", ...fields}`, where fields are
+given by the caller (`unit`, `sink`...).
+
+"""
+
+import atexit
 import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
 
 from . import ROOT
+from .filelock import FileLock
+
+LOG_FILE = ROOT + "log.jsonl"
+MAX_BYTES = 5 * 1024 * 1024
+BACKUP_COUNT = 7
+
+logger = logging.getLogger("fbr_production")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+_lock = threading.Lock()
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname.lower(),
+            "pid": record.process,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, default=str)
+
+
+class LogFileHandler(logging.Handler):
+    """Appends to the log file, rotated on size and when the day changes.
+
+    Daemon, live, watch and hourly runs are separate processes writing the same
+    file: every write and rotation is done under a `FileLock`, and the file is
+    not kept open between records (Windows cannot rename a file open elsewhere).
+    """
+
+    def __init__(self, filename: str, max_bytes: int, backup_count: int):
+        super().__init__()
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.file_lock = FileLock(filename + ".lock")
+
+    def _shouldRollover(self, size: int) -> bool:
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return False
+        if datetime.date.fromtimestamp(stat.st_mtime) != datetime.date.today():
+            return stat.st_size > 0
+        return stat.st_size + size > self.max_bytes
+
+    def _rollover(self) -> None:
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.filename}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.filename}.{index + 1}")
+        os.replace(self.filename, f"{self.filename}.1")
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            line = (self.format(record) + "\n").encode("utf-8")
+            with self.file_lock:
+                if self._shouldRollover(len(line)):
+                    self._rollover()
+                with open(self.filename, "ab") as f:
+                    f.write(line)
+        except Exception:
+            self.handleError(record)
+
+
+def _start() -> None:
+    global _listener
+
+    with _lock:
+        if _listener is not None:
+            return
+        os.makedirs(ROOT, exist_ok=True)
+        handler = LogFileHandler(LOG_FILE, MAX_BYTES, BACKUP_COUNT)
+        handler.setFormatter(JsonFormatter())
+        records = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(records, handler)
+        listener.start()
+        logger.addHandler(logging.handlers.QueueHandler(records))
+        # Written before the program exits
+        atexit.register(listener.stop)
+        _listener = listener
+
+
+def setLogLevel(level: str) -> None:
+    """Minimum level written (`debug`, `info`, `warning`, `error`)."""
+
+    number = logging.getLevelName(level.upper())
+    if isinstance(number, int):
+        logger.setLevel(number)
+
 
+def logMessage(msg, level: str = "error", **fields) -> None:
+    """Program execution failure/exception logging
 
-def logMessage(msg) -> None:
-    """Program execution failure/exception logging"""
+    `fields` are added to the record as they are, e.g. `unit=unit.key`.
+    """
 
-    with open(ROOT + "log.txt", "a+") as f:
-        f.write(f"{datetime.datetime.now()}  {msg}\n")
+    if _listener is None:
+        _start()
+    number = logging.getLevelName(level.upper())
+    if not isinstance(number, int):
+        number = logging.ERROR
+    logger.log(number, str(msg), extra={"fields": fields})
@@ -0,0 +1,249 @@
+"""
+Timings of the stages of a run.
+
+Every stage (config load, connect, each query, state load/save, render, each sink
+send) is timed with `stage()`/`record()` and kept until the run ends, then:
+
+* appended as json lines to `metrics/timings-<day>.jsonl`,
+* written to `metrics/fbr_production.prom` (last run only), in the format of the
+  Prometheus node exporter textfile collector,
+* served on `http://127.0.0.1:<METRICS_PORT>/metrics` by `serveMetrics()`, in the
+  daemon mode.
+
+With `PROFILE_RUNS` a cProfile dump of each run (main thread) is also saved.
+Timings and profiles older than `KEEP_DAYS` are removed.
+
+Work done apart from the runs (outbox drain, start up of the resident modes) is
+timed within `background()`, or in threads marked with `markBackground()`: its
+stages are kept out of the run, and written as json lines tagged with their role
+by `flushBackground()`.
+
+"""
+
+import datetime
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+from . import ROOT, settings
+from .log_me import logMessage
+from .utils import writeFileAtomic
+
+METRICS_DIR = ROOT + "metrics/"
+TEXTFILE = METRICS_DIR + "fbr_production.prom"
+PREFIX = "fbr_production"
+
+KEEP_DAYS = 30
+"""Days of timings and profiles kept."""
+
+_lock = threading.Lock()
+_records: List[dict] = []
+_background: List[dict] = []
+"""Stages of the background threads, since the last `flushBackground`."""
+_local = threading.local()
+_text = ""
+"""Prometheus text of the last run."""
+
+
+def record(name: str, seconds: float, /, **labels) -> None:
+    """Keep the timing of a stage, labels of `None` value are left out."""
+
+    entry = {"stage": name, "seconds": seconds}
+    entry.update({k: str(v) for k, v in labels.items() if v is not None})
+    role = getattr(_local, "role", None)
+    with _lock:
+        if role:
+            _background.append({**entry, "role": role})
+        else:
+            _records.append(entry)
+
+
+def markBackground(role: str) -> None:
+    """Keep the stages of the calling thread out of the runs, tagged `role`.
+
+    Also usable as `ThreadPoolExecutor` initializer of a background pool.
+    """
+
+    _local.role = role
+
+
+@contextmanager
+def background(role: str) -> Iterator[None]:
+    """Keep the stages of the block out of the runs, tagged `role`, then flush them."""
+
+    previous = getattr(_local, "role", None)
+    _local.role = role
+    try:
+        yield
+    finally:
+        _local.role = previous
+        flushBackground()
+
+
+@contextmanager
+def stage(name: str, /, **labels) -> Iterator[None]:
+    """Time the block as stage `name`, also if it raises."""
+
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - t0, **labels)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def prometheusText(records: List[dict], run_seconds: float, timestamp: float) -> str:
+    """Stage timings of a run in the Prometheus text exposition format.
+
+    Stages with the same labels (e.g. two urls of a sink) are summed.
+    """
+
+    seconds: Dict[Tuple, float] = {}
+    calls: Dict[Tuple, int] = {}
+    for entry in records:
+        key = tuple(sorted((k, v) for k, v in entry.items() if k != "seconds"))
+        seconds[key] = seconds.get(key, 0) + entry["seconds"]
+        calls[key] = calls.get(key, 0) + 1
+
+    lines = [
+        f"# HELP {PREFIX}_stage_seconds Duration of the stages of the last run.",
+        f"# TYPE {PREFIX}_stage_seconds gauge",
+    ]
+    lines += [f"{PREFIX}_stage_seconds{_labels(k)} {v:.6f}" for k, v in seconds.items()]
+    lines += [
+        f"# HELP {PREFIX}_stage_calls Times each stage ran in the last run.",
+        f"# TYPE {PREFIX}_stage_calls gauge",
+    ]
+    lines += [f"{PREFIX}_stage_calls{_labels(k)} {v}" for k, v in calls.items()]
+    lines += [
+        f"# HELP {PREFIX}_run_seconds Duration of the last run.",
+        f"# TYPE {PREFIX}_run_seconds gauge",
+        f"{PREFIX}_run_seconds {run_seconds:.6f}",
+        f"# HELP {PREFIX}_last_run_timestamp_seconds End of the last run.",
+        f"# TYPE {PREFIX}_last_run_timestamp_seconds gauge",
+        f"{PREFIX}_last_run_timestamp_seconds {timestamp:.0f}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def _appendJsonLines(records: List[dict], now: datetime.datetime) -> None:
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    run = now.isoformat(timespec="seconds")
+    with open(METRICS_DIR + f"timings-{now:%Y%m%d}.jsonl", "a") as f:
+        for entry in records:
+            f.write(json.dumps({"run": run, **entry}) + "\n")
+
+
+def _prune(now: datetime.datetime) -> None:
+    """Remove the timings and profiles older than `KEEP_DAYS`."""
+
+    cutoff = f"{now - datetime.timedelta(days=KEEP_DAYS):%Y%m%d}"
+    for name in os.listdir(METRICS_DIR):
+        for prefix in ("timings-", "profile-"):
+            if name.startswith(prefix) and name[len(prefix) :] < cutoff:
+                os.remove(METRICS_DIR + name)
+
+
+def flushBackground() -> None:
+    """Write the stages of the background threads kept since the last flush."""
+
+    with _lock:
+        records = _background[:]
+        _background.clear()
+    if not (settings.METRICS_ENABLED and records):
+        return
+    try:
+        _appendJsonLines(records, datetime.datetime.now())
+    except Exception as e:
+        logMessage(f"Failed to save background timings.\n{e}", "warning")
+
+
+def flushRun(run_seconds: float) -> None:
+    """Write the stages kept since the last flush, as json lines and textfile."""
+
+    global _text
+
+    with _lock:
+        records = _records[:]
+        _records.clear()
+    if not settings.METRICS_ENABLED:
+        return
+
+    now = datetime.datetime.now()
+    try:
+        _appendJsonLines(records + [{"stage": "run", "seconds": run_seconds}], now)
+        _prune(now)
+
+        _text = prometheusText(records, run_seconds, now.timestamp())
+        writeFileAtomic(TEXTFILE, _text.encode())
+    except Exception as e:
+        logMessage(f"Failed to save run timings.\n{e}", "warning")
+
+
+@contextmanager
+def run() -> Iterator[None]:
+    """Time the block as a run and flush its stages, profiled if `PROFILE_RUNS`."""
+
+    profiler = None
+    if settings.PROFILE_RUNS:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        run_seconds = time.perf_counter() - t0
+        if profiler is not None:
+            profiler.disable()
+            try:
+                os.makedirs(METRICS_DIR, exist_ok=True)
+                now = datetime.datetime.now()
+                profiler.dump_stats(METRICS_DIR + f"profile-{now:%Y%m%d%H%M%S}.prof")
+            except Exception as e:
+                logMessage(f"Failed to save run profile.\n{e}", "warning")
+        flushRun(run_seconds)
+
+
+def serveMetrics(port: int) -> None:
+    """Serve the timings of the last run on localhost, in a background thread."""
+
+    # Only the daemon serves them, not loaded by the hourly runs
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            data = _text.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+    except OSError as e:
+        logMessage(f"Metrics endpoint not started on port {port}.\n{e}")
+        return
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
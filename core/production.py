@@ -4,14 +4,17 @@ Production information.
 """
 
 import datetime
-from typing import Iterable
+import math
+from typing import Dict, Iterable, Optional
 
-from core.settings import PRODUCTION_START_HOUR
+from core import settings
 
 
 class Production:
     """Model for storing hourly production details."""
 
+    __slots__ = ("date", "time", "achieved", "fg", "phour", "backfilled")
+
     def __init__(
         self,
         date=datetime.datetime.now(),
@@ -19,6 +22,7 @@ class Production:
         achieved: int = 0,
         fg: int = 0,
         phour: int = 0,
+        backfilled: bool = False,
     ):
 
         self.time: datetime.datetime = time
@@ -31,6 +35,41 @@ class Production:
         """FG Production upto this hour."""
         self.phour: int = phour
         """Production on this hour."""
+        self.backfilled: bool = backfilled
+        """Counted afterwards from the scans, the run of the hour was missed."""
+
+    def to_tuple(self) -> tuple:
+        """Compact representation, in the order of constructor arguments."""
+
+        return (
+            self.date,
+            self.time,
+            self.achieved,
+            self.fg,
+            self.phour,
+            self.backfilled,
+        )
+
+    @classmethod
+    def from_tuple(cls, record: tuple) -> "Production":
+        return cls(*record)
+
+    def __getstate__(self) -> tuple:
+        return self.to_tuple()
+
+    def __setstate__(self, state) -> None:
+        if isinstance(state, dict):
+            # Pickled before `__slots__`, attributes were saved as `__dict__`
+            state = (
+                state["date"],
+                state["time"],
+                state["achieved"],
+                state["fg"],
+                state["phour"],
+            )
+        self.date, self.time, self.achieved, self.fg, self.phour = state[:5]
+        # Saved before `backfilled`, counted by the runs
+        self.backfilled = bool(state[5]) if len(state) > 5 else False
 
     @property
     def hour_string(self) -> str:
@@ -49,30 +88,151 @@ class Production:
     @property
     def phour_count(self):
         """Returns hour count"""
-        count = self.time.hour - PRODUCTION_START_HOUR
+        count = self.time.hour - settings.PRODUCTION_START_HOUR
         if count <= 0:
             count += 24
         return count
 
 
+EWMA_ALPHA = 0.3
+"""Weight of the latest hour in the production rate."""
+DAY_HOURS = 24
+
+
+class HourlyStats:
+    """Running figures of the hours of a production day.
+
+    Updated in O(1) per hour (Welford's mean/variance, exponentially weighted
+    rate) instead of scanning the hourly log, kept next to it by `core/store.py`.
+    """
+
+    __slots__ = (
+        "count",
+        "total",
+        "mean",
+        "m2",
+        "min",
+        "max",
+        "top_time",
+        "ewma",
+        "last_time",
+        "achieved",
+        "fg",
+    )
+
+    def __init__(self):
+        self.count: int = 0
+        self.total: int = 0
+        self.mean: float = 0.0
+        self.m2: float = 0.0
+        """Sum of the squared differences from the mean."""
+        self.min: int = 0
+        self.max: int = 0
+        self.top_time: Optional[datetime.datetime] = None
+        """Hour with the most production (first of the ties)."""
+        self.ewma: float = 0.0
+        """Production rate, pairs per hour."""
+        self.last_time: Optional[datetime.datetime] = None
+        self.achieved: int = 0
+        self.fg: int = 0
+
+    def add(self, prod: Production) -> None:
+        """Account the hour following the last one added."""
+
+        self.count += 1
+        self.total += prod.phour
+        delta = prod.phour - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (prod.phour - self.mean)
+
+        if self.count == 1:
+            self.min = self.max = prod.phour
+            self.top_time = prod.time
+            self.ewma = float(prod.phour)
+        else:
+            self.min = min(self.min, prod.phour)
+            if prod.phour > self.max:
+                self.max, self.top_time = prod.phour, prod.time
+            self.ewma += EWMA_ALPHA * (prod.phour - self.ewma)
+
+        self.last_time = prod.time
+        self.achieved = prod.achieved
+        self.fg = prod.fg
+
+    @classmethod
+    def from_log(cls, data: Dict[datetime.datetime, Production]) -> "HourlyStats":
+        stats = cls()
+        for time in sorted(data):
+            stats.add(data[time])
+        return stats
+
+    def to_tuple(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    @classmethod
+    def from_tuple(cls, record: tuple) -> "HourlyStats":
+        stats = cls()
+        for name, value in zip(cls.__slots__, record):
+            setattr(stats, name, value)
+        return stats
+
+    @property
+    def average(self) -> int:
+        """Average production per hour."""
+
+        return int(self.mean)
+
+    @property
+    def std(self) -> float:
+        """Sample standard deviation of the hourly production."""
+
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def projection(self, hour_count: int) -> int:
+        """Production expected by the end of the day at the current rate."""
+
+        return int(round(self.achieved + self.ewma * max(DAY_HOURS - hour_count, 0)))
+
+    def to_dict(self, hour_count: int) -> dict:
+        return {
+            "hours": self.count,
+            "average": self.average,
+            "std": round(self.std, 1),
+            "min": self.min,
+            "max": self.max,
+            "top": self.top_time.isoformat() if self.top_time else None,
+            "rate": round(self.ewma, 1),
+            "projection": self.projection(hour_count),
+        }
+
+
 def averageHourlyProduction(productions: Iterable[Production]) -> int:
-    """Returns average production per hour."""
+    """Returns average production per hour, in one pass over any iterable."""
 
-    return int(sum([p.phour for p in productions]) / len(productions))
+    count = total = 0
+    for p in productions:
+        count += 1
+        total += p.phour
+    return int(total / count) if count else 0
 
 
-def generateProductionSummary(data: dict[datetime.datetime, Production]) -> dict:
+def generateProductionSummary(
+    data: Dict[datetime.datetime, Production], stats: Optional[HourlyStats] = None
+) -> dict:
     """Returns production summary report"""
 
+    stats = stats or HourlyStats.from_log(data)
     summary = {}
-    summary["top"] = max(data.values(), key=lambda p: p.phour)
-    summary["detail"] = ""
-    for p in data.values():
-        summary["detail"] += f"{p.hour_string}  :  {p.achieved}"
-        summary["detail"] += " " * (8 - len(str(p.achieved)))
-        summary["detail"] += f"+{p.phour}\n"
-
-    # productions = list(data.values()) # Sort for getting top5, last5
-    # productions.sort(key=lambda x: x.phour)
+    summary["top"] = data.get(stats.top_time) or max(
+        data.values(), key=lambda p: p.phour
+    )
+    summary["stats"] = stats
+    lines = []
+    for _, p in sorted(data.items()):
+        mark = " *" if p.backfilled else ""
+        lines.append(f"{p.hour_string}  :  {p.achieved:<8}+{p.phour}{mark}\n")
+    if any(p.backfilled for p in data.values()):
+        lines.append("* Backfilled, run of the hour missed\n")
+    summary["detail"] = "".join(lines)
 
     return summary
@@ -0,0 +1,306 @@
+"""
+Query layer for production counts.
+
+Every count the application needs is described as a `CountMeasure` (a table, a
+datetime column and a time window). Measures over the same table are folded into
+a single conditional-aggregation pass, and all passes are joined into one select so
+a run costs exactly one round trip, whatever number of measures are requested.
+
+The queries run on a `DataSource` (`core/database.py`), which gives the dialect
+and keeps the statements prepared.
+
+"""
+
+import datetime
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+if TYPE_CHECKING:
+    from .database import DataSource
+
+PRODUCTION_TABLE = "tbl_ProductionScan"
+PRODUCTION_COLUMN = "prod_date"
+STORAGE_TABLE = "tbl_StorageScan"
+STORAGE_COLUMN = "store_date"
+
+
+class Dialect:
+    """SQL flavour specific fragments, defaults to SQL Server."""
+
+    def __init__(self, database: str = None):
+        self.database = database
+
+    def table(self, name: str) -> str:
+        """Fully qualified table name."""
+
+        if self.database:
+            return f"{self.database}.[dbo].[{name}]"
+        return f"[dbo].[{name}]"
+
+    def hourBucket(self, column: str) -> str:
+        """Expression truncating the datetime column to the start of its hour."""
+
+        return f"dateadd(hour, datediff(hour, 0, [{column}]), 0)"
+
+    def createTableQuery(self, name: str, definition: str) -> str:
+        """Statement creating the table if it does not exist yet."""
+
+        table = self.table(name)
+        return (
+            f"if object_id(N'{table.replace('[', '').replace(']', '')}', N'U') is null "
+            f"create table {table} ({definition})"
+        )
+
+    def upsertQuery(self, name: str, key: str, columns: List[str]) -> str:
+        """Statement inserting a row or updating the row with the same `key`.
+
+        Parameters are the key followed by `columns`.
+        """
+
+        names = [key] + columns
+        values = ", ".join(f"[{c}]" for c in names)
+        return (
+            f"merge {self.table(name)} as t "
+            f"using (values ({', '.join('?' * len(names))})) as s ({values}) "
+            f"on t.[{key}] = s.[{key}] "
+            f"when matched then update set {', '.join(f'[{c}] = s.[{c}]' for c in columns)} "
+            f"when not matched then insert ({values}) "
+            f"values ({', '.join(f's.[{c}]' for c in names)});"
+        )
+
+
+class SQLiteDialect(Dialect):
+    """SQLite flavour, used for local stand-ins and benchmarks."""
+
+    def table(self, name: str) -> str:
+        return f"[{name}]"
+
+    def hourBucket(self, column: str) -> str:
+        return f"strftime('%Y-%m-%d %H:00:00', [{column}])"
+
+    def createTableQuery(self, name: str, definition: str) -> str:
+        return f"create table if not exists {self.table(name)} ({definition})"
+
+    def upsertQuery(self, name: str, key: str, columns: List[str]) -> str:
+        names = [key] + columns
+        return (
+            f"insert into {self.table(name)} ({', '.join(f'[{c}]' for c in names)}) "
+            f"values ({', '.join('?' * len(names))}) "
+            f"on conflict([{key}]) do update set "
+            f"{', '.join(f'[{c}] = excluded.[{c}]' for c in columns)}"
+        )
+
+
+class CountMeasure(NamedTuple):
+    """Number of rows of `table` where `column` falls in the window.
+
+    Window is `start <= column <= end` (same as `between`), or
+    `start < column <= end` if `include_start` is false.
+    """
+
+    name: str
+    table: str
+    column: str
+    start: datetime.datetime
+    end: datetime.datetime
+    include_start: bool = True
+
+
+def hourlyMeasures(
+    hourly_sdate: datetime.datetime,
+    hourly_edate: datetime.datetime,
+    start_date: datetime.datetime,
+) -> List[CountMeasure]:
+    """Measures needed for an hourly report (`phour`, `achieved`, `fg`)."""
+
+    return [
+        CountMeasure(
+            "phour", PRODUCTION_TABLE, PRODUCTION_COLUMN, hourly_sdate, hourly_edate
+        ),
+        CountMeasure(
+            "achieved", PRODUCTION_TABLE, PRODUCTION_COLUMN, start_date, hourly_edate
+        ),
+        CountMeasure("fg", STORAGE_TABLE, STORAGE_COLUMN, start_date, hourly_edate),
+    ]
+
+
+def liveMeasures(
+    start_date: datetime.datetime, now: datetime.datetime, window_minutes: int
+) -> List[CountMeasure]:
+    """Measures of the live report, day and current hour so far and a recent window."""
+
+    hour_start = now.replace(minute=0, second=0, microsecond=0)
+    window_start = now - datetime.timedelta(minutes=window_minutes)
+    return [
+        CountMeasure("achieved", PRODUCTION_TABLE, PRODUCTION_COLUMN, start_date, now),
+        CountMeasure("phour", PRODUCTION_TABLE, PRODUCTION_COLUMN, hour_start, now),
+        CountMeasure(
+            "recent", PRODUCTION_TABLE, PRODUCTION_COLUMN, window_start, now, False
+        ),
+        CountMeasure("fg", STORAGE_TABLE, STORAGE_COLUMN, start_date, now),
+    ]
+
+
+def _windowCondition(measure: CountMeasure) -> str:
+    column = f"[{measure.column}]"
+    if measure.include_start:
+        return f"{column} between ? and ?"
+    return f"{column} > ? and {column} <= ?"
+
+
+def buildCountQuery(
+    measures: Iterable[CountMeasure], dialect: Dialect = None
+) -> Tuple[str, list, List[str]]:
+    """Build one select returning every measure as a column.
+
+    Measures are grouped by table; each table is scanned once over the union of
+    its measures' windows and every measure becomes a conditional count of that
+    scan. Returns the query, its parameters and the measure names in column order.
+    """
+
+    dialect = dialect or Dialect()
+    passes: Dict[Tuple[str, str], List[CountMeasure]] = {}
+    for measure in measures:
+        passes.setdefault((measure.table, measure.column), []).append(measure)
+
+    if not passes:
+        raise ValueError("At least one measure is required.")
+
+    sources = []
+    params = []
+    names = []
+    for index, ((table, column), group) in enumerate(passes.items()):
+        # Scan range of this pass, covers every window of the group
+        scan_start = min(m.start for m in group)
+        scan_end = max(m.end for m in group)
+
+        columns = []
+        for measure in group:
+            names.append(measure.name)
+            if measure.include_start and (measure.start, measure.end) == (
+                scan_start,
+                scan_end,
+            ):
+                # Window is the whole scan, no per row condition needed
+                columns.append(f"count(*) as [{measure.name}]")
+                continue
+            columns.append(
+                f"count(case when {_windowCondition(measure)} then 1 end) as [{measure.name}]"
+            )
+            params.extend((measure.start, measure.end))
+
+        params.extend((scan_start, scan_end))
+        sources.append(
+            f"(select {', '.join(columns)} from {dialect.table(table)} "
+            f"where [{column}] between ? and ?) as t{index}"
+        )
+
+    selected = ", ".join(f"[{name}]" for name in names)
+    query = f"select {selected} from {' cross join '.join(sources)}"
+    return query, params, names
+
+
+def fetchCounts(
+    source: "DataSource", measures: Iterable[CountMeasure]
+) -> Dict[str, int]:
+    """Execute all the measures in a single round trip of the data source."""
+
+    query, params, names = buildCountQuery(measures, source.dialect)
+    row = source.fetchone(query, params)
+    return {name: int(value or 0) for name, value in zip(names, row)}
+
+
+class ChangeMarker(NamedTuple):
+    """Latest production and storage scan times, `None` if no scan."""
+
+    production: Optional[datetime.datetime]
+    storage: Optional[datetime.datetime]
+
+
+def _scanTime(value) -> Optional[datetime.datetime]:
+    if isinstance(value, str):
+        return datetime.datetime.fromisoformat(value)
+    return value
+
+
+def fetchChangeMarker(source: "DataSource", since: datetime.datetime) -> ChangeMarker:
+    """Latest production and storage scan times since `since`.
+
+    Changes whenever a scan arrives in either table. Answered from the indexes of
+    the scan times alone in one round trip, cheap enough to poll.
+    """
+
+    dialect = source.dialect
+    latest = [
+        f"(select max([{column}]) from {dialect.table(table)} where [{column}] >= ?)"
+        for table, column in (
+            (PRODUCTION_TABLE, PRODUCTION_COLUMN),
+            (STORAGE_TABLE, STORAGE_COLUMN),
+        )
+    ]
+    row = source.fetchone(f"select {', '.join(latest)}", [since, since])
+    return ChangeMarker(_scanTime(row[0]), _scanTime(row[1]))
+
+
+def fetchHourlyCounts(
+    source: "DataSource",
+    start: datetime.datetime,
+    end: datetime.datetime,
+    table: str = PRODUCTION_TABLE,
+    column: str = PRODUCTION_COLUMN,
+) -> List[Tuple[datetime.datetime, int]]:
+    """Number of scans per hour for `start <= column < end`, in one grouped query.
+
+    Returns `(hour start, count)` for the hours having scans.
+    """
+
+    dialect = source.dialect
+    bucket = dialect.hourBucket(column)
+    query = (
+        f"select {bucket} as [hour], count(*) as [count] from {dialect.table(table)} "
+        f"where [{column}] >= ? and [{column}] < ? group by {bucket}"
+    )
+    rows = []
+    for hour, count in source.fetchall(query, [start, end]):
+        if isinstance(hour, str):
+            hour = datetime.datetime.fromisoformat(hour)
+        rows.append((hour, int(count)))
+    return rows
+
+
+def fetchGroupedCounts(
+    source: "DataSource",
+    start: datetime.datetime,
+    end: datetime.datetime,
+    columns: Sequence[str],
+    table: str = PRODUCTION_TABLE,
+    column: str = PRODUCTION_COLUMN,
+) -> List[Tuple[datetime.datetime, tuple, int]]:
+    """Number of scans per hour and per value of `columns`, in one grouped query.
+
+    Same hours as `fetchHourlyCounts`, returns `(hour start, values, count)`.
+    """
+
+    dialect = source.dialect
+    bucket = dialect.hourBucket(column)
+    names = ", ".join(f"[{name}]" for name in columns)
+    query = (
+        f"select {bucket} as [hour], {names}, count(*) as [count] "
+        f"from {dialect.table(table)} where [{column}] >= ? and [{column}] < ? "
+        f"group by {bucket}, {names}"
+    )
+    rows = []
+    for row in source.fetchall(query, [start, end]):
+        hour = row[0]
+        if isinstance(hour, str):
+            hour = datetime.datetime.fromisoformat(hour)
+        rows.append((hour, tuple(row[1:-1]), int(row[-1])))
+    return rows
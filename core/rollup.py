@@ -0,0 +1,122 @@
+"""
+Hourly rollup table on the SQL Server.
+
+`tbl_ProductionHourly` holds one row per closed hour with the number of
+production (`phour`) and storage (`fg`) scans of that hour. Every run upserts the
+hours closed since the last row, plus the last `ROLLUP_REFRESH_HOURS` again for
+the scans that arrive late, and the reports are counted from the rollup instead
+of the growing scan tables.
+
+The table is created on first use (needs create table permission). Hours are
+`hour <= scan < hour + 1`, the same buckets as `fetchHourlyCounts`.
+
+"""
+
+import datetime
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
+from .queries import (
+    PRODUCTION_COLUMN,
+    PRODUCTION_TABLE,
+    STORAGE_COLUMN,
+    STORAGE_TABLE,
+    fetchHourlyCounts,
+)
+
+if TYPE_CHECKING:
+    from .database import DataSource
+
+ROLLUP_TABLE = "tbl_ProductionHourly"
+ROLLUP_DEFINITION = (
+    "[hour] datetime not null primary key, "
+    "[phour] int not null, "
+    "[fg] int not null, "
+    "[updated] datetime not null"
+)
+ROLLUP_COLUMNS = ["phour", "fg", "updated"]
+
+
+def _datetime(value) -> datetime.datetime:
+    if isinstance(value, str):
+        return datetime.datetime.fromisoformat(value)
+    return value
+
+
+def lastRollupHour(source: "DataSource"):
+    """Start of the latest hour in the rollup, `None` if it is empty."""
+
+    row = source.fetchone(
+        f"select max([hour]) from {source.dialect.table(ROLLUP_TABLE)}"
+    )
+    return _datetime(row[0]) if row[0] is not None else None
+
+
+def updateRollup(
+    source: "DataSource",
+    end: datetime.datetime,
+    backfill_start: datetime.datetime,
+    refresh_hours: int = 2,
+) -> int:
+    """Upsert the closed hours before `end` that are new or recent.
+
+    An empty rollup is filled from `backfill_start`, so are the gaps older than
+    that. Returns the number of hours written.
+    """
+
+    dialect = source.dialect
+    source.execute(dialect.createTableQuery(ROLLUP_TABLE, ROLLUP_DEFINITION))
+
+    start = backfill_start
+    last = lastRollupHour(source)
+    if last is not None:
+        start = max(last + datetime.timedelta(hours=1 - refresh_hours), start)
+    if start >= end:
+        return 0
+
+    hours = int((end - start).total_seconds() // 3600)
+    counts = {start + datetime.timedelta(hours=i): [0, 0] for i in range(hours)}
+    for index, (table, column) in enumerate(
+        [(PRODUCTION_TABLE, PRODUCTION_COLUMN), (STORAGE_TABLE, STORAGE_COLUMN)]
+    ):
+        for hour, count in fetchHourlyCounts(source, start, end, table, column):
+            if hour in counts:
+                counts[hour][index] = count
+
+    now = datetime.datetime.now()
+    rows = [(hour, phour, fg, now) for hour, (phour, fg) in counts.items()]
+    source.executemany(dialect.upsertQuery(ROLLUP_TABLE, "hour", ROLLUP_COLUMNS), rows)
+    source.commit()
+    return len(rows)
+
+
+def fetchRollupCounts(
+    source: "DataSource",
+    hourly_sdate: datetime.datetime,
+    hourly_edate: datetime.datetime,
+    start_date: datetime.datetime,
+) -> Dict[str, int]:
+    """`phour`, `achieved` and `fg` of an hourly report, from the rollup."""
+
+    query = (
+        "select sum(case when [hour] = ? then [phour] end), sum([phour]), sum([fg]) "
+        f"from {source.dialect.table(ROLLUP_TABLE)} where [hour] >= ? and [hour] < ?"
+    )
+    row = source.fetchone(query, [hourly_sdate, start_date, hourly_edate])
+    return {
+        name: int(value or 0) for name, value in zip(("phour", "achieved", "fg"), row)
+    }
+
+
+def fetchRollupHours(
+    source: "DataSource", start: datetime.datetime, end: datetime.datetime
+) -> List[Tuple[datetime.datetime, int, int]]:
+    """`(hour, phour, fg)` rows of the hours `start <= hour < end`."""
+
+    query = (
+        f"select [hour], [phour], [fg] from {source.dialect.table(ROLLUP_TABLE)} "
+        "where [hour] >= ? and [hour] < ?"
+    )
+    return [
+        (_datetime(hour), int(phour), int(fg))
+        for hour, phour, fg in source.fetchall(query, [start, end])
+    ]
@@ -0,0 +1,60 @@
+"""
+Wall-clock aligned hourly scheduler for the resident (daemon) mode.
+
+"""
+
+import datetime
+import time
+from typing import Callable
+
+from .log_me import logMessage
+
+
+def hourSlot(now: datetime.datetime) -> datetime.datetime:
+    """Start of the hour `now` belongs to."""
+
+    return now.replace(minute=0, second=0, microsecond=0)
+
+
+def nextRunTime(
+    now: datetime.datetime, last_slot: datetime.datetime, offset: datetime.timedelta
+) -> datetime.datetime:
+    """Time of the next run, the hour after the last fired one plus `offset`."""
+
+    return max(last_slot + datetime.timedelta(hours=1), hourSlot(now)) + offset
+
+
+def runHourly(
+    job: Callable[[], None], offset_seconds: float = 2, max_sleep: float = 30
+) -> None:
+    """Run `job` at every hour boundary plus `offset_seconds`, forever.
+
+    * An hour is fired at most once, even if the clock is set back.
+    * After a sleep/hibernate or a forward clock jump, only the latest missed
+      hour is fired (immediately), older ones are skipped.
+    * Sleeps are capped to `max_sleep` so wall clock changes are noticed soon.
+    """
+
+    offset = datetime.timedelta(seconds=offset_seconds)
+
+    now = datetime.datetime.now()
+    # Started mid-hour: this hour is reported by the previous instance/scheduler
+    last_slot = hourSlot(now)
+    if now < last_slot + offset:
+        last_slot -= datetime.timedelta(hours=1)
+
+    while True:
+        now = datetime.datetime.now()
+        slot = hourSlot(now)
+
+        if slot > last_slot and now >= slot + offset:
+            last_slot = slot
+            try:
+                job()
+            except Exception as e:
+                logMessage(f"Scheduled execution failed.\n{e}")
+            continue
+
+        due = nextRunTime(now, last_slot, offset)
+        remaining = (due - now).total_seconds()
+        time.sleep(min(max(remaining, 0.05), max_sleep))
@@ -1,114 +1,524 @@
 """
-Main configurations of the application, this file needed to be loaded initially.
+Main configurations of the application.
+
+All values are held by one immutable `Config`, read as attributes of this module
+(`settings.UNITS`). `load()` builds it from `config.ini` once at start up (before
+the values are used) and `reload()` builds a new one when the file was modified,
+the running process picks it up at its next run. A `from core.settings import X`
+copy would keep the default.
+
+Invalid values are reported with the key and the reason. At start up they keep
+their default, a modified file with invalid values is not applied at all.
 
 """
 
 import configparser
 import os
+import re
+import threading
+from typing import List, NamedTuple, Optional, Tuple
 
-from . import ROOT, CONNECTION_STRING, LOG_SUNDAY, MIN_PRODUCTION, PRODUCTION_START_HOUR
-from .log_me import logMessage
+from . import ROOT
+from . import CONNECTION_STRING as _CONNECTION_STRING
+from . import LOG_SUNDAY as _LOG_SUNDAY
+from . import MIN_PRODUCTION as _MIN_PRODUCTION
+from . import PRODUCTION_START_HOUR as _PRODUCTION_START_HOUR
+from .database import SQLITE_PREFIX
+from .log_me import logMessage, setLogLevel
 
-if not os.path.exists(ROOT):
-    os.makedirs(ROOT)
+CONFIG_FILE = ROOT + "config.ini"
 
-SLACK_WH = None
-DISCORD_WH = None
-GOOGLE_WH = None
-SLACK_APP_TOKEN = None
-SLACK_CHANNEL_ID = None
-DISPLAY_HOUR_COUNT = 0
 
-DATABASE_NAME = "barcode"  # default
+class Sinks(NamedTuple):
+    """Destinations of a report."""
 
-is_api_available = False
+    discord: list = []
+    slack: list = []
+    google: list = []
+    slack_token: Optional[str] = None
+    slack_channel: Optional[str] = None
 
-config = configparser.ConfigParser(interpolation=None)
-exists = config.read(ROOT + "config.ini")
+    def __bool__(self) -> bool:
+        return bool(self.discord or self.slack or self.google or self.slack_token)
 
 
-if exists:
+class Unit(NamedTuple):
+    """A production unit, with its own SQL Server and report sinks."""
 
-    if config.has_section("SQL SERVER"):
+    key: str
+    """Identifier used for the local state folder, empty for the single unit."""
+    alias: str
+    name: str
+    connection_string: Optional[str]
+    database: str
+    sinks: Sinks
+
+
+class Config(NamedTuple):
+    """Every setting of the application, defaults until `config.ini` is loaded."""
+
+    CONNECTION_STRING: Optional[str] = _CONNECTION_STRING
+    DATABASE_NAME: str = "barcode"  # default
+
+    SLACK_WH: list = []
+    DISCORD_WH: list = []
+    GOOGLE_WH: list = []
+    WEBHOOK_TIMEOUT: Tuple[float, float] = (3.05, 10)  # (connect, read) seconds
+    SLACK_APP_TOKEN: Optional[str] = None
+    SLACK_CHANNEL_ID: Optional[str] = None
+
+    MIN_PRODUCTION: int = _MIN_PRODUCTION
+    LOG_SUNDAY: bool = _LOG_SUNDAY
+    PRODUCTION_START_HOUR: int = _PRODUCTION_START_HOUR  # 24 hour format (0-23)
+    DISPLAY_HOUR_COUNT: int = 0
+    INCREMENTAL_COUNT: bool = False
+    FULL_RECOUNT_HOURS: int = 6
+    BASELINE_DAYS: int = 28
+    PERIOD_TOTALS: bool = True
+    HOURLY_ROLLUP: bool = False
+    ROLLUP_REFRESH_HOURS: int = 2
+
+    UNIT_ALIAS: str = "Fortune Br"
+    UNIT_NAME: str = "Fortune Branch"
+    COMBINED_REPORT: bool = False
+    COMBINED_ALIAS: str = "All Units"
+    MAX_CONNECTIONS: int = 4
+    LOG_LEVEL: str = "info"
+
+    LIVE_POLL_SECONDS: int = 30
+    LIVE_MAX_POLL_SECONDS: int = 300
+    LIVE_MIN_UPDATE_SECONDS: int = 60
+    LIVE_RATE_MINUTES: int = 15
+
+    WATCHDOG_FLOOR: int = 5  # Scans per minute
+    WATCHDOG_MINUTES: int = 10
+    WATCHDOG_HOURS: int = 24  # From PRODUCTION_START_HOUR
+
+    BREAKDOWN_COLUMNS: Tuple[str, ...] = ()  # Empty: No breakdown
+    BREAKDOWN_SIZE: int = 3
+
+    METRICS_ENABLED: bool = True
+    METRICS_PORT: int = 0  # 0: No metrics endpoint
+    PROFILE_RUNS: bool = False
+
+    SNAPSHOT_PORT: int = 0  # 0: No snapshot endpoint
+    SNAPSHOT_HOST: str = "127.0.0.1"
+    SNAPSHOT_MAX_AGE_SECONDS: int = 15
+
+    UNITS: List[Unit] = []
+    """Units to report, a single one unless `[UNIT <key>]` sections are configured."""
+    SINKS: Sinks = Sinks()
+    """Sinks of the single unit, default for units and the combined report."""
+    is_api_available: bool = False
+
+
+_current = Config()
+_lock = threading.Lock()
+_mtime: Optional[int] = None
+"""Modification time (ns) of the loaded `config.ini`."""
+
+
+def __getattr__(name: str):
+    # `settings.X` reads the current config, swapped as a whole on reload
+    try:
+        return getattr(_current, name)
+    except AttributeError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+
+
+def current() -> Config:
+    """The config in use, a consistent snapshot of every value."""
+
+    return _current
+
+
+def override(**values) -> None:
+    """Replace some values of the config in use (benchmarks, tools)."""
+
+    global _current
+    with _lock:
+        _current = _current._replace(**values)
+
+
+def parseUrls(value: str, prefix: str) -> list:
+    """Valid urls from a comma or newline separated config value."""
+
+    urls = [url.strip() for url in value.replace("\n", ",").split(",")]
+    return [url for url in urls if url.startswith(prefix)]
+
+
+def connectionString(section: configparser.SectionProxy) -> str:
+    """ODBC connection string of a section with SERVER, DATABASE, UID and PWD.
+
+    A section with SQLITE (path of a SQLite file) is a local stand-in instead.
+    """
+
+    if "SQLITE" in section:
+        return SQLITE_PREFIX + section["SQLITE"]
+    return (
+        r"Driver={ODBC Driver 17 for SQL Server};"
+        rf'Server={section["SERVER"]};'
+        rf'Database={section["DATABASE"]};'
+        rf'uid={section["UID"]};'
+        rf'pwd={section["PWD"]};'
+        r"Integrated Security=false;"
+    )
+
+
+def parseUnit(key: str, section: configparser.SectionProxy, default: Sinks) -> Unit:
+    """Unit from a `[UNIT <key>]` section, sinks not given are taken from `default`."""
+
+    sinks = Sinks(
+        discord=parseUrls(section.get("DISCORD", ""), "https://discord"),
+        slack=parseUrls(section.get("SLACK", ""), "https://hooks.slack.com/services/"),
+        google=parseUrls(section.get("GOOGLE", ""), "https://chat.googleapis.com"),
+        slack_token=section.get("SLACK_BOT_TOKEN"),
+        slack_channel=section.get("SLACK_CHANNEL_ID"),
+    )
+    if sinks.slack_token and not sinks.slack_token.startswith("xoxb"):
+        sinks = sinks._replace(slack_token=None)
+    if not sinks:
+        sinks = default
+
+    return Unit(
+        key=key,
+        alias=section.get("UNIT_ALIAS", key),
+        name=section.get("UNIT_NAME", key),
+        connection_string=connectionString(section),
+        database=section.get("DATABASE"),
+        sinks=sinks,
+    )
+
+
+def slackToken(channel_id: str) -> Optional[str]:
+    """Slack app token of the unit posting to the channel."""
+
+    config = _current
+    for sinks in [config.SINKS] + [unit.sinks for unit in config.UNITS]:
+        if sinks.slack_token and sinks.slack_channel == channel_id:
+            return sinks.slack_token
+    return config.SLACK_APP_TOKEN
+
+
+class _Reader:
+    """Typed values of a `config.ini`, invalid ones are collected in `errors`."""
+
+    def __init__(self, config: configparser.ConfigParser):
+        self.config = config
+        self.errors: List[str] = []
+
+    def _value(self, section: str, key: str) -> Optional[str]:
+        if not self.config.has_option(section, key):
+            return None
+        return self.config.get(section, key).strip()
+
+    def integer(
+        self,
+        section: str,
+        key: str,
+        default: int,
+        minimum: Optional[int] = None,
+        maximum: Optional[int] = None,
+    ) -> int:
+        value = self._value(section, key)
+        if value is None:
+            return default
+        try:
+            number = int(value)
+        except ValueError:
+            self.errors.append(f'[{section}] {key}: "{value}" is not a whole number')
+            return default
+        if (minimum is not None and number < minimum) or (
+            maximum is not None and number > maximum
+        ):
+            limits = "..".join("" if x is None else str(x) for x in (minimum, maximum))
+            self.errors.append(f"[{section}] {key}: {number} is not in {limits}")
+            return default
+        return number
+
+    def number(self, section: str, key: str, default: float) -> float:
+        value = self._value(section, key)
+        if value is None:
+            return default
+        try:
+            number = float(value)
+        except ValueError:
+            self.errors.append(f'[{section}] {key}: "{value}" is not a number')
+            return default
+        if number <= 0:
+            self.errors.append(f"[{section}] {key}: {number} must be over 0")
+            return default
+        return number
+
+    def flag(self, section: str, key: str, default: bool) -> bool:
+        value = self._value(section, key)
+        if value is None:
+            return default
         try:
-            DATABASE_NAME = config["SQL SERVER"]["DATABASE"]
-            CONNECTION_STRING = (
-                r"Driver={ODBC Driver 17 for SQL Server};"
-                rf'Server={config["SQL SERVER"]["SERVER"]};'
-                rf"Database={DATABASE_NAME};"
-                rf'uid={config["SQL SERVER"]["UID"]};'
-                rf'pwd={config["SQL SERVER"]["PWD"]};'
-                r"Integrated Security=false;"
+            return int(value) != 0
+        except ValueError:
+            pass
+        if value.lower() in self.config.BOOLEAN_STATES:
+            return self.config.BOOLEAN_STATES[value.lower()]
+        self.errors.append(f'[{section}] {key}: "{value}" is not 0 or 1')
+        return default
+
+    def names(self, section: str, key: str, default: tuple) -> tuple:
+        """Comma separated column names, quoted in the queries as they are."""
+
+        value = self._value(section, key)
+        if value is None:
+            return default
+        names = tuple(name.strip() for name in value.split(",") if name.strip())
+        invalid = [name for name in names if not re.fullmatch(r"\w+", name)]
+        if invalid:
+            self.errors.append(
+                f'[{section}] {key}: "{", ".join(invalid)}" is not a column name'
+            )
+            return default
+        return names
+
+    def choice(self, section: str, key: str, default: str, choices: tuple) -> str:
+        value = self._value(section, key)
+        if value is None:
+            return default
+        if value.lower() not in choices:
+            self.errors.append(
+                f'[{section}] {key}: "{value}" is not one of {", ".join(choices)}'
             )
+            return default
+        return value.lower()
+
+
+def parseConfig(config: configparser.ConfigParser) -> Tuple[Config, List[str]]:
+    """Config of a read `config.ini` and the errors of its invalid values.
+
+    Invalid values keep their default.
+    """
+
+    default = Config()
+    read = _Reader(config)
+    values = {}
+    is_api_available = False
+
+    if config.has_section("SQL SERVER"):
+        try:
+            values["CONNECTION_STRING"] = connectionString(config["SQL SERVER"])
+            values["DATABASE_NAME"] = config["SQL SERVER"].get("DATABASE")
         except KeyError as e:
-            CONNECTION_STRING = None
-            logMessage(f'Required key "{e.args[0]}" not found in configurations.')
+            values["CONNECTION_STRING"] = None
+            read.errors.append(f"[SQL SERVER] {e.args[0]}: required key not found")
 
     if config.has_section("SLACK APP"):
         try:
-            SLACK_APP_TOKEN = config["SLACK APP"]["BOT_TOKEN"]
-            SLACK_CHANNEL_ID = config["SLACK APP"]["CHANNEL_ID"]
-            if not SLACK_APP_TOKEN.startswith("xoxb"):
-                SLACK_APP_TOKEN = None
-            else:
+            token = config["SLACK APP"]["BOT_TOKEN"]
+            values["SLACK_CHANNEL_ID"] = config["SLACK APP"]["CHANNEL_ID"]
+            # Left unset while it is the placeholder of the sample config
+            if token.startswith("xoxb"):
+                values["SLACK_APP_TOKEN"] = token
                 is_api_available = True
         except KeyError as e:
-            SLACK_APP_TOKEN = None
-            logMessage(f'Required key "{e.args[0]}" not found in configurations.')
+            read.errors.append(f"[SLACK APP] {e.args[0]}: required key not found")
 
-    if config.has_option("WEBHOOK", "SLACK"):
-        value = config.get("WEBHOOK", "SLACK")
-        if value.startswith("https://hooks.slack.com/services/"):
-            SLACK_WH = value
-            is_api_available = True
+    for key, name, prefix in [
+        ("SLACK", "SLACK_WH", "https://hooks.slack.com/services/"),
+        ("DISCORD", "DISCORD_WH", "https://discord"),
+        ("GOOGLE", "GOOGLE_WH", "https://chat.googleapis.com"),
+    ]:
+        if config.has_option("WEBHOOK", key):
+            values[name] = parseUrls(config.get("WEBHOOK", key), prefix)
+            if values[name]:
+                is_api_available = True
 
-    if config.has_option("WEBHOOK", "DISCORD"):
-        value = config.get("WEBHOOK", "DISCORD")
-        if value.startswith("https://discord"):
-            DISCORD_WH = value
-            is_api_available = True
+    values["WEBHOOK_TIMEOUT"] = (
+        read.number("WEBHOOK", "CONNECT_TIMEOUT", default.WEBHOOK_TIMEOUT[0]),
+        read.number("WEBHOOK", "READ_TIMEOUT", default.WEBHOOK_TIMEOUT[1]),
+    )
 
-    if config.has_option("WEBHOOK", "GOOGLE"):
-        value = config.get("WEBHOOK", "GOOGLE")
-        if value.startswith("https://chat.googleapis.com"):
-            GOOGLE_WH = value
-            is_api_available = True
+    values.update(
+        LOG_SUNDAY=read.flag("GENERAL", "SUNDAY_ENABLE", default.LOG_SUNDAY),
+        MIN_PRODUCTION=read.integer(
+            "GENERAL", "MIN_PRODUCTION_LOGGING", default.MIN_PRODUCTION, 1
+        ),
+        PRODUCTION_START_HOUR=read.integer(
+            "GENERAL", "PRODUCTION_START_HOUR", default.PRODUCTION_START_HOUR, 0, 23
+        ),
+        DISPLAY_HOUR_COUNT=read.integer(
+            "GENERAL", "DISPLAY_HOUR_COUNT", default.DISPLAY_HOUR_COUNT, 0, 1
+        ),
+        INCREMENTAL_COUNT=read.flag(
+            "GENERAL", "INCREMENTAL_COUNT", default.INCREMENTAL_COUNT
+        ),
+        FULL_RECOUNT_HOURS=read.integer(
+            "GENERAL", "FULL_RECOUNT_HOURS", default.FULL_RECOUNT_HOURS, 1
+        ),
+        BASELINE_DAYS=read.integer(
+            "GENERAL", "BASELINE_DAYS", default.BASELINE_DAYS, 0
+        ),
+        PERIOD_TOTALS=read.flag("GENERAL", "PERIOD_TOTALS", default.PERIOD_TOTALS),
+        HOURLY_ROLLUP=read.flag("GENERAL", "HOURLY_ROLLUP", default.HOURLY_ROLLUP),
+        ROLLUP_REFRESH_HOURS=read.integer(
+            "GENERAL", "ROLLUP_REFRESH_HOURS", default.ROLLUP_REFRESH_HOURS, 0
+        ),
+        UNIT_ALIAS=config.get("GENERAL", "UNIT_ALIAS", fallback=default.UNIT_ALIAS),
+        UNIT_NAME=config.get("GENERAL", "UNIT_NAME", fallback=default.UNIT_NAME),
+        COMBINED_REPORT=read.flag(
+            "GENERAL", "COMBINED_REPORT", default.COMBINED_REPORT
+        ),
+        COMBINED_ALIAS=config.get(
+            "GENERAL", "COMBINED_ALIAS", fallback=default.COMBINED_ALIAS
+        ),
+        MAX_CONNECTIONS=read.integer(
+            "GENERAL", "MAX_CONNECTIONS", default.MAX_CONNECTIONS, 1
+        ),
+        LOG_LEVEL=read.choice(
+            "GENERAL",
+            "LOG_LEVEL",
+            default.LOG_LEVEL,
+            ("debug", "info", "warning", "error"),
+        ),
+        LIVE_POLL_SECONDS=read.integer(
+            "LIVE", "POLL_SECONDS", default.LIVE_POLL_SECONDS, 1
+        ),
+        LIVE_MAX_POLL_SECONDS=read.integer(
+            "LIVE", "MAX_POLL_SECONDS", default.LIVE_MAX_POLL_SECONDS, 1
+        ),
+        LIVE_MIN_UPDATE_SECONDS=read.integer(
+            "LIVE", "MIN_UPDATE_SECONDS", default.LIVE_MIN_UPDATE_SECONDS, 0
+        ),
+        LIVE_RATE_MINUTES=read.integer(
+            "LIVE", "RATE_MINUTES", default.LIVE_RATE_MINUTES, 1
+        ),
+        WATCHDOG_FLOOR=read.integer("WATCHDOG", "FLOOR", default.WATCHDOG_FLOOR, 1),
+        WATCHDOG_MINUTES=read.integer(
+            "WATCHDOG", "MINUTES", default.WATCHDOG_MINUTES, 1, 180
+        ),
+        WATCHDOG_HOURS=read.integer("WATCHDOG", "HOURS", default.WATCHDOG_HOURS, 1, 24),
+        BREAKDOWN_COLUMNS=read.names("BREAKDOWN", "COLUMNS", default.BREAKDOWN_COLUMNS),
+        BREAKDOWN_SIZE=read.integer("BREAKDOWN", "SIZE", default.BREAKDOWN_SIZE, 1, 10),
+        METRICS_ENABLED=read.flag("METRICS", "ENABLED", default.METRICS_ENABLED),
+        METRICS_PORT=read.integer("METRICS", "PORT", default.METRICS_PORT, 0, 65535),
+        PROFILE_RUNS=read.flag("METRICS", "PROFILE", default.PROFILE_RUNS),
+        SNAPSHOT_PORT=read.integer("SNAPSHOT", "PORT", default.SNAPSHOT_PORT, 0, 65535),
+        SNAPSHOT_HOST=config.get("SNAPSHOT", "HOST", fallback=default.SNAPSHOT_HOST),
+        SNAPSHOT_MAX_AGE_SECONDS=read.integer(
+            "SNAPSHOT", "MAX_AGE_SECONDS", default.SNAPSHOT_MAX_AGE_SECONDS, 1
+        ),
+    )
 
-    if config.has_option("GENERAL", "SUNDAY_ENABLE"):
-        value = config.get("GENERAL", "SUNDAY_ENABLE")
-        try:
-            if int(value) != 0:
-                LOG_SUNDAY = True
-        except:
-            pass  # Default value will consider
+    sinks = Sinks(
+        values.get("DISCORD_WH", []),
+        values.get("SLACK_WH", []),
+        values.get("GOOGLE_WH", []),
+        values.get("SLACK_APP_TOKEN"),
+        values.get("SLACK_CHANNEL_ID"),
+    )
 
-    if config.has_option("GENERAL", "MIN_PRODUCTION_LOGGING"):
-        value = config.get("GENERAL", "MIN_PRODUCTION_LOGGING")
+    units = []
+    for section in config.sections():
+        match = re.fullmatch(r"UNIT\s+(\w+)", section)
+        if not match:
+            continue
         try:
-            if int(value) > 0:
-                MIN_PRODUCTION = int(value)
-        except:
-            pass  # Default value will consider
+            unit = parseUnit(match.group(1), config[section], sinks)
+        except KeyError as e:
+            read.errors.append(f"[{section}] {e.args[0]}: required key not found")
+            continue
+        units.append(unit)
+        if unit.sinks:
+            is_api_available = True
 
-    if config.has_option("GENERAL", "PRODUCTION_START_HOUR"):
-        value = config.get("GENERAL", "PRODUCTION_START_HOUR")
-        try:
-            value = int(value)
-            if value >= 0 and value < 24:
-                PRODUCTION_START_HOUR = value
-        except:
-            pass  # Default value will consider
-    if config.has_option("GENERAL", "DISPLAY_HOUR_COUNT"):
-        value = config.get("GENERAL", "DISPLAY_HOUR_COUNT")
+    connection_string = values.get("CONNECTION_STRING", default.CONNECTION_STRING)
+    if not units and connection_string:
+        units.append(
+            Unit(
+                "",
+                values["UNIT_ALIAS"],
+                values["UNIT_NAME"],
+                connection_string,
+                values.get("DATABASE_NAME", default.DATABASE_NAME),
+                sinks,
+            )
+        )
+
+    loaded = default._replace(
+        **values, UNITS=units, SINKS=sinks, is_api_available=is_api_available
+    )
+    return loaded, read.errors
+
+
+def _modified() -> Optional[int]:
+    try:
+        return os.stat(CONFIG_FILE).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _apply(config: Config, mtime: Optional[int]) -> None:
+    global _current, _mtime
+
+    _current = config
+    _mtime = mtime
+    setLogLevel(config.LOG_LEVEL)
+
+
+def load() -> None:
+    """Read `config.ini` from `ROOT`, missing or invalid values keep the default."""
+
+    if not os.path.exists(ROOT):
+        os.makedirs(ROOT)
+
+    with _lock:
+        mtime = _modified()
+        config = configparser.ConfigParser(interpolation=None)
+        exists = config.read(CONFIG_FILE)
+
+        if not exists:
+            _apply(Config(), mtime)
+            logMessage("Configuration file missing, Exiting..!")  # Then do not run
+            return
+
+        loaded, errors = parseConfig(config)
+        for error in errors:
+            logMessage(f"Invalid configuration, default used. {error}", "warning")
+        _apply(loaded, mtime)
+
+    if not loaded.is_api_available:
+        logMessage(
+            "No valid webhook configurations found. Failed to sent report.",
+            "warning",
+        )
+
+
+def reload() -> bool:
+    """Load `config.ini` again if it was modified since, returns if it was applied.
+
+    A file with invalid values (or not readable) is not applied, the config in
+    use is kept until the file is fixed.
+    """
+
+    global _mtime
+
+    mtime = _modified()
+    if mtime is None or mtime == _mtime:
+        return False
+
+    with _lock:
+        config = configparser.ConfigParser(interpolation=None)
         try:
-            value = int(value)
-            if value == 1:
-                DISPLAY_HOUR_COUNT = value
-        except:
-            pass  # Default value will consider
-
-    if not is_api_available:
-        logMessage("No valid webhook configurations found. Failed to sent report.")
-else:
-    CONNECTION_STRING = None
-    logMessage("Configuration file missing, Exiting..!")  # Then do not run
+            config.read(CONFIG_FILE)
+            loaded, errors = parseConfig(config)
+        except configparser.Error as e:
+            loaded, errors = None, [str(e)]
+
+        if errors:
+            # Not retried until the file is modified again
+            _mtime = mtime
+            for error in errors:
+                logMessage(f"Configuration not reloaded. {error}")
+            return False
+
+        _apply(loaded, mtime)
+
+    logMessage("Configuration reloaded.", "info")
+    return True
@@ -0,0 +1,204 @@
+"""
+Production right now, served as json for dashboards.
+
+`GET /snapshot` answers the production of the day so far, the hourly log and its
+summary of every unit from a cache in memory, refreshed at most once every
+`SNAPSHOT_MAX_AGE_SECONDS`. A refresh first polls the latest scan times, the
+counts are queried only if scans (production or storage) arrived since the
+previous one.
+
+Requests coming while the cache is stale wait for one refresh (single flight)
+instead of querying each, so any number of clients cost one query per unit.
+The body has an `ETag`, a client sending it back as `If-None-Match` gets a bodiless
+304 until the production changes.
+
+"""
+
+import datetime
+import hashlib
+import json
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, Optional, Tuple
+
+from . import settings
+from .log_me import logMessage
+from .production import HourlyStats, Production
+from .queries import ChangeMarker, fetchChangeMarker, fetchCounts, liveMeasures
+from .settings import Unit
+from .store import loadHourlyProductionLog, loadHourlyStats
+from .utils import getDailyProductionDate
+
+if TYPE_CHECKING:
+    from .database import ConnectionPool
+
+
+class SnapshotCache:
+    """Body built by `refresh`, rebuilt by a single caller once `max_age` passed.
+
+    If a refresh fails the previous body is served, the next refresh is tried
+    `max_age` later.
+    """
+
+    def __init__(self, refresh: Callable[[], bytes], max_age: float):
+        self.refresh = refresh
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._body: Optional[bytes] = None
+        self._etag = ""
+        self._attempted = float("-inf")
+        self._flight: Optional[threading.Event] = None
+        """Set when the refresh in progress is done."""
+
+    def get(self) -> Optional[Tuple[bytes, str]]:
+        """Current body and its ETag, `None` if there never was a successful refresh."""
+
+        with self._lock:
+            if time.monotonic() - self._attempted < self.max_age:
+                return (self._body, self._etag) if self._body is not None else None
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = threading.Event()
+
+        if not leader:
+            flight.wait()
+        else:
+            try:
+                body = self.refresh()
+                etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+                with self._lock:
+                    self._body, self._etag = body, etag
+            except Exception as e:
+                logMessage(f"Snapshot not refreshed.\n{e}", "warning")
+            finally:
+                with self._lock:
+                    self._attempted = time.monotonic()
+                    self._flight = None
+                flight.set()
+
+        with self._lock:
+            if self._body is None:
+                return None
+            return self._body, self._etag
+
+
+def _production(prod: Production) -> dict:
+    return {
+        "date": prod.date.isoformat(),
+        "time": prod.time.isoformat(),
+        "achieved": prod.achieved,
+        "fg": prod.fg,
+        "phour": prod.phour,
+        "backfilled": prod.backfilled,
+    }
+
+
+class Snapshot:
+    """Refresh of the snapshot of every unit, counts kept while no scans arrive."""
+
+    def __init__(self, pool: "ConnectionPool"):
+        self.pool = pool
+        self._counts: Dict[str, tuple] = {}
+        """Change marker, hour and counts of each unit at its last query."""
+
+    def _unitCounts(
+        self, unit: Unit, start_date: datetime.datetime, now: datetime.datetime
+    ) -> Tuple[ChangeMarker, dict]:
+        # Own connection, the unit's one may be in use by a run or the live mode
+        key = f"{unit.key}:snapshot"
+        with self.pool.connection(key, unit.connection_string, unit.database) as source:
+            try:
+                source.open()
+                marker = fetchChangeMarker(source, start_date)
+                hour = now.replace(minute=0, second=0, microsecond=0)
+                last = self._counts.get(unit.key)
+                if last and last[:2] == (marker, hour):
+                    return marker, last[2]
+                counts = {"achieved": 0, "phour": 0, "recent": 0, "fg": 0}
+                if any(marker):
+                    counts = fetchCounts(
+                        source,
+                        liveMeasures(start_date, now, settings.LIVE_RATE_MINUTES),
+                    )
+            except Exception:
+                source.invalidate()
+                raise
+        self._counts[unit.key] = (marker, hour, counts)
+        return marker, counts
+
+    def unit(self, unit: Unit, now: datetime.datetime) -> dict:
+        start_date, end_date = getDailyProductionDate(now)
+        marker, counts = self._unitCounts(unit, start_date, now)
+
+        prod_log = loadHourlyProductionLog(start_date, unit.key)
+        summary = None
+        if prod_log:
+            stats = loadHourlyStats(start_date, unit.key)
+            if stats.count != len(prod_log):
+                stats = HourlyStats.from_log(prod_log)
+            summary = stats.to_dict(prod_log[stats.last_time].phour_count)
+            summary["top"] = _production(prod_log[stats.top_time])
+
+        return {
+            "unit": unit.key,
+            "alias": unit.alias,
+            "name": unit.name,
+            "day": {"start": start_date.isoformat(), "end": end_date.isoformat()},
+            "latest_scan": (
+                marker.production.isoformat() if marker.production else None
+            ),
+            "production": counts,
+            "hourly": [_production(prod_log[hour]) for hour in sorted(prod_log)],
+            "summary": summary,
+        }
+
+    def __call__(self) -> bytes:
+        now = datetime.datetime.now()
+        units = [self.unit(unit, now) for unit in settings.UNITS]
+        return json.dumps({"units": units}, default=str).encode()
+
+
+def serveSnapshot(pool: "ConnectionPool", host: str, port: int) -> None:
+    """Serve `/snapshot` in a background thread."""
+
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    cache = SnapshotCache(Snapshot(pool), settings.SNAPSHOT_MAX_AGE_SECONDS)
+
+    class _SnapshotHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0].rstrip("/") != "/snapshot":
+                self.send_error(404)
+                return
+            current = cache.get()
+            if current is None:
+                self.send_error(503, "Production not available yet")
+                return
+
+            body, etag = current
+            matches = self.headers.get("If-None-Match", "")
+            not_modified = matches.strip() == "*" or etag in [
+                tag.strip().removeprefix("W/") for tag in matches.split(",")
+            ]
+            self.send_response(304 if not_modified else 200)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", f"max-age={int(cache.max_age)}")
+            if not_modified:
+                self.end_headers()
+                return
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer((host, port), _SnapshotHandler)
+    except OSError as e:
+        logMessage(f"Snapshot endpoint not started on {host}:{port}.\n{e}")
+        return
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
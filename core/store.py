@@ -0,0 +1,261 @@
+"""
+Hourly production store.
+
+One small binary file per production day (`hourly/YYYYMMDD.bin`) holding a fixed
+width record per hour, so a run only reads the current day. The running figures
+of the day (`HourlyStats`) are kept next to it (`hourly/YYYYMMDD.stats`) and
+updated with each hour. Both are written under a file lock.
+
+A new hour is appended in place to the day file. The file is rewritten whole
+(temp file + rename) only when an hour is replaced or comes before the last one
+(backfilled hours), or when the day starts; the figures of the day are then
+recounted. A record torn by a crash while appending is ignored when read and
+cut off by the next append.
+
+Version 2 records carry flags (backfilled hour), version 1 files are still read
+and rewritten as version 2 on the next save. The previous `production.pickle` is
+still read, days missing in the store are imported from it on first load.
+
+"""
+
+import datetime
+import os
+import pickle
+import struct
+from typing import Dict, Iterable, List, Optional
+
+from . import ROOT
+from .filelock import FileLock
+from .log_me import logMessage
+from .production import HourlyStats, Production
+from .utils import stateDir, writeFileAtomic
+
+STORE_DIR = "hourly/"
+"""Store folder, inside the state folder of the unit."""
+LEGACY_FILE = ROOT + "production.pickle"
+
+HEADER = struct.Struct("<4sB3x")
+MAGIC = b"FBRH"
+VERSION = 2
+
+RECORD = struct.Struct("<qIIII")
+"""time (seconds since `EPOCH`), phour, achieved, fg, flags"""
+RECORD_V1 = struct.Struct("<qIII")
+"""Version 1 record, without flags."""
+BACKFILLED = 0x1
+"""Flag of an hour counted afterwards (see `core/backfill.py`)."""
+EPOCH = datetime.datetime(1970, 1, 1)
+
+STATS_MAGIC = b"FBRS"
+STATS_VERSION = 1
+STATS = struct.Struct("<IqddIIqdqII")
+"""`HourlyStats` fields, times as seconds since `EPOCH` (-1: None)."""
+
+
+def _storeDir(unit: str) -> str:
+    return stateDir(unit) + STORE_DIR
+
+
+def _partitionPath(day: datetime.datetime, unit: str) -> str:
+    return f"{_storeDir(unit)}{day:%Y%m%d}.bin"
+
+
+def _statsPath(day: datetime.datetime, unit: str) -> str:
+    return f"{_storeDir(unit)}{day:%Y%m%d}.stats"
+
+
+def _lock(unit: str) -> FileLock:
+    return FileLock(_storeDir(unit) + ".lock")
+
+
+def _encodeRecords(productions: Iterable[Production]) -> bytes:
+    records = []
+    for p in sorted(productions, key=lambda p: p.time):
+        flags = BACKFILLED if p.backfilled else 0
+        records.append(RECORD.pack(_seconds(p.time), p.phour, p.achieved, p.fg, flags))
+    return b"".join(records)
+
+
+def _encode(day: datetime.datetime, productions: List[Production]) -> bytes:
+    return HEADER.pack(MAGIC, VERSION) + _encodeRecords(productions)
+
+
+def _decode(day: datetime.datetime, data: bytes) -> Dict[datetime.datetime, Production]:
+    magic, version = HEADER.unpack_from(data)
+    if magic != MAGIC or version not in (1, VERSION):
+        raise ValueError(f"Unknown hourly store format ({magic}, {version})")
+
+    record = RECORD if version == VERSION else RECORD_V1
+    hourly_log = {}
+    end = len(data) - (len(data) - HEADER.size) % record.size
+    for seconds, phour, achieved, fg, *flags in record.iter_unpack(
+        data[HEADER.size : end]
+    ):
+        time = EPOCH + datetime.timedelta(seconds=seconds)
+        hourly_log[time] = Production(
+            date=day,
+            time=time,
+            achieved=achieved,
+            fg=fg,
+            phour=phour,
+            backfilled=bool(flags and flags[0] & BACKFILLED),
+        )
+    return hourly_log
+
+
+def _seconds(time: Optional[datetime.datetime]) -> int:
+    return -1 if time is None else int((time - EPOCH).total_seconds())
+
+
+def _time(seconds: int) -> Optional[datetime.datetime]:
+    return None if seconds < 0 else EPOCH + datetime.timedelta(seconds=seconds)
+
+
+def _encodeStats(stats: HourlyStats) -> bytes:
+    record = list(stats.to_tuple())
+    for index in (6, 8):  # top_time, last_time
+        record[index] = _seconds(record[index])
+    return HEADER.pack(STATS_MAGIC, STATS_VERSION) + STATS.pack(*record)
+
+
+def _decodeStats(data: bytes) -> HourlyStats:
+    magic, version = HEADER.unpack_from(data)
+    if magic != STATS_MAGIC or version != STATS_VERSION:
+        raise ValueError(f"Unknown hourly stats format ({magic}, {version})")
+    record = list(STATS.unpack_from(data, HEADER.size))
+    for index in (6, 8):
+        record[index] = _time(record[index])
+    return HourlyStats.from_tuple(record)
+
+
+def _loadLegacy(day: datetime.datetime) -> Dict[datetime.datetime, Production]:
+    """Hours of the production day from the old pickle file."""
+
+    try:
+        with open(LEGACY_FILE, "rb") as f:
+            hourly_log = pickle.load(f)
+    except (FileNotFoundError, EOFError):
+        return {}
+    except Exception as e:
+        logMessage(f"Failed to load previous production log.\n{e}")
+        return {}
+
+    return {key: p for key, p in hourly_log.items() if p.date == day}
+
+
+def loadHourlyProductionLog(
+    day: datetime.datetime, unit: str = ""
+) -> Dict[datetime.datetime, Production]:
+    """Get hourly logging of the production day (starting at `day`)."""
+
+    path = _partitionPath(day, unit)
+    try:
+        with open(path, "rb") as f:
+            return _decode(day, f.read())
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logMessage(f"Failed to load previous production log.\n{e}")
+        return {}
+
+    hourly_log = _loadLegacy(day) if not unit else {}
+    if hourly_log:
+        try:
+            with _lock(unit):
+                if not os.path.exists(path):
+                    writeFileAtomic(path, _encode(day, list(hourly_log.values())))
+        except Exception as e:
+            logMessage(f"Failed to import previous production log.\n{e}")
+
+    return hourly_log
+
+
+def appendHourlyProductionLog(prod: Production, unit: str = "") -> None:
+    """Add (or replace) the hour of `prod` in its production day."""
+
+    mergeHourlyProductionLog([prod], unit)
+
+
+def _appendRecords(path: str, productions: List[Production], count: int) -> bool:
+    """Append the hours to the day file in place.
+
+    Returns `False` (nothing written) if the file does not hold `count` version 2
+    records or an hour is not after its last one, it has to be rewritten then.
+    """
+
+    try:
+        with open(path, "r+b") as f:
+            if f.read(HEADER.size) != HEADER.pack(MAGIC, VERSION):
+                return False
+            size = f.seek(0, os.SEEK_END)
+            end = size - (size - HEADER.size) % RECORD.size
+            if (end - HEADER.size) // RECORD.size != count:
+                return False
+            if count:
+                f.seek(end - RECORD.size)
+                last = RECORD.unpack(f.read(RECORD.size))[0]
+                if _seconds(productions[0].time) <= last:
+                    return False
+            # Torn record of a crash while appending
+            f.truncate(end)
+            f.seek(end)
+            f.write(_encodeRecords(productions))
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def mergeHourlyProductionLog(productions: Iterable[Production], unit: str = "") -> None:
+    """Add (or replace) the hours of `productions`, all of the same production day."""
+
+    productions = sorted(productions, key=lambda p: p.time)
+    if not productions:
+        return
+    day = productions[0].date
+    path = _partitionPath(day, unit)
+    distinct = len({p.time for p in productions}) == len(productions)
+    try:
+        os.makedirs(_storeDir(unit), exist_ok=True)
+        with _lock(unit):
+            stats = _readStats(day, unit)
+            if (
+                stats is not None
+                and distinct
+                and _appendRecords(path, productions, stats.count)
+            ):
+                for prod in productions:
+                    stats.add(prod)
+            else:
+                try:
+                    with open(path, "rb") as f:
+                        hourly_log = _decode(day, f.read())
+                except FileNotFoundError:
+                    hourly_log = _loadLegacy(day) if not unit else {}
+                for prod in productions:
+                    hourly_log[prod.time] = prod
+                writeFileAtomic(path, _encode(day, list(hourly_log.values())))
+                # Hours replaced or older than the last one, the day is recounted
+                stats = HourlyStats.from_log(hourly_log)
+            writeFileAtomic(_statsPath(day, unit), _encodeStats(stats))
+    except Exception as e:
+        logMessage(f"Failed to save current production log. \n{e}")
+
+
+def _readStats(day: datetime.datetime, unit: str) -> Optional[HourlyStats]:
+    try:
+        with open(_statsPath(day, unit), "rb") as f:
+            return _decodeStats(f.read())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logMessage(f"Failed to load hourly stats.\n{e}", "warning")
+        return None
+
+
+def loadHourlyStats(day: datetime.datetime, unit: str = "") -> HourlyStats:
+    """Running figures of the production day, counted from its hours if not kept."""
+
+    stats = _readStats(day, unit)
+    if stats is None:
+        stats = HourlyStats.from_log(loadHourlyProductionLog(day, unit))
+    return stats
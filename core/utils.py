@@ -4,43 +4,31 @@ Utilities
 """
 
 import datetime
-from typing import TYPE_CHECKING, Tuple
+import os
+from typing import Tuple
 
-import pickle
+from . import ROOT, settings
 
-from .settings import PRODUCTION_START_HOUR
-from .log_me import logMessage
-from . import ROOT
 
+def stateDir(unit: str = "") -> str:
+    """Folder of the local state files of a unit, `ROOT` for the single unit."""
 
-if TYPE_CHECKING:
-    from .production import Production
+    if not unit:
+        return ROOT
+    path = f"{ROOT}units/{unit}/"
+    os.makedirs(path, exist_ok=True)
+    return path
 
 
-def loadHourlyProductionLog() -> dict[datetime.datetime, "Production"]:
-    """Get hourly logging from previously saved local file"""
+def writeFileAtomic(path: str, data: bytes) -> None:
+    """Write the file completely or not at all (temp file + rename)."""
 
-    hourly_log = {}
-
-    try:
-        with open(ROOT + "production.pickle", "rb") as f:
-            hourly_log = pickle.load(f)
-    except FileNotFoundError or EOFError:
-        pass
-    except Exception as e:
-        logMessage(f"Failed to load previous production log.\n{e}")
-
-    return hourly_log
-
-
-def saveHourlyProductionLog(data: dict) -> None:
-    """Saves the current latest log in the file"""
-
-    try:
-        with open(ROOT + "production.pickle", "w+b") as f:
-            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
-    except Exception as e:
-        logMessage(f"Failed to save current production log. \n{e}")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
 
 
 def getDailyProductionDate(cur_datetime) -> Tuple[datetime.datetime]:
@@ -49,16 +37,13 @@ def getDailyProductionDate(cur_datetime) -> Tuple[datetime.datetime]:
     8am to 8am (next day)
     """
 
-    # New day production logging start at 9am (8am-9am) by default
-    logtime = datetime.time(PRODUCTION_START_HOUR + 1)
-
-    if cur_datetime.time() < logtime:
-        sday = cur_datetime.date() - datetime.timedelta(days=1)
-    else:
-        sday = cur_datetime.date()
+    # New day production logging start at 9am (8am-9am) by default, counted
+    # back from the current time so a start hour of 23 logs from midnight
+    logtime = datetime.timedelta(hours=settings.PRODUCTION_START_HOUR + 1)
+    sday = (cur_datetime - logtime).date()
 
     eday = sday + datetime.timedelta(days=1)
-    time_period = datetime.time(PRODUCTION_START_HOUR, 0)
+    time_period = datetime.time(settings.PRODUCTION_START_HOUR, 0)
     start_date = datetime.datetime.combine(sday, time_period)
     end_date = datetime.datetime.combine(eday, time_period)
     return (start_date, end_date)
@@ -0,0 +1,122 @@
+"""
+Stalled lines, noticed within minutes instead of at the next hourly report.
+
+Every closed minute the scans of that minute are counted with a single measure
+query (the same prepared statement every minute) and kept in a ring buffer of
+the last `WATCHDOG_MINUTES` minutes. A unit is stalled once each of these
+minutes has less than `WATCHDOG_FLOOR` scans: an alert is sent once, then a
+recovery message as soon as a minute reaches the floor again.
+
+Only the production hours are watched, `WATCHDOG_HOURS` from
+`PRODUCTION_START_HOUR` and not on Sunday with `SUNDAY_ENABLE` (as the Google
+reports). Memory and queries per minute stay the same however long it runs.
+
+"""
+
+import datetime
+from array import array
+from typing import TYPE_CHECKING, List, NamedTuple, Optional
+
+from . import settings
+from .queries import PRODUCTION_COLUMN, PRODUCTION_TABLE, CountMeasure, fetchCounts
+
+if TYPE_CHECKING:
+    from .database import DataSource
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+STALLED = "stalled"
+RECOVERED = "recovered"
+
+
+def _minuteNumber(minute: datetime.datetime) -> int:
+    return int((minute - EPOCH).total_seconds() // 60)
+
+
+class MinuteRing:
+    """Scans of the last `size` minutes, each slot stamped with its minute."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._stamps = array("q", [-1] * size)
+        self._counts = array("q", [0] * size)
+
+    def add(self, minute: datetime.datetime, count: int) -> None:
+        number = _minuteNumber(minute)
+        self._stamps[number % self.size] = number
+        self._counts[number % self.size] = count
+
+    def last(self, minute: datetime.datetime, count: int) -> List[Optional[int]]:
+        """Scans of the `count` minutes upto `minute`, `None` if not counted."""
+
+        end = _minuteNumber(minute)
+        return [
+            (
+                self._counts[number % self.size]
+                if self._stamps[number % self.size] == number
+                else None
+            )
+            for number in range(end - min(count, self.size) + 1, end + 1)
+        ]
+
+
+def isWatched(now: datetime.datetime) -> bool:
+    """Whether `now` is in the production hours watched."""
+
+    hours = (now.hour - settings.PRODUCTION_START_HOUR) % 24
+    if hours >= settings.WATCHDOG_HOURS:
+        return False
+    shift_start = now - datetime.timedelta(hours=hours)
+    return not (settings.LOG_SUNDAY and shift_start.weekday() == 6)
+
+
+def fetchMinuteCount(source: "DataSource", minute: datetime.datetime) -> int:
+    """Production scans of the minute starting at `minute`."""
+
+    end = minute + datetime.timedelta(minutes=1)
+    measure = CountMeasure(
+        "minute", PRODUCTION_TABLE, PRODUCTION_COLUMN, minute, end, False
+    )
+    return fetchCounts(source, [measure])["minute"]
+
+
+class StallEvent(NamedTuple):
+    kind: str
+    """`STALLED` or `RECOVERED`."""
+    since: datetime.datetime
+    """First minute under the floor."""
+    minute: datetime.datetime
+    """Minute that raised the event."""
+    count: int
+    """Scans of that minute."""
+
+
+class Watchdog:
+    """Stall state of a unit."""
+
+    def __init__(self):
+        self.ring = MinuteRing(settings.WATCHDOG_MINUTES)
+        self.stalled_since: Optional[datetime.datetime] = None
+        """First minute under the floor of the current stall."""
+
+    def update(self, minute: datetime.datetime, count: int) -> Optional[StallEvent]:
+        """Keep the scans of `minute`, returns the event if the state changed."""
+
+        self.ring.add(minute, count)
+
+        if self.stalled_since is not None:
+            if count >= settings.WATCHDOG_FLOOR:
+                since, self.stalled_since = self.stalled_since, None
+                return StallEvent(RECOVERED, since, minute, count)
+            return None
+
+        counts = self.ring.last(minute, self.ring.size)
+        if all(c is not None and c < settings.WATCHDOG_FLOOR for c in counts):
+            self.stalled_since = minute - datetime.timedelta(minutes=len(counts) - 1)
+            return StallEvent(STALLED, self.stalled_since, minute, count)
+        return None
+
+    def reset(self) -> None:
+        """Forget the stall, e.g. at the end of the production hours."""
+
+        self.stalled_since = None
@@ -0,0 +1,140 @@
+"""
+Watermarks for incremental counting.
+
+A watermark stores the running total of a day-to-date measure (`achieved`, `fg`)
+and the time it was counted upto. Next run only counts the scans after that
+time and adds them to the total, so the cost of a run stays the same through
+the day. Every `FULL_RECOUNT_HOURS` runs the whole day is counted again, which
+also picks up the scans that arrived late (stamped before the watermark).
+
+"""
+
+import datetime
+import json
+from typing import Dict, Iterable, List, NamedTuple
+
+from .log_me import logMessage
+from .queries import CountMeasure
+from .utils import stateDir, writeFileAtomic
+
+WATERMARK_FILE = "watermark.json"
+"""File name, inside the state folder of the unit."""
+DAY_MEASURES = ("achieved", "fg")
+"""Day-to-date measures that are counted incrementally."""
+
+
+class Watermark(NamedTuple):
+    """Running total of a measure."""
+
+    day: datetime.datetime
+    """Production day start the total belongs to."""
+    until: datetime.datetime
+    """Scans counted upto (inclusive) this time."""
+    total: int
+    """Count from day start upto `until`."""
+    runs: int = 0
+    """Incremental runs since the last full count."""
+
+
+def loadWatermarks(unit: str = "") -> Dict[str, Watermark]:
+    """Get watermarks from previously saved local file"""
+
+    watermarks = {}
+    try:
+        with open(stateDir(unit) + WATERMARK_FILE, "r") as f:
+            data = json.load(f)
+        for name, mark in data.items():
+            watermarks[name] = Watermark(
+                day=datetime.datetime.fromisoformat(mark["day"]),
+                until=datetime.datetime.fromisoformat(mark["until"]),
+                total=int(mark["total"]),
+                runs=int(mark.get("runs", 0)),
+            )
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        # Watermarks are only an optimization, a full count will be done
+        logMessage(f"Failed to load count watermarks.\n{e}")
+        watermarks = {}
+
+    return watermarks
+
+
+def saveWatermarks(watermarks: Dict[str, Watermark], unit: str = "") -> None:
+    """Saves the watermarks in the file"""
+
+    data = {
+        name: {
+            "day": mark.day.isoformat(),
+            "until": mark.until.isoformat(),
+            "total": mark.total,
+            "runs": mark.runs,
+        }
+        for name, mark in watermarks.items()
+    }
+    try:
+        writeFileAtomic(
+            stateDir(unit) + WATERMARK_FILE, json.dumps(data, indent=2).encode()
+        )
+    except Exception as e:
+        logMessage(f"Failed to save count watermarks.\n{e}")
+
+
+def incrementalMeasures(
+    measures: Iterable[CountMeasure],
+    watermarks: Dict[str, Watermark],
+    start_date: datetime.datetime,
+    full_recount: int,
+) -> List[CountMeasure]:
+    """Replace day-to-date measures by the count since their watermark.
+
+    A measure is counted fully again if it has no watermark for this production
+    day, the watermark is ahead of the measure (clock/rerun of an older hour) or
+    `full_recount` incremental runs were done since the last full count.
+    """
+
+    result = []
+    for measure in measures:
+        mark = watermarks.get(measure.name)
+        if (
+            measure.name in DAY_MEASURES
+            and measure.start == start_date
+            and mark is not None
+            and mark.day == start_date
+            and mark.until <= measure.end
+            and mark.runs < full_recount
+        ):
+            measure = measure._replace(start=mark.until, include_start=False)
+        result.append(measure)
+
+    return result
+
+
+def applyWatermarks(
+    measures: Iterable[CountMeasure],
+    counts: Dict[str, int],
+    watermarks: Dict[str, Watermark],
+    start_date: datetime.datetime,
+) -> Dict[str, int]:
+    """Turn the counts of `incrementalMeasures` into day-to-date totals.
+
+    Watermarks are moved forward in place, returns the corrected counts.
+    """
+
+    counts = dict(counts)
+    for measure in measures:
+        if measure.name not in DAY_MEASURES:
+            continue
+        if measure.start == start_date and measure.include_start:
+            # Full count of the day
+            watermarks[measure.name] = Watermark(
+                start_date, measure.end, counts[measure.name]
+            )
+        elif measure.name in watermarks and not measure.include_start:
+            mark = watermarks[measure.name]
+            counts[measure.name] += mark.total
+            watermarks[measure.name] = Watermark(
+                start_date, measure.end, counts[measure.name], mark.runs + 1
+            )
+
+    return counts
@@ -6,177 +6,914 @@ This program is designed for a private local SQL Server and all instructions pro
 Notes:
 --------------------------------
 * Root folder is set to "C:/fbr_prodcution/".
-* All exceptions are logged in `log.txt` file.
+* All exceptions are logged in `log.jsonl` file (see `core/log_me.py`).
 * **SQL Server, Webhook** configuration is expected in `config.ini` or default will be hard coded with application.
-* Hourly report is logged in `production.pickle`, *do not delete that*.
-* Total number of queries per execution is 3, expect a 4th with month cumulative in future.
+* Hourly report is logged per production day in `hourly/` folder, *do not delete that*.
+  Hours missed by the runs are backfilled with the next run (see `core/backfill.py`).
+* All counts of a run are fetched in a single aggregated query (see `core/queries.py`).
+* Hourly counts are also kept in `history/` (see `core/history.py`), week and month
+  to date totals of the summary are read from there instead of the scan tables.
+* With `HOURLY_ROLLUP`, closed hours are upserted in a `tbl_ProductionHourly` table
+  and every count is read from it instead of the scan tables (see `core/rollup.py`).
+* With `BREAKDOWN_COLUMNS`, reports also rank the lines/articles of the hour, counted
+  with one grouped query per run and kept per day in `breakdown/` (see
+  `core/breakdown.py`).
+* Reports are saved in `outbox/` until delivered, failed ones are retried later.
+* Timings of every stage of a run are saved in `metrics/` (see `core/metrics.py`).
+* Reports show the typical figures of the hour, taken from the last `BASELINE_DAYS`
+  days of `history/` (see `core/baseline.py`).
+* Several units (each with its own SQL Server and sinks) can be configured with
+  `[UNIT <key>]` sections, they are queried concurrently.
+* Run with `--daemon` to stay resident and report at every HH:00:02, keeping the
+  SQL connection and http sessions open between the hours.
+* Run with `--live` to keep one message per day (Slack app, Discord) updated as
+  the scans arrive.
+* Run with `--watch` to alert the sinks as soon as a line stalls, scans being
+  counted every minute (see `core/watchdog.py`).
+* Run with `--export FIRST_DAY LAST_DAY --output file.csv` to write the hourly
+  production of the days (`--daily`: one row per day) to CSV or Parquet, read
+  from `history/` and the database for the hours it lacks (see `core/export.py`).
+* With a `[SNAPSHOT] PORT`, the resident modes (and `--serve` alone) answer the
+  production right now as json on `/snapshot` (see `core/snapshot.py`).
 * To run the script, [odbc](https://docs.microsoft.com/en-us/sql/connect/odbc/download-odbc-driver-for-sql-server?view=sql-server-ver15) driver has to be installed.
 
 """
 
 
+import argparse
 import datetime
-import socket
-
-import pyodbc
-from core import PRODUCTION_START_HOUR
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
+from core import metrics, settings, snapshot
 from core.log_me import logMessage
-from core.settings import (
-    CONNECTION_STRING,
-    DISCORD_WH,
-    GOOGLE_WH,
-    SLACK_WH,
-    SLACK_APP_TOKEN,
-    SLACK_CHANNEL_ID,
-    LOG_SUNDAY,
-    MIN_PRODUCTION,
-    DATABASE_NAME,
-    PRODUCTION_START_HOUR,
+from core.settings import Sinks, Unit
+from core.breakdown import (
+    Breakdown,
+    combineBreakdowns,
+    loadBreakdown,
+    rankings,
+    updateBreakdown,
+)
+from core.backfill import backfillHours
+from core.baseline import (
+    baselineStart,
+    combineHistories,
+    computeBaseline,
+    loadHistory,
+    typicalHour,
+)
+from core.database import ConnectionPool
+from core.export import (
+    DAILY_FIELDS,
+    HOURLY_FIELDS,
+    Chunk,
+    dailyChunks,
+    exportProduction,
+    hourlyChunks,
+)
+from core.history import (
+    combineTotals,
+    periodStarts,
+    periodTotals,
+    recordHour,
+    reconcile,
+)
+from core.queries import (
+    fetchChangeMarker,
+    fetchCounts,
+    hourlyMeasures,
+    liveMeasures,
 )
+from core.rollup import fetchRollupCounts, updateRollup
 from core.production import (
     Production,
-    averageHourlyProduction,
+    HourlyStats,
     generateProductionSummary,
 )
-from core.utils import (
-    getDailyProductionDate,
+from core.scheduler import runHourly
+from core.store import (
+    appendHourlyProductionLog,
     loadHourlyProductionLog,
-    saveHourlyProductionLog,
+    loadHourlyStats,
 )
-from api.web_api import slack_api, webhook_request
+from core.utils import getDailyProductionDate
+from core.watchdog import StallEvent, Watchdog, fetchMinuteCount, isWatched
+from core.watermark import (
+    applyWatermarks,
+    incrementalMeasures,
+    loadWatermarks,
+    saveWatermarks,
+)
+from api import outbox
+from api.live import LiveBoard
+from api.web_api import dispatch
 from api.templates import (
     discord_template,
     google_template,
+    live_discord_template,
+    live_slack_template,
     slack_api_template,
     slack_template,
+    stall_discord_template,
+    stall_google_template,
+    stall_slack_template,
 )
 
+HourlyLog = Dict[datetime.datetime, Production]
+
+
+def collectProduction(
+    unit: Unit, pool: ConnectionPool, now: datetime.datetime
+) -> Optional[Tuple[Production, HourlyLog]]:
+    """Count the production of the unit upto this hour and log it.
+
+    Returns the current hour production and the hourly log of the production
+    day, `None` if the unit could not be queried.
+    """
+
+    start_date, end_date = getDailyProductionDate(now)
+
+    hourly_edate = now.replace(minute=0, second=0, microsecond=0)
+    hourly_sdate = hourly_edate - datetime.timedelta(hours=1)
+
+    with pool.connection(unit.key, unit.connection_string, unit.database) as source:
+        # Connecting SQL Server
+        try:
+            with metrics.stage("connect", unit=unit.key):
+                source.open()
+        except ConnectionError:
+            logMessage(f"Failed to connect SQL Server of {unit.alias}", unit=unit.key)
+            return None
+        except Exception as e:
+            logMessage(
+                f"Connection to server of {unit.alias} failed.\n{e}", unit=unit.key
+            )
+            return None
+
+        # Only the hours of current production day
+        with metrics.stage("state_load", name="hourly_log", unit=unit.key):
+            prod_log = loadHourlyProductionLog(start_date, unit.key)
+
+        prod_now = Production(time=hourly_edate, date=start_date)
+        # Query execution
+        try:
+            if settings.HOURLY_ROLLUP:
+                # Closed hours upserted in the rollup table, then counted from it
+                backfill_start = min(
+                    start_date - datetime.timedelta(days=settings.BASELINE_DAYS),
+                    *periodStarts(start_date).values(),
+                )
+                with metrics.stage("query", name="rollup_update", unit=unit.key):
+                    updateRollup(
+                        source,
+                        hourly_edate,
+                        backfill_start,
+                        settings.ROLLUP_REFRESH_HOURS,
+                    )
+                with metrics.stage("query", name="rollup_counts", unit=unit.key):
+                    counts = fetchRollupCounts(
+                        source, hourly_sdate, hourly_edate, start_date
+                    )
+            else:
+                # Current hour, upto this hour and FG upto this hour in one round trip
+                measures = hourlyMeasures(hourly_sdate, hourly_edate, start_date)
+                if settings.INCREMENTAL_COUNT:
+                    # Count only the scans since the last run
+                    with metrics.stage("state_load", name="watermarks", unit=unit.key):
+                        watermarks = loadWatermarks(unit.key)
+                    measures = incrementalMeasures(
+                        measures, watermarks, start_date, settings.FULL_RECOUNT_HOURS
+                    )
+                with metrics.stage("query", name="counts", unit=unit.key):
+                    counts = fetchCounts(source, measures)
+                if settings.INCREMENTAL_COUNT:
+                    counts = applyWatermarks(measures, counts, watermarks, start_date)
+                    with metrics.stage("state_save", name="watermarks", unit=unit.key):
+                        saveWatermarks(watermarks, unit.key)
+            prod_now.phour = counts["phour"]
+            prod_now.achieved = counts["achieved"]
+            prod_now.fg = counts["fg"]
+
+            try:
+                # Hours of the day missed by the runs, before this one is added
+                with metrics.stage("query", name="backfill", unit=unit.key):
+                    backfillHours(
+                        source,
+                        prod_log,
+                        start_date,
+                        hourly_edate,
+                        unit.key,
+                        settings.HOURLY_ROLLUP,
+                    )
+            except Exception as e:
+                logMessage(
+                    f"Missed hours of {unit.alias} not backfilled.\n{e}",
+                    "warning",
+                    unit=unit.key,
+                )
+
+            prod_log[hourly_edate] = prod_now
+            with metrics.stage("state_save", name="hourly_log", unit=unit.key):
+                appendHourlyProductionLog(prod_now, unit.key)
+
+            if settings.BREAKDOWN_COLUMNS:
+                try:
+                    # Hours of the day not kept yet (this one), one grouped query
+                    with metrics.stage("query", name="breakdown", unit=unit.key):
+                        updateBreakdown(
+                            source,
+                            start_date,
+                            hourly_edate,
+                            settings.BREAKDOWN_COLUMNS,
+                            unit.key,
+                        )
+                except Exception as e:
+                    logMessage(
+                        f"Breakdown of {unit.alias} not updated.\n{e}",
+                        "warning",
+                        unit=unit.key,
+                    )
+
+            if settings.BASELINE_DAYS or settings.PERIOD_TOTALS:
+                try:
+                    # Hours missing since the baseline/week/month start, then
+                    # this hour
+                    starts = []
+                    if settings.BASELINE_DAYS:
+                        starts.append(baselineStart(start_date, settings.BASELINE_DAYS))
+                    if settings.PERIOD_TOTALS:
+                        starts += periodStarts(start_date).values()
+                    with metrics.stage("query", name="history", unit=unit.key):
+                        reconcile(
+                            source,
+                            min(starts),
+                            hourly_sdate,
+                            unit.key,
+                            settings.HOURLY_ROLLUP,
+                        )
+                    with metrics.stage("state_save", name="history", unit=unit.key):
+                        recordHour(hourly_sdate, prod_now.phour, prod_now.fg, unit.key)
+                except Exception as e:
+                    logMessage(
+                        f"Hourly history of {unit.alias} not updated.\n{e}",
+                        "warning",
+                        unit=unit.key,
+                    )
+
+        except Exception as e:
+            # Connection may be broken, reconnect on next run
+            source.invalidate()
+            logMessage(f"Query execution of {unit.alias} failed.\n{e}", unit=unit.key)
+            return None
+
+    return prod_now, prod_log
+
+
+def combineProduction(
+    results: List[Tuple[Production, HourlyLog]],
+) -> Tuple[Production, HourlyLog]:
+    """Roll-up of the units, sum of their hourly figures."""
+
+    combined_log: HourlyLog = {}
+    for _, prod_log in results:
+        for time, prod in prod_log.items():
+            total = combined_log.setdefault(time, Production(date=prod.date, time=time))
+            total.phour += prod.phour
+            total.achieved += prod.achieved
+            total.fg += prod.fg
+            total.backfilled = total.backfilled or prod.backfilled
+
+    prod_now = combined_log[results[0][0].time]
+    return prod_now, combined_log
+
+
+def reportCalls(
+    sinks: Sinks,
+    prod_now: Production,
+    prod_log: HourlyLog,
+    now: datetime.datetime,
+    unit: Optional[str] = None,
+    typical: Optional[dict] = None,
+    period: Optional[dict] = None,
+    breakdown: Optional[Breakdown] = None,
+    stats: Optional[HourlyStats] = None,
+) -> List[Callable[[], bool]]:
+    """Render the report for each sink, returns the calls that send them.
+
+    `unit` labels the report when more than one unit is reported, `typical` are
+    the typical figures of the hour (see `core.baseline.typicalHour`), `period`
+    the week/month to date totals of the summary, `breakdown` the hours of
+    the day per line/article (see `core/breakdown.py`) and `stats` the running
+    figures of the day, counted from `prod_log` if not given.
+    """
 
-def main() -> None:
-    """Connect to SQL Server and execute the query to count rows.
+    calls = []
+    if not (prod_now.achieved >= settings.MIN_PRODUCTION and prod_log):
+        return calls
 
-    * Total number of queries to run: 3
+    # Send to webhooks
+    if stats is None or stats.count != len(prod_log):
+        stats = HourlyStats.from_log(prod_log)
+    average_production = stats.average
+    summary = None
+
+    if now.hour == settings.PRODUCTION_START_HOUR and len(prod_log) > 5:
+        summary = generateProductionSummary(prod_log, stats)
+        summary["period"] = period
+
+    if not (
+        prod_now.phour > settings.MIN_PRODUCTION
+        or (now.hour == settings.PRODUCTION_START_HOUR and len(prod_log) > 5)
+    ):
+        return calls
+
+    ranked = None
+    if breakdown:
+        # The hour, or every hour of the day kept for the summary
+        hours = (
+            list(breakdown)
+            if summary
+            else [prod_now.time - datetime.timedelta(hours=1)]
+        )
+        ranked = rankings(
+            breakdown, settings.BREAKDOWN_COLUMNS, hours, settings.BREAKDOWN_SIZE
+        )
+
+    # Hourly report, saved in outbox and all sinks are sent in parallel,
+    # sinks known to be unreachable are skipped (see `api/health.py`)
+    kind = "summary" if summary else "hourly"
+    if sinks.discord:
+        with metrics.stage("render", sink="discord", unit=unit):
+            embed = discord_template(
+                prod_now,
+                average_production,
+                summary,
+                unit,
+                typical,
+                ranked,
+                stats,
+            )
+        calls += [
+            partial(outbox.send, "discord", url, embed, kind) for url in sinks.discord
+        ]
+
+    if sinks.slack_token:
+        with metrics.stage("render", sink="slack_api", unit=unit):
+            contents = slack_api_template(
+                prod_now,
+                average_production,
+                summary,
+                unit,
+                typical,
+                ranked,
+                stats,
+            )
+        calls.append(
+            partial(outbox.send, "slack_api", sinks.slack_channel, contents, kind)
+        )
+
+    if sinks.slack:
+        with metrics.stage("render", sink="slack", unit=unit):
+            block = slack_template(
+                prod_now,
+                average_production,
+                summary,
+                unit,
+                typical,
+                ranked,
+                stats,
+            )
+        calls += [
+            partial(outbox.send, "slack", url, block, kind) for url in sinks.slack
+        ]
+
+    send_google = True
+    if settings.LOG_SUNDAY:
+        if (
+            now.weekday() == 6
+            and now.time() > datetime.time(settings.PRODUCTION_START_HOUR, 15)
+        ) or (now.weekday() == 0 and now.time() <= datetime.time(7, 59)):
+            # Not sending to google webhook on sunday
+            send_google = False
+
+    if send_google and sinks.google:
+        with metrics.stage("render", sink="google", unit=unit):
+            card = google_template(
+                prod_now,
+                average_production,
+                summary,
+                unit,
+                typical,
+                ranked,
+                stats,
+            )
+        calls += [
+            partial(outbox.send, "google", url, card, kind) for url in sinks.google
+        ]
+
+    return calls
+
+
+def main(pool: Optional[ConnectionPool] = None) -> None:
+    """Connect to SQL Server(s) and execute the query to count rows.
+
+    * Total number of queries to run: 1 per unit (`phour`, `achieved` and `fg`
+      aggregated), units are queried concurrently
     * Send results to Discord/Google webhook
+
+    Connections of an open `pool` are reused and left open (daemon mode),
+    otherwise they are made and closed within the run.
+    """
+
+    if not settings.UNITS:
+        return
+
+    with metrics.run():
+        now = datetime.datetime.now()
+
+        keep_connections = pool is not None
+        if not keep_connections:
+            pool = ConnectionPool(settings.MAX_CONNECTIONS)
+
+        try:
+            if len(settings.UNITS) == 1:
+                results = [collectProduction(settings.UNITS[0], pool, now)]
+            else:
+                with ThreadPoolExecutor(
+                    max_workers=settings.MAX_CONNECTIONS
+                ) as executor:
+                    results = list(
+                        executor.map(
+                            lambda u: collectProduction(u, pool, now), settings.UNITS
+                        )
+                    )
+        finally:
+            if not keep_connections:
+                pool.close()
+
+        multi_unit = len(settings.UNITS) > 1
+        with metrics.stage("state_load", name="history"):
+            histories = [
+                (
+                    loadHistory(result[0].date, settings.BASELINE_DAYS, unit.key)
+                    if result and settings.BASELINE_DAYS
+                    else None
+                )
+                for unit, result in zip(settings.UNITS, results)
+            ]
+            periods = [
+                (
+                    periodTotals(result[0].date, result[0].time, unit.key)
+                    if result and settings.PERIOD_TOTALS
+                    else None
+                )
+                for unit, result in zip(settings.UNITS, results)
+            ]
+        with metrics.stage("state_load", name="breakdown"):
+            breakdowns = [
+                (
+                    loadBreakdown(result[0].date, settings.BREAKDOWN_COLUMNS, unit.key)
+                    if result and settings.BREAKDOWN_COLUMNS
+                    else None
+                )
+                for unit, result in zip(settings.UNITS, results)
+            ]
+        with metrics.stage("state_load", name="stats"):
+            day_stats = [
+                loadHourlyStats(result[0].date, unit.key) if result else None
+                for unit, result in zip(settings.UNITS, results)
+            ]
+        calls = []
+        for unit, result, history, period, breakdown, stats in zip(
+            settings.UNITS, results, histories, periods, breakdowns, day_stats
+        ):
+            if result:
+                label = unit.alias if multi_unit else None
+                typical = None
+                if history is not None:
+                    typical = typicalHour(
+                        computeBaseline(history), result[0].phour_count
+                    )
+                calls += reportCalls(
+                    unit.sinks, *result, now, label, typical, period, breakdown, stats
+                )
+
+        if multi_unit and settings.COMBINED_REPORT:
+            if all(results):
+                prod_now, prod_log = combineProduction(results)
+                typical = None
+                if settings.BASELINE_DAYS:
+                    baseline = computeBaseline(combineHistories(histories))
+                    typical = typicalHour(baseline, prod_now.phour_count)
+                period = combineTotals(periods) if settings.PERIOD_TOTALS else None
+                calls += reportCalls(
+                    settings.SINKS,
+                    prod_now,
+                    prod_log,
+                    now,
+                    settings.COMBINED_ALIAS,
+                    typical,
+                    period,
+                    combineBreakdowns(breakdowns),
+                )
+            else:
+                logMessage(
+                    "Combined report skipped, not all units were queried.", "warning"
+                )
+
+        with metrics.stage("dispatch"):
+            dispatch(calls)
+
+
+def daemon() -> None:
+    """Stay resident and run `main()` at every HH:00:02 with warm connections.
+
+    `config.ini` is reloaded before a run if it was modified, the connections of
+    the units whose SQL Server did not change are kept.
     """
 
-    if not CONNECTION_STRING:
+    if not settings.UNITS:
         return
 
-    now = datetime.datetime.now()
-    query = f"select count(*) from {DATABASE_NAME}.[dbo].[tbl_ProductionScan] where [prod_date] between ? and ?"
-    query_fg = f"select count(*) from {DATABASE_NAME}.[dbo].[tbl_StorageScan] where [store_date] between ? and ?"
+    # Retry the undelivered reports between the hours
+    threading.Thread(target=outbox.drain_forever, daemon=True).start()
+    if settings.METRICS_ENABLED and settings.METRICS_PORT:
+        metrics.serveMetrics(settings.METRICS_PORT)
+
+    pool = ConnectionPool(settings.MAX_CONNECTIONS)
+    if settings.SNAPSHOT_PORT:
+        snapshot.serveSnapshot(pool, settings.SNAPSHOT_HOST, settings.SNAPSHOT_PORT)
+
+    def run() -> None:
+        settings.reload()
+        main(pool)
 
-    # Connecting SQL Server
     try:
-        conn = pyodbc.connect(CONNECTION_STRING)
-        if not conn:
-            raise ConnectionError("Failed to connect SQL Server.")
-        cursor = conn.cursor()
-    except ConnectionError:
-        logMessage("Failed to connect SQL Server")
+        runHourly(run, offset_seconds=2)
+    finally:
+        pool.close()
+
+
+def reloadedUnit(key: str) -> Optional[Unit]:
+    """The unit `key` after reloading `config.ini` if modified, `None` if removed."""
+
+    settings.reload()
+    return next((unit for unit in settings.UNITS if unit.key == key), None)
+
+
+def unitLabel(unit: Unit) -> Optional[str]:
+    """Alias shown in the messages of the unit, when several units are configured."""
+
+    return unit.alias if len(settings.UNITS) > 1 else None
+
+
+def runUnits(
+    target: Callable[[Unit, ConnectionPool], None],
+    wanted: Callable[[Unit], bool],
+    pool: ConnectionPool,
+    interval: float = 60,
+) -> None:
+    """Run `target` in a thread for every wanted unit, forever.
+
+    `config.ini` is reloaded every `interval` seconds if modified: added units
+    get their thread, a thread that ended (unit removed) is started again if its
+    unit is back.
+    """
+
+    threads: Dict[str, threading.Thread] = {}
+    while True:
+        settings.reload()
+        for unit in settings.UNITS:
+            thread = threads.get(unit.key)
+            if wanted(unit) and (thread is None or not thread.is_alive()):
+                thread = threading.Thread(target=target, args=(unit, pool), daemon=True)
+                thread.start()
+                threads[unit.key] = thread
+        time.sleep(interval)
+
+
+def liveUnit(unit: Unit, pool: ConnectionPool) -> None:
+    """Keep the live message of the unit updated, until the unit is removed.
+
+    Only the latest scan time is polled; the counts are queried and the message
+    is edited only when new scans arrived, at most once every
+    `LIVE_MIN_UPDATE_SECONDS`. While no scans arrive the polling interval is
+    doubled upto `LIVE_MAX_POLL_SECONDS`. `config.ini` is reloaded at every poll
+    if modified, the new sinks and SQL Server of the unit are used from there.
+    """
+
+    board = LiveBoard(unit.key, unit.sinks)
+    interval = settings.LIVE_POLL_SECONDS
+    last_marker = None
+    last_update = 0.0
+
+    while True:
+        current = reloadedUnit(unit.key)
+        if current != unit:
+            if current is None:
+                return
+            if current.sinks != unit.sinks:
+                board = LiveBoard(current.key, current.sinks)
+                if not board:
+                    return
+            # Counted again, the SQL Server may have changed
+            unit, last_marker = current, None
+
+        now = datetime.datetime.now()
+        start_date, end_date = getDailyProductionDate(now)
+        counts = None
+
+        with pool.connection(unit.key, unit.connection_string, unit.database) as source:
+            try:
+                source.open()
+                marker = fetchChangeMarker(source, start_date)
+                if not any(marker) or marker == last_marker:
+                    # Idle, nothing to query or edit
+                    interval = min(interval * 2, settings.LIVE_MAX_POLL_SECONDS)
+                else:
+                    interval = settings.LIVE_POLL_SECONDS
+                    if (
+                        time.monotonic() - last_update
+                        >= settings.LIVE_MIN_UPDATE_SECONDS
+                    ):
+                        counts = fetchCounts(
+                            source,
+                            liveMeasures(start_date, now, settings.LIVE_RATE_MINUTES),
+                        )
+                        last_marker = marker
+            except Exception as e:
+                source.invalidate()
+                logMessage(f"Live update of {unit.alias} failed.\n{e}", unit=unit.key)
+                interval = settings.LIVE_MAX_POLL_SECONDS
+
+        if counts:
+            prod = Production(
+                date=start_date,
+                time=now,
+                achieved=counts["achieved"],
+                fg=counts["fg"],
+                phour=counts["phour"],
+            )
+            minutes = max((now - start_date).total_seconds() / 60, 1)
+            rate = prod.achieved / minutes
+            recent_rate = counts["recent"] / settings.LIVE_RATE_MINUTES
+            label = unitLabel(unit)
+            board.publish(
+                start_date,
+                live_discord_template(prod, rate, recent_rate, label),
+                live_slack_template(prod, rate, recent_rate, label),
+            )
+            last_update = time.monotonic()
+
+        time.sleep(interval)
+
+
+def live() -> None:
+    """Keep one message per production day updated for every unit."""
+
+    def wanted(unit: Unit) -> bool:
+        return bool(LiveBoard(unit.key, unit.sinks))
+
+    if not any(wanted(unit) for unit in settings.UNITS):
+        logMessage("Live mode needs a Slack app or Discord webhook.")
         return
-    except Exception as e:
-        logMessage(f"Connection to server failed.\n{e}")
+
+    pool = ConnectionPool(settings.MAX_CONNECTIONS)
+    if settings.SNAPSHOT_PORT:
+        snapshot.serveSnapshot(pool, settings.SNAPSHOT_HOST, settings.SNAPSHOT_PORT)
+    try:
+        runUnits(liveUnit, wanted, pool)
+    finally:
+        pool.close()
+
+
+def stallCalls(
+    sinks: Sinks, event: StallEvent, unit: Optional[str] = None
+) -> List[Callable[[], bool]]:
+    """Render the stall alert (or recovery) for each sink, returns the calls."""
+
+    calls = [
+        partial(
+            outbox.send, "discord", url, stall_discord_template(event, unit), "alert"
+        )
+        for url in sinks.discord
+    ]
+    msg = stall_slack_template(event, unit)
+    calls += [partial(outbox.send, "slack", url, msg, "alert") for url in sinks.slack]
+    if sinks.slack_token:
+        calls.append(
+            partial(outbox.send, "slack_api", sinks.slack_channel, msg, "alert")
+        )
+    card = stall_google_template(event, unit)
+    calls += [
+        partial(outbox.send, "google", url, card, "alert") for url in sinks.google
+    ]
+    return calls
+
+
+def watchUnit(unit: Unit, pool: ConnectionPool) -> None:
+    """Count the scans of every minute of the unit and alert on a stall.
+
+    Minutes outside the production hours are not queried; a stall still open
+    when they end is dropped without recovery message. `config.ini` is reloaded
+    every minute if modified; the stall state starts over if the SQL Server of
+    the unit or `WATCHDOG_MINUTES` changed, and it ends once the unit is removed
+    or has no sink left.
+    """
+
+    watchdog = Watchdog()
+
+    while True:
+        # Counted once closed, its scans given a few seconds to be saved
+        minute = datetime.datetime.now().replace(second=0, microsecond=0)
+        tick = minute + datetime.timedelta(minutes=1, seconds=5)
+        time.sleep(max((tick - datetime.datetime.now()).total_seconds(), 0))
+
+        current = reloadedUnit(unit.key)
+        if current is None or not current.sinks:
+            return
+        if (current.connection_string, current.database) != (
+            unit.connection_string,
+            unit.database,
+        ) or watchdog.ring.size != settings.WATCHDOG_MINUTES:
+            watchdog = Watchdog()
+        unit = current
+
+        if not isWatched(minute):
+            watchdog.reset()
+            continue
+
+        with pool.connection(unit.key, unit.connection_string, unit.database) as source:
+            try:
+                count = fetchMinuteCount(source, minute)
+            except Exception as e:
+                # Minute left uncounted, an outage is not taken for a stall
+                source.invalidate()
+                logMessage(f"Watchdog of {unit.alias} failed.\n{e}", unit=unit.key)
+                continue
+
+        event = watchdog.update(minute, count)
+        if event:
+            logMessage(
+                f"{unit.alias} {event.kind} at {event.minute:%H:%M}.",
+                "warning",
+                unit=unit.key,
+            )
+            dispatch(stallCalls(unit.sinks, event, unitLabel(unit)))
+
+
+def watch() -> None:
+    """Watch every unit for stalled lines."""
+
+    def wanted(unit: Unit) -> bool:
+        return bool(unit.sinks)
+
+    if not any(wanted(unit) for unit in settings.UNITS):
+        logMessage("Watch mode needs at least one sink.")
         return
 
-    start_date, end_date = getDailyProductionDate(now)
+    # Alerts not delivered right away are retried
+    threading.Thread(target=outbox.drain_forever, daemon=True).start()
+    pool = ConnectionPool(settings.MAX_CONNECTIONS)
+    try:
+        runUnits(watchUnit, wanted, pool)
+    finally:
+        pool.close()
 
-    hourly_edate = now.replace(minute=0, second=0, microsecond=0)
-    hourly_sdate = hourly_edate - datetime.timedelta(hours=1)
 
-    if now.hour == 9:
-        prod_log = {}
-    else:
-        prod_log = loadHourlyProductionLog()
-        if len(prod_log) > 0:
-            min_time = min(prod_log.keys())
-            if now.date() != min_time.date():
-                if now.hour > PRODUCTION_START_HOUR or (
-                    min_time.date() < now.date() - datetime.timedelta(days=1)
-                ):
-                    prod_log = {}
-            else:
-                if (
-                    min_time.hour <= PRODUCTION_START_HOUR
-                    and now.hour > PRODUCTION_START_HOUR
-                ):
-                    prod_log = {}
-
-    prod_now = Production(time=hourly_edate, date=start_date)
-    # Query execution
+def export(first_day: str, last_day: str, path: str, daily: bool = False) -> None:
+    """Write the production of the days `first_day` to `last_day` (YYYY-MM-DD).
+
+    Hourly rows (or daily with `daily`) of every unit, upto the last closed hour.
+    """
+
     try:
-        # Current hour production
-        qresult_hour = cursor.execute(query, hourly_sdate, hourly_edate)
-        prod_now.phour = qresult_hour.fetchone()[0]
-        # Production upto this hour
-        qresult_cur = cursor.execute(query, start_date, hourly_edate)
-        prod_now.achieved = qresult_cur.fetchone()[0]
-        # FG production upto this hour
-        qresult_fg = cursor.execute(query_fg, start_date, hourly_edate)
-        prod_now.fg = qresult_fg.fetchone()[0]
-
-        prod_log[hourly_edate] = prod_now
-        saveHourlyProductionLog(prod_log)
-
-        cursor.close()
-        conn.close()
-        network_connection_test = socket.create_connection(("1.1.1.1", 53))
-
-    except OSError:
-        # Internet connection is not available
-        # Cannot send to webhooks
+        start = datetime.datetime.combine(
+            datetime.date.fromisoformat(first_day),
+            datetime.time(settings.PRODUCTION_START_HOUR),
+        )
+        end = datetime.datetime.combine(
+            datetime.date.fromisoformat(last_day) + datetime.timedelta(days=1),
+            datetime.time(settings.PRODUCTION_START_HOUR),
+        )
+    except ValueError as e:
+        logMessage(f"Export dates must be YYYY-MM-DD.\n{e}")
         return
-
-    except Exception as e:
-        logMessage(f"Query execution failed.\n{e}")
+    end = min(end, datetime.datetime.now().replace(minute=0, second=0, microsecond=0))
+    if end <= start:
+        logMessage("Nothing to export, the range has no closed hour.", "warning")
         return
 
-    if prod_now.achieved >= MIN_PRODUCTION and prod_log:
-        # Send to webhooks
-        average_production = averageHourlyProduction(prod_log.values())
-        summary = None
+    pool = ConnectionPool(settings.MAX_CONNECTIONS)
 
-        if now.hour == PRODUCTION_START_HOUR and len(prod_log) > 5:
-            summary = generateProductionSummary(prod_log)
+    def chunks() -> Iterator[Chunk]:
+        for unit in settings.UNITS:
+            with pool.connection(
+                unit.key, unit.connection_string, unit.database
+            ) as source:
+                yield from hourlyChunks(
+                    source, start, end, unit.key, settings.HOURLY_ROLLUP
+                )
 
-        if prod_now.phour > MIN_PRODUCTION or (
-            now.hour == PRODUCTION_START_HOUR and len(prod_log) > 5
-        ):
-            # Hourly report
-            if DISCORD_WH:
-                embed = discord_template(prod_now, average_production, summary)
-                webhook_request(DISCORD_WH, embed, "discord")
-
-            if SLACK_APP_TOKEN:
-                contents = slack_api_template(prod_now, average_production, summary)
-                slack_api(SLACK_APP_TOKEN, SLACK_CHANNEL_ID, **contents)
-
-            if SLACK_WH:
-                block = slack_template(prod_now, average_production, summary)
-                webhook_request(SLACK_WH, block, "slack")
-            if LOG_SUNDAY:
-                if not (
-                    now.weekday() == 6
-                    and now.time() > datetime.time(PRODUCTION_START_HOUR, 15)
-                ):
-                    if not (now.weekday() == 0 and now.time() <= datetime.time(7, 59)):
-                        # If not sunday, send to google webhook
-                        if GOOGLE_WH:
-                            card = google_template(
-                                prod_now, average_production, summary
-                            )
-                            webhook_request(GOOGLE_WH, card, "google")
-            else:
-                if GOOGLE_WH:
-                    card = google_template(prod_now, average_production, summary)
-                    webhook_request(GOOGLE_WH, card, "google")
+    try:
+        if daily:
+            count = exportProduction(dailyChunks(chunks()), path, DAILY_FIELDS)
+        else:
+            count = exportProduction(chunks(), path, HOURLY_FIELDS)
+    finally:
+        pool.close()
+    if count >= 0:
+        logMessage(f"Exported {count} rows to {path}.", "info")
+
+
+def serve() -> None:
+    """Only answer the snapshot endpoint, forever."""
+
+    if not settings.SNAPSHOT_PORT:
+        logMessage("Serve mode needs a [SNAPSHOT] PORT.")
+        return
+
+    pool = ConnectionPool(settings.MAX_CONNECTIONS)
+    snapshot.serveSnapshot(pool, settings.SNAPSHOT_HOST, settings.SNAPSHOT_PORT)
+    try:
+        while True:
+            time.sleep(3600)
+    finally:
+        pool.close()
 
 
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description="Hourly production report.")
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="stay resident and report at every hour instead of a single run",
+    )
+    parser.add_argument(
+        "--live",
+        action="store_true",
+        help="stay resident and keep a live message of the day updated",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="stay resident and alert as soon as a line stalls",
+    )
+    parser.add_argument(
+        "--export",
+        nargs=2,
+        metavar=("FIRST_DAY", "LAST_DAY"),
+        help="write the hourly production of the days (YYYY-MM-DD) to --output",
+    )
+    parser.add_argument(
+        "--output",
+        default="production.csv",
+        help="export file, .csv or .parquet (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--daily",
+        action="store_true",
+        help="export one row per production day instead of per hour",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="stay resident and only serve the production snapshot as json",
+    )
+    args = parser.parse_args()
+
+    one_shot = not (args.export or args.live or args.watch or args.serve or args.daemon)
+
     # ToDo: Remove try-catch expression here
     try:
-        main()
+        if one_shot:
+            # Flushed with the run
+            with metrics.stage("config"):
+                settings.load()
+        else:
+            with metrics.background("startup"), metrics.stage("config"):
+                settings.load()
+        if args.export:
+            export(*args.export, args.output, args.daily)
+        elif args.live:
+            live()
+        elif args.watch:
+            watch()
+        elif args.serve:
+            serve()
+        elif args.daemon:
+            daemon()
+        else:
+            main()
+            # Undelivered reports of previous runs, after this hour's report
+            with metrics.background("drain"):
+                outbox.drain()
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
         logMessage(f"Main program execution failed.\n{e}")
@@ -0,0 +1,103 @@
+"""
+Circuit breaker of a destination, driven by the results of the sends.
+
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from api import health
+
+SINK = "webhook"
+URL = "https://hooks.example.com/T1/B1/token"
+
+
+class BreakerTest(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.now = 1_000_000.0
+        self.up = True
+        self.probes = 0
+
+        def probe(host, port):
+            self.probes += 1
+            return self.up
+
+        for patcher in (
+            mock.patch.object(health, "HEALTH_FILE", folder.name + os.sep + "h.json"),
+            mock.patch.object(health, "_state", None),
+            mock.patch.object(health, "probe", probe),
+            mock.patch.object(health.time, "time", lambda: self.now),
+            mock.patch.object(health, "logMessage", lambda *a, **k: None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def fail(self, times: int) -> None:
+        for _ in range(times):
+            health.record_result(SINK, URL, False)
+
+    def state(self) -> str:
+        return health._entry(SINK, URL)["state"]
+
+    def test_opens_after_threshold(self):
+        self.fail(health.FAILURE_THRESHOLD - 1)
+        self.assertEqual(self.state(), health.CLOSED)
+        self.assertTrue(health.is_available(SINK, URL))
+
+        self.fail(1)
+        self.assertEqual(self.state(), health.OPEN)
+        self.assertFalse(health.is_available(SINK, URL))
+
+    def test_probe_does_not_reset_failures(self):
+        # Host accepts connections but the sends fail, e.g. 5xx
+        for _ in range(health.FAILURE_THRESHOLD):
+            self.now += health.CACHE_TTL + 1
+            self.assertTrue(health.is_available(SINK, URL))
+            self.fail(1)
+        self.assertEqual(self.state(), health.OPEN)
+
+    def test_half_open_single_trial_then_close(self):
+        self.fail(health.FAILURE_THRESHOLD)
+        self.now += health.OPEN_SECONDS
+
+        self.assertTrue(health.is_available(SINK, URL))
+        self.assertEqual(self.state(), health.HALF_OPEN)
+        self.assertFalse(health.is_available(SINK, URL))
+        self.assertEqual(self.probes, 1)
+
+        health.record_result(SINK, URL, True)
+        self.assertEqual(self.state(), health.CLOSED)
+        self.assertEqual(health._entry(SINK, URL)["failures"], 0)
+        self.assertTrue(health.is_available(SINK, URL))
+
+    def test_half_open_failure_reopens(self):
+        self.fail(health.FAILURE_THRESHOLD)
+        self.now += health.OPEN_SECONDS
+        self.assertTrue(health.is_available(SINK, URL))
+
+        self.fail(1)
+        self.assertEqual(self.state(), health.OPEN)
+        self.now += health.OPEN_SECONDS - 1
+        self.assertFalse(health.is_available(SINK, URL))
+
+    def test_unclaimed_trial_expires(self):
+        self.fail(health.FAILURE_THRESHOLD)
+        self.now += health.OPEN_SECONDS
+        self.assertTrue(health.is_available(SINK, URL))
+
+        self.now += health.TRIAL_SECONDS
+        self.assertTrue(health.is_available(SINK, URL))
+        self.assertEqual(self.probes, 2)
+
+    def test_destinations_are_independent(self):
+        self.fail(health.FAILURE_THRESHOLD)
+        self.assertFalse(health.is_available(SINK, URL))
+        self.assertTrue(health.is_available(SINK, URL + "2"))
+
+
+if __name__ == "__main__":
+    unittest.main()
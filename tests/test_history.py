@@ -0,0 +1,88 @@
+"""
+Range totals of the columnar history, across gaps and past the filled hours.
+
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from core import history
+
+
+class RangeTotalTest(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        patcher = mock.patch.object(
+            history, "stateDir", lambda unit="": folder.name + os.sep
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.phour = np.zeros(history.GROW_HOURS * 2, np.int64)
+        self.filled = np.zeros(len(self.phour), bool)
+
+    def write(self, start: int, values) -> None:
+        values = np.asarray(values, np.int64)
+        end = start + len(values)
+        with history._columns("", end) as columns:
+            history._write(columns, start, {"phour": values, "fg": values * 2})
+        self.phour[start:end] = values
+        self.filled[start:end] = True
+
+    def assertTotals(self, ranges) -> None:
+        with history._columns("") as columns:
+            for start, end in ranges:
+                expected = int(self.phour[start:end].sum())
+                self.assertEqual(
+                    history._total(columns, "phour", start, end),
+                    expected,
+                    (start, end),
+                )
+                self.assertEqual(
+                    history._total(columns, "fg", start, end), 2 * expected
+                )
+
+    def test_gap_between_filled_hours(self):
+        self.write(10, [1, 2, 3])
+        self.write(40, [4, 5])
+        self.assertTotals([(0, 100), (11, 41), (13, 40), (20, 30), (12, 42)])
+
+    def test_past_the_last_filled_hour(self):
+        self.write(5, [7, 8])
+        # Preallocated tail of the columns, never written
+        self.assertTotals([(0, history.GROW_HOURS), (6, 500), (7, 500), (500, 900)])
+
+    def test_rewrite_and_growth(self):
+        self.write(100, [1] * 50)
+        self.write(history.GROW_HOURS + 10, [3, 3])
+        self.write(120, [9] * 5)
+        self.write(0, [2] * 10)
+        self.assertTotals(
+            [
+                (0, len(self.phour)),
+                (105, 125),
+                (149, history.GROW_HOURS + 11),
+                (history.GROW_HOURS + 11, history.GROW_HOURS + 20),
+            ]
+        )
+
+    def test_end_is_kept(self):
+        self.write(30, [1, 1])
+        with history._columns("") as columns:
+            self.assertEqual(history._validEnd(columns), 32)
+        self.write(3, [1])
+        with history._columns("") as columns:
+            self.assertEqual(history._validEnd(columns), 32)
+
+    def test_end_found_for_older_history(self):
+        self.write(30, [1, 1])
+        os.remove(history._historyDir("") + history.END)
+        self.assertTotals([(0, 100), (31, 40)])
+
+
+if __name__ == "__main__":
+    unittest.main()
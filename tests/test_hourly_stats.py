@@ -0,0 +1,91 @@
+"""
+Running hourly stats, kept with the hourly store, against a full recount.
+
+"""
+
+import datetime
+import os
+import random
+import statistics
+import tempfile
+import unittest
+from unittest import mock
+
+from core import store
+from core.production import HourlyStats, Production
+
+DAY = datetime.datetime(2026, 10, 14, 6)
+
+
+def production(hour: int, phour: int, backfilled: bool = False) -> Production:
+    return Production(
+        date=DAY,
+        time=DAY + datetime.timedelta(hours=hour),
+        achieved=phour * hour,
+        fg=phour // 2,
+        phour=phour,
+        backfilled=backfilled,
+    )
+
+
+class HourlyStatsTest(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        patcher = mock.patch.object(
+            store, "stateDir", lambda unit="": folder.name + os.sep
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertRecounted(self, stats: HourlyStats, hours) -> None:
+        hours = sorted(hours, key=lambda p: p.time)
+        phours = [p.phour for p in hours]
+        top = max(phours)
+
+        self.assertEqual(stats.count, len(hours))
+        self.assertEqual(stats.total, sum(phours))
+        self.assertAlmostEqual(stats.mean, statistics.mean(phours))
+        self.assertAlmostEqual(stats.std, statistics.stdev(phours))
+        self.assertEqual((stats.min, stats.max), (min(phours), top))
+        self.assertEqual(stats.top_time, hours[phours.index(top)].time)
+        self.assertEqual(stats.last_time, hours[-1].time)
+        self.assertEqual((stats.achieved, stats.fg), (hours[-1].achieved, hours[-1].fg))
+
+    def test_added_hours(self):
+        rng = random.Random(4)
+        hours = [production(h, rng.randrange(0, 500)) for h in range(1, 24)]
+        stats = HourlyStats()
+        for prod in hours:
+            stats.add(prod)
+        self.assertRecounted(stats, hours)
+
+    def test_store_appends_and_backfill(self):
+        rng = random.Random(11)
+        hours = {}
+        for h in list(range(1, 8)) + list(range(10, 16)):
+            prod = production(h, rng.choice([0, 120, 300, 300, 480]))
+            store.appendHourlyProductionLog(prod)
+            hours[prod.time] = prod
+        self.assertRecounted(store.loadHourlyStats(DAY), hours.values())
+
+        # Missed hours then a replaced hour, the day is recounted
+        backfilled = [production(h, rng.randrange(500), True) for h in (8, 9)]
+        store.mergeHourlyProductionLog(backfilled)
+        replaced = production(12, 999)
+        store.appendHourlyProductionLog(replaced)
+        for prod in backfilled + [replaced]:
+            hours[prod.time] = prod
+        store.appendHourlyProductionLog(production(16, 7))
+        hours[production(16, 7).time] = production(16, 7)
+
+        stats = store.loadHourlyStats(DAY)
+        self.assertRecounted(stats, hours.values())
+        self.assertEqual(
+            stats.to_tuple(),
+            HourlyStats.from_log(store.loadHourlyProductionLog(DAY)).to_tuple(),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+Retries of the outbox: hourly reports collapsed, stale and old entries dropped.
+
+"""
+
+import datetime
+import glob
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from api import outbox
+from api.web_api import SendResult
+
+NOW = datetime.datetime(2026, 10, 14, 10, 30)
+
+
+class DrainTest(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.sent = []
+        self.now = NOW
+
+        def send(entry):
+            self.sent.append(entry["payload"]["text"])
+            return SendResult(True, 200)
+
+        for patcher in (
+            mock.patch.object(outbox, "OUTBOX_DIR", folder.name + os.sep),
+            mock.patch.object(outbox, "_now", lambda: self.now),
+            mock.patch.object(outbox, "_send", send),
+            mock.patch.object(outbox, "logMessage", lambda *a, **k: None),
+            mock.patch.object(outbox.health, "is_available", lambda s, u: True),
+            mock.patch.object(outbox.health, "record_result", lambda s, u, ok: None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def enqueue(self, text: str, minutes_ago: float, kind="hourly", url="u1"):
+        self.now = NOW - datetime.timedelta(minutes=minutes_ago)
+        outbox.enqueue("slack", url, {"text": text}, kind)
+        self.now = NOW
+
+    def left(self):
+        return glob.glob(outbox.OUTBOX_DIR + "*")
+
+    def test_hourly_collapsed_into_newest(self):
+        self.enqueue("first", 20)
+        self.enqueue("summary", 15, "summary")
+        self.enqueue("second", 10)
+        self.enqueue("other", 5, url="u2")
+
+        self.assertEqual(outbox.drain(), 3)
+        self.assertEqual(sorted(self.sent), ["other", "second", "summary"])
+        self.assertEqual(self.left(), [])
+
+    def test_hourly_of_an_earlier_hour_dropped(self):
+        self.enqueue("last hour", 40)
+        self.enqueue("yesterday", 60 * 20)
+        self.enqueue("alert", 40, "alert")
+
+        self.assertEqual(outbox.drain(), 1)
+        self.assertEqual(self.sent, ["alert"])
+        self.assertEqual(self.left(), [])
+
+    def test_max_age_cutoff(self):
+        age = outbox.MAX_AGE.total_seconds() / 60
+        self.enqueue("too old", age + 1, "summary")
+        self.enqueue("kept", age - 1, "summary")
+
+        self.assertEqual(outbox.drain(), 1)
+        self.assertEqual(self.sent, ["kept"])
+        self.assertEqual(self.left(), [])
+
+    def test_not_due_kept(self):
+        self.enqueue("summary", 5, "summary")
+        path, entry = outbox._entries()[0]
+        entry["next_attempt"] = (NOW + datetime.timedelta(minutes=1)).isoformat()
+        outbox.writeFileAtomic(path, outbox._encode(entry))
+
+        self.assertEqual(outbox.drain(), 0)
+        self.assertEqual(self.sent, [])
+        self.assertEqual(self.left(), [path])
+
+
+if __name__ == "__main__":
+    unittest.main()
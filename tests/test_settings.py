@@ -0,0 +1,76 @@
+"""
+Reload of `config.ini`: a file with invalid values is not applied.
+
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from core import settings
+
+REPO_CONFIG = os.path.join(os.path.dirname(os.path.dirname(__file__)), "config.ini")
+
+
+class ReloadTest(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.path = os.path.join(folder.name, "config.ini")
+        shutil.copy(REPO_CONFIG, self.path)
+        self.errors = []
+
+        for patcher in (
+            mock.patch.object(settings, "ROOT", folder.name + os.sep),
+            mock.patch.object(settings, "CONFIG_FILE", self.path),
+            mock.patch.object(settings, "_current", settings.Config()),
+            mock.patch.object(settings, "_mtime", None),
+            mock.patch.object(settings, "setLogLevel", lambda level: None),
+            mock.patch.object(
+                settings, "logMessage", lambda msg, *a, **k: self.errors.append(msg)
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        settings.load()
+        self.errors.clear()
+
+    def edit(self, key: str, value: str, mtime: int) -> None:
+        with open(self.path) as f:
+            lines = f.read().splitlines()
+        lines = [f"{key} = {value}" if l.startswith(key) else l for l in lines]
+        with open(self.path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.utime(self.path, ns=(mtime, mtime))
+
+    def test_invalid_file_not_applied(self):
+        loaded = settings.current()
+        self.edit("BASELINE_DAYS", "-1", 10**18)
+
+        self.assertFalse(settings.reload())
+        self.assertIs(settings.current(), loaded)
+        self.assertTrue(any("BASELINE_DAYS" in error for error in self.errors))
+
+        # Not retried until the file is modified again
+        self.errors.clear()
+        self.assertFalse(settings.reload())
+        self.assertEqual(self.errors, [])
+
+    def test_fixed_file_applied(self):
+        self.edit("BASELINE_DAYS", "many", 10**18)
+        self.assertFalse(settings.reload())
+
+        self.edit("BASELINE_DAYS", "7", 10**18 + 1)
+        self.assertTrue(settings.reload())
+        self.assertEqual(settings.BASELINE_DAYS, 7)
+
+    def test_unmodified_file_not_read(self):
+        with mock.patch.object(settings, "parseConfig") as parse:
+            self.assertFalse(settings.reload())
+        parse.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+"""
+Stall alerts posted with the Slack app are not deleted by the summary cleanup.
+
+"""
+
+import datetime
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from api import outbox, slack
+from api.templates import stall_slack_template
+from core.watchdog import STALLED, StallEvent
+
+
+class StallAlertCleanupTest(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        root = folder.name + os.sep
+        for name, value in (
+            ("ROOT", root),
+            ("TS_FILE", root + "slack_ts.json"),
+            ("LEGACY_TS_FILES", ()),
+        ):
+            patcher = mock.patch.object(slack, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.posted = 0
+        self.deleted = []
+
+        def call(token, method, **kwargs):
+            if method == "chat_delete":
+                self.deleted.append(kwargs["ts"])
+                return SimpleNamespace(data={}, status_code=200)
+            self.posted += 1
+            return SimpleNamespace(data={"ts": f"ts{self.posted}"}, status_code=200)
+
+        for patcher in (
+            mock.patch.object(slack, "call", call),
+            mock.patch.object(outbox, "slackToken", lambda channel: "token"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def send(self, payload: dict, kind: str) -> str:
+        entry = {"sink": "slack_api", "url": "C1", "payload": payload, "kind": kind}
+        self.assertTrue(outbox._send(entry).ok)
+        return f"ts{self.posted}"
+
+    def test_stall_alert_survives_cleanup(self):
+        minute = datetime.datetime(2026, 10, 14, 10, 30)
+        event = StallEvent(STALLED, minute, minute, 0)
+        hourly = self.send({"text": "hourly", "blocks": []}, "hourly")
+        alert = self.send(stall_slack_template(event), "alert")
+
+        slack.cleanup("token", "C1")
+
+        self.assertEqual(self.deleted, [hourly])
+        self.assertNotIn(alert, self.deleted)
+
+
+if __name__ == "__main__":
+    unittest.main()